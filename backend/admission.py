@@ -0,0 +1,209 @@
+"""Admission control for /api/chat.
+
+Every chat turn that will reach the LLM must first be admitted. Optionally
+(CHAT_CLIENT_RATE) each client, by address, has a token bucket, and a client
+over its rate is refused at once with 429. Admitted turns are then capped by a global rate bucket and a
+concurrency limit. A turn that can't start immediately waits in a bounded
+priority queue, where turns of conversations already under way go ahead of
+new ones. A full queue, or a wait past QUEUE_TIMEOUT, is answered with 503.
+Both refusals carry Retry-After. Limits are per server process.
+"""
+import asyncio
+import heapq
+import itertools
+import math
+import os
+import time
+from collections import OrderedDict
+
+# Chat turns being answered at once.
+MAX_ACTIVE = int(os.environ.get("CHAT_MAX_ACTIVE", os.environ.get("LLM_MAX_CONCURRENCY", "64")))
+# Turns waiting to start; more are refused.
+QUEUE_SIZE = int(os.environ.get("CHAT_QUEUE_SIZE", "128"))
+# Seconds a turn may wait to start before it is refused.
+QUEUE_TIMEOUT = float(os.environ.get("CHAT_QUEUE_TIMEOUT", "10"))
+# Turns started per second across all clients, with bursts up to RATE_BURST; 0 disables.
+RATE = float(os.environ.get("CHAT_RATE", "20"))
+RATE_BURST = float(os.environ.get("CHAT_RATE_BURST", "40"))
+# Turns per second per client, with bursts up to CLIENT_BURST; 0 disables.
+# Off by default: clients are told apart by the connection's address, which
+# behind a proxy is the proxy's, so every user would share one bucket. Enable
+# it only where that address is the client's, e.g. with uvicorn's
+# --proxy-headers and --forwarded-allow-ips set to the trusted proxies.
+CLIENT_RATE = float(os.environ.get("CHAT_CLIENT_RATE", "0"))
+CLIENT_BURST = float(os.environ.get("CHAT_CLIENT_BURST", "20"))
+# Client buckets kept; the least recently seen are dropped beyond this.
+MAX_CLIENTS = 10_000
+
+# Queue priorities: lower goes first.
+IN_PROGRESS = 0
+NEW = 1
+
+
+class Rejected(Exception):
+    def __init__(self, status_code: int, detail: str, retry_after: float):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+        self.retry_after = retry_after
+
+    @property
+    def headers(self) -> dict:
+        return {"Retry-After": str(max(1, math.ceil(self.retry_after)))}
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def take(self) -> float:
+        """Take a token; returns 0 on success, else seconds until one is available."""
+        if self.rate <= 0:
+            return 0.0
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+
+class Ticket:
+    """An admitted turn's slot; release() is idempotent."""
+
+    def __init__(self, admission: "Admission"):
+        self._admission = admission
+        self._released = False
+
+    def release(self) -> None:
+        if not self._released:
+            self._released = True
+            self._admission._release()
+
+
+class Admission:
+    def __init__(
+        self,
+        max_active: int = MAX_ACTIVE,
+        queue_size: int = QUEUE_SIZE,
+        queue_timeout: float = QUEUE_TIMEOUT,
+        rate: float = RATE,
+        rate_burst: float = RATE_BURST,
+        client_rate: float = CLIENT_RATE,
+        client_burst: float = CLIENT_BURST,
+    ):
+        self.max_active = max_active
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        self.client_rate = client_rate
+        self.client_burst = client_burst
+        self._global = TokenBucket(rate, rate_burst)
+        self._clients: OrderedDict[str, TokenBucket] = OrderedDict()
+        # [priority, sequence, future] entries; futures resolve on admission.
+        self._queue: list[list] = []
+        self._sequence = itertools.count()
+        self._timer: asyncio.TimerHandle | None = None
+        self.active = 0
+        self.admitted = 0
+        self.rejected = {"client_rate": 0, "queue_full": 0, "queue_timeout": 0}
+
+    def check_client(self, client: str) -> None:
+        """Charge one turn to client's bucket, raising Rejected (429) if it is empty."""
+        if self.client_rate <= 0:
+            return
+        bucket = self._clients.pop(client, None) or TokenBucket(self.client_rate, self.client_burst)
+        self._clients[client] = bucket
+        if len(self._clients) > MAX_CLIENTS:
+            self._clients.popitem(last=False)
+        wait = bucket.take()
+        if wait:
+            self.rejected["client_rate"] += 1
+            raise Rejected(429, "Too many chat requests; slow down", wait)
+
+    async def acquire(self, priority: int = NEW) -> Ticket:
+        """Wait for a slot, raising Rejected (503) if the queue is full or the wait too long."""
+        if not self._queue and self.active < self.max_active and not self._global.take():
+            return self._admit()
+
+        if len(self._queue) >= self.queue_size:
+            # A full queue makes room for an in-progress turn by refusing the newest new one.
+            worst = max(self._queue, key=lambda entry: (entry[0], entry[1]))
+            if worst[0] <= priority:
+                self.rejected["queue_full"] += 1
+                raise Rejected(503, "Server busy; try again shortly", self.queue_timeout)
+            self._remove(worst)
+            self.rejected["queue_full"] += 1
+            worst[2].set_exception(Rejected(503, "Server busy; try again shortly", self.queue_timeout))
+
+        future = asyncio.get_running_loop().create_future()
+        entry = [priority, next(self._sequence), future]
+        heapq.heappush(self._queue, entry)
+        self._dispatch()
+        try:
+            await asyncio.wait_for(asyncio.shield(future), self.queue_timeout)
+        except TimeoutError:
+            if not future.done():
+                self._remove(entry)
+                future.cancel()
+                self.rejected["queue_timeout"] += 1
+                raise Rejected(503, "Server busy; try again shortly", self.queue_timeout) from None
+        except asyncio.CancelledError:
+            # The client went away while queued: give back a slot it was just granted.
+            if future.done() and not future.cancelled() and future.exception() is None:
+                self._release()
+            elif not future.done():
+                self._remove(entry)
+                future.cancel()
+            raise
+        future.result()  # raises Rejected if a higher-priority turn took its place
+        return Ticket(self)
+
+    def snapshot(self) -> dict:
+        return {
+            "max_active": self.max_active,
+            "active": self.active,
+            "queue_size": self.queue_size,
+            "queue_depth": len(self._queue),
+            "queue_timeout": self.queue_timeout,
+            "rate": self._global.rate,
+            "rate_burst": self._global.burst,
+            "client_rate": self.client_rate,
+            "client_burst": self.client_burst,
+            "admitted": self.admitted,
+            "rejected": dict(self.rejected),
+        }
+
+    def _admit(self) -> Ticket:
+        self.active += 1
+        self.admitted += 1
+        return Ticket(self)
+
+    def _remove(self, entry: list) -> None:
+        self._queue.remove(entry)
+        heapq.heapify(self._queue)
+
+    def _release(self) -> None:
+        self.active -= 1
+        self._dispatch()
+
+    def _on_timer(self) -> None:
+        self._timer = None
+        self._dispatch()
+
+    def _dispatch(self) -> None:
+        """Start queued turns while there is a free slot and a global token."""
+        while self._queue and self.active < self.max_active:
+            wait = self._global.take()
+            if wait:
+                if self._timer is None:
+                    self._timer = asyncio.get_running_loop().call_later(wait, self._on_timer)
+                return
+            _, _, future = heapq.heappop(self._queue)
+            self.active += 1
+            self.admitted += 1
+            future.set_result(None)
+
@@ -0,0 +1,148 @@
+"""Renders full agreements: the cover page followed by the standard terms.
+
+Standard terms never change per request, so each file is rendered to HTML
+once, split into its numbered top-level sections, and indexed by anchor.
+Like cover pages, a file is re-rendered when its mtime changes.
+"""
+import re
+from dataclasses import dataclass
+from pathlib import Path
+
+from docs import DOC_REGISTRY
+from template_renderer import render_template
+
+TEMPLATES_DIR = Path(__file__).parent.parent / "templates"
+
+_SECTION_START = re.compile(r"^(\d+)\.\s")
+_SUBSECTION_START = re.compile(r"^\s+(\d+)\.\s")
+_HEADER_2 = re.compile(r'class="header_2"[^>]*>(.*?)</span>|\*\*(.+?)\*\*')
+_HEADER_3 = re.compile(r'class="header_3"[^>]*>(.*?)</span>')
+_TAGS = re.compile(r"<[^>]+>")
+
+
+@dataclass(frozen=True)
+class Section:
+    anchor: str
+    number: str
+    title: str
+    subsections: tuple[str, ...]
+    html: str
+
+    def summary(self) -> dict:
+        return {
+            "anchor": self.anchor,
+            "number": self.number,
+            "title": self.title,
+            "subsections": list(self.subsections),
+        }
+
+
+@dataclass(frozen=True)
+class StandardTerms:
+    title: str
+    html: str
+    sections: tuple[Section, ...]
+    mtime_ns: int
+
+    def section(self, anchor: str) -> Section | None:
+        return next((s for s in self.sections if s.anchor == anchor), None)
+
+
+_terms: dict[str, StandardTerms] = {}
+
+
+def _plain(text: str) -> str:
+    return _TAGS.sub("", text).strip().rstrip(".").strip()
+
+
+def _render_section(number: str, lines: list[str]) -> Section:
+    import markdown
+
+    head = _HEADER_2.search(lines[0])
+    if head:
+        title = _plain(head.group(1) or head.group(2))
+    else:
+        # A plain heading such as "11. Definitions": its first sentence.
+        title = _plain(_SECTION_START.sub("", lines[0], 1)).split(". ", 1)[0] or f"Section {number}"
+    subsections = tuple(
+        _plain(m.group(1))
+        for line in lines[1:]
+        if _SUBSECTION_START.match(line) and (m := _HEADER_3.search(line))
+    )
+    body = markdown.markdown("\n".join(lines))
+    # Each chunk renders as its own list, so carry over the original numbering.
+    body = body.replace("<ol>", f'<ol start="{number}">', 1)
+    anchor = f"section-{number}"
+    return Section(
+        anchor=anchor,
+        number=number,
+        title=title,
+        subsections=subsections,
+        html=f'<section id="{anchor}">\n{body}\n</section>',
+    )
+
+
+def compile_terms(source: str, mtime_ns: int = 0) -> StandardTerms:
+    """Render standard terms markdown into indexed top-level sections."""
+    import markdown
+
+    preamble: list[str] = []
+    chunks: list[tuple[str, list[str]]] = []
+    closing: list[str] = []
+    previous = ""
+    for line in source.splitlines():
+        start = _SECTION_START.match(line)
+        if closing or (chunks and line[:1].strip() and not start and not previous.strip()):
+            closing.append(line)
+        elif start:
+            chunks.append((start.group(1), [line]))
+        elif chunks:
+            chunks[-1][1].append(line)
+        else:
+            preamble.append(line)
+        previous = line
+
+    title = next((line.lstrip("# ").strip() for line in preamble if line.startswith("#")), "")
+    sections = tuple(_render_section(number, lines) for number, lines in chunks)
+    parts = [markdown.markdown("\n".join(preamble))]
+    parts.extend(s.html for s in sections)
+    if closing:
+        parts.append(markdown.markdown("\n".join(closing)))
+    return StandardTerms(
+        title=title,
+        html="\n".join(p for p in parts if p),
+        sections=sections,
+        mtime_ns=mtime_ns,
+    )
+
+
+def get_standard_terms(doc_type: str) -> StandardTerms | None:
+    """Return the rendered standard terms for doc_type, or None if it has none."""
+    config = DOC_REGISTRY.get(doc_type)
+    if config is None or config.terms_file is None:
+        return None
+    path = TEMPLATES_DIR / config.terms_file
+    try:
+        mtime_ns = path.stat().st_mtime_ns
+    except OSError:
+        return None
+
+    terms = _terms.get(doc_type)
+    if terms is None or terms.mtime_ns != mtime_ns:
+        terms = compile_terms(path.read_text(), mtime_ns)
+        _terms[doc_type] = terms
+    return terms
+
+
+def prerender_standard_terms() -> None:
+    """Render every registered doc type's standard terms; called at startup."""
+    for doc_type in DOC_REGISTRY:
+        get_standard_terms(doc_type)
+
+
+def render_agreement(doc_type: str, fields: dict) -> str | None:
+    """Return the cover page followed by the standard terms as one HTML document."""
+    terms = get_standard_terms(doc_type)
+    if terms is None:
+        return None
+    return f"{render_template(doc_type, fields)}\n<hr />\n{terms.html}"
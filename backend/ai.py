@@ -1,14 +1,53 @@
-"""AI chat completion with per-document structured outputs."""
-from dataclasses import dataclass
-from typing import Type
+"""AI chat completion with per-document structured outputs.
+
+litellm takes seconds to import, so it (and httpx) is imported on first use
+rather than with this module; call warm_up() to pay that cost up front.
+"""
+import asyncio
+import json
+import logging
+import os
+import random
+import sys
+import time
+from collections import defaultdict, deque
+from contextlib import asynccontextmanager
+from dataclasses import asdict, dataclass, field
+from functools import cache
+from typing import Any, AsyncIterator, Awaitable, Callable, Type
+
 from pydantic import BaseModel, create_model
-from litellm import completion
 
 from docs import DOC_REGISTRY
+from history import compact_history
+from metrics import errors, llm_tokens, stage_duration
 
 MODEL = "openrouter/openai/gpt-oss-120b"
 EXTRA_BODY = {"provider": {"order": ["cerebras"]}}
 
+# Max upstream LLM calls in flight per process; extra callers queue for a slot.
+MAX_CONCURRENCY = int(os.environ.get("LLM_MAX_CONCURRENCY", "64"))
+MAX_CONNECTIONS = int(os.environ.get("LLM_MAX_CONNECTIONS", str(MAX_CONCURRENCY)))
+
+# Model/provider routes, tried in order on retry: a JSON list of
+# {"model", "name"?, "extra_body"?, "api_base"?}. Defaults to MODEL via EXTRA_BODY.
+ROUTES_SPEC = os.environ.get("LLM_ROUTES", "")
+# Wall-clock budget for a whole call, across retries and hedges.
+DEADLINE_SECONDS = float(os.environ.get("LLM_DEADLINE", "90"))
+# A streamed attempt with no first token by now is abandoned.
+FIRST_TOKEN_TIMEOUT = float(os.environ.get("LLM_FIRST_TOKEN_TIMEOUT", "30"))
+# Upstream calls per turn, hedges included.
+MAX_ATTEMPTS = int(os.environ.get("LLM_MAX_ATTEMPTS", "3"))
+BACKOFF_BASE = float(os.environ.get("LLM_BACKOFF_BASE", "0.25"))
+# Seconds without a first token before a hedge is fired at the next route:
+# a number, "p95" to track the primary route's observed latency, or empty to disable.
+HEDGE_AFTER = os.environ.get("LLM_HEDGE_AFTER", "")
+# First-token samples needed before "p95" hedging kicks in.
+HEDGE_MIN_SAMPLES = 20
+
+
+logger = logging.getLogger(__name__)
+
 
 @dataclass
 class ChatResult:
@@ -16,8 +55,422 @@ class ChatResult:
     fields: dict
 
 
+@dataclass
+class UsageStats:
+    calls: int = 0
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    cached_tokens: int = 0
+
+
+# Token usage reported by the provider, keyed by doc type.
+usage_stats: dict[str, UsageStats] = defaultdict(UsageStats)
+
+
+class UpstreamLimiter:
+    """Bounds in-flight upstream calls and records how long callers queue."""
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self._semaphore = asyncio.Semaphore(limit)
+        self.in_flight = 0
+        self.waiting = 0
+        self.acquired = 0
+        self.wait_seconds_total = 0.0
+        self.max_wait_seconds = 0.0
+
+    @asynccontextmanager
+    async def slot(self):
+        start = time.perf_counter()
+        self.waiting += 1
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self.waiting -= 1
+        waited = time.perf_counter() - start
+        self.acquired += 1
+        self.wait_seconds_total += waited
+        self.max_wait_seconds = max(self.max_wait_seconds, waited)
+        self.in_flight += 1
+        try:
+            yield waited
+        finally:
+            self.in_flight -= 1
+            self._semaphore.release()
+
+    def snapshot(self) -> dict:
+        return {
+            "limit": self.limit,
+            "in_flight": self.in_flight,
+            "queue_depth": self.waiting,
+            "acquired": self.acquired,
+            "wait_seconds_total": round(self.wait_seconds_total, 6),
+            "max_wait_seconds": round(self.max_wait_seconds, 6),
+        }
+
+
+limiter = UpstreamLimiter(MAX_CONCURRENCY)
+
+
+@dataclass(frozen=True)
+class Route:
+    name: str
+    model: str
+    extra_body: dict | None = None
+    api_base: str | None = None
+
+
+def load_routes(spec: str) -> list[Route]:
+    """Parse LLM_ROUTES; an empty spec is the single default route."""
+    if not spec:
+        return [Route(name=MODEL, model=MODEL, extra_body=EXTRA_BODY)]
+    routes: list[Route] = []
+    for i, item in enumerate(json.loads(spec)):
+        name = item.get("name") or item["model"]
+        if any(r.name == name for r in routes):
+            name = f"{name}#{i}"
+        routes.append(Route(
+            name=name,
+            model=item["model"],
+            extra_body=item.get("extra_body"),
+            api_base=item.get("api_base"),
+        ))
+    return routes
+
+
+@dataclass
+class Attempt:
+    """One upstream call made on behalf of a turn."""
+    route: str
+    number: int
+    hedge: bool
+    outcome: str = "pending"  # ok | error | timeout | cancelled
+    first_token_seconds: float | None = None
+    error: str | None = None
+
+
+@dataclass
+class RouteStats:
+    attempts: int = 0
+    ok: int = 0
+    errors: int = 0
+    timeouts: int = 0
+    cancelled: int = 0
+    hedges: int = 0
+    latencies: deque = field(default_factory=lambda: deque(maxlen=256))
+
+    def percentile(self, q: float) -> float | None:
+        if not self.latencies:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def retryable(error: BaseException) -> bool:
+    """Whether another attempt may succeed: timeouts, connection failures, 429 and 5xx.
+
+    Auth, bad-request and context-length errors would fail the same way again.
+    """
+    status = getattr(error, "status_code", None)
+    if isinstance(status, int):
+        return status in (408, 429) or status >= 500
+    if isinstance(error, (TimeoutError, ConnectionError)):
+        return True
+    httpx = sys.modules.get("httpx")  # imported with litellm; absent means no transport error
+    return httpx is not None and isinstance(error, httpx.TransportError)
+
+
+class Router:
+    """Runs upstream calls across routes with deadlines, retries and hedging.
+
+    first() starts an attempt on the first route; if it fails with a
+    retryable() error, the next attempt goes to the next route after a
+    jittered backoff, and any other error is raised at once. With hedging on,
+    an attempt that has produced nothing after the hedge delay is raced
+    against one on the next route, and whichever answers first wins.
+    """
+
+    def __init__(
+        self,
+        routes: list[Route],
+        max_attempts: int = MAX_ATTEMPTS,
+        deadline: float = DEADLINE_SECONDS,
+        first_token_timeout: float = FIRST_TOKEN_TIMEOUT,
+        hedge_after: str = HEDGE_AFTER,
+    ):
+        self.routes = routes
+        self.max_attempts = max_attempts
+        self.deadline = deadline
+        self.first_token_timeout = first_token_timeout
+        self.hedge_after = hedge_after
+        self.stats = {route.name: RouteStats() for route in routes}
+        self.recent: deque[Attempt] = deque(maxlen=64)
+
+    def hedge_delay(self) -> float | None:
+        if not self.hedge_after:
+            return None
+        if self.hedge_after != "p95":
+            return float(self.hedge_after)
+        primary = self.stats[self.routes[0].name]
+        if len(primary.latencies) < HEDGE_MIN_SAMPLES:
+            return None
+        return primary.percentile(0.95)
+
+    def _record(self, attempt: Attempt, outcome: str, error: BaseException | None = None) -> None:
+        attempt.outcome = outcome
+        attempt.error = None if error is None else f"{type(error).__name__}: {error}"
+        stats = self.stats[attempt.route]
+        if outcome == "ok":
+            stats.ok += 1
+            stats.latencies.append(attempt.first_token_seconds)
+        elif outcome == "timeout":
+            stats.timeouts += 1
+        elif outcome == "error":
+            stats.errors += 1
+        else:
+            stats.cancelled += 1
+        self.recent.append(attempt)
+        logger.info(
+            "llm attempt route=%s number=%d hedge=%s outcome=%s first_token_seconds=%s",
+            attempt.route, attempt.number, attempt.hedge, outcome,
+            None if attempt.first_token_seconds is None else round(attempt.first_token_seconds, 3),
+        )
+
+    async def first(
+        self,
+        open_attempt: Callable[[Route], Awaitable[Any]],
+        discard: Callable[[Any], Awaitable[None]] | None = None,
+    ) -> tuple[Any, float]:
+        """Return the first successful open_attempt(route) result and the call's deadline.
+
+        The deadline is in event loop time, for bounding the rest of a stream.
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.deadline
+        pending: dict[asyncio.Task, Attempt] = {}
+        started: dict[asyncio.Task, float] = {}
+        hedged = False
+        last_error: BaseException | None = None
+
+        def launch(hedge: bool) -> None:
+            number = len(started)
+            route = self.routes[number % len(self.routes)]
+            attempt = Attempt(route=route.name, number=number, hedge=hedge)
+            stats = self.stats[route.name]
+            stats.attempts += 1
+            stats.hedges += hedge
+            begin = loop.time()
+
+            async def run():
+                timeout = min(self.first_token_timeout, deadline - begin)
+                result = await asyncio.wait_for(open_attempt(route), timeout)
+                attempt.first_token_seconds = loop.time() - begin
+                return result
+
+            task = asyncio.ensure_future(run())
+            pending[task] = attempt
+            started[task] = begin
+
+        try:
+            while True:
+                if not pending:
+                    if len(started) >= self.max_attempts or loop.time() >= deadline:
+                        raise last_error or TimeoutError("upstream deadline exceeded")
+                    if started:
+                        backoff = random.uniform(0, BACKOFF_BASE * 2 ** (len(started) - 1))
+                        await asyncio.sleep(min(backoff, max(0.0, deadline - loop.time())))
+                    launch(hedge=False)
+
+                timeout = deadline - loop.time()
+                delay = self.hedge_delay()
+                can_hedge = delay is not None and not hedged and len(started) < self.max_attempts
+                if can_hedge:
+                    oldest = min(started[task] for task in pending)
+                    timeout = min(timeout, max(0.0, oldest + delay - loop.time()))
+                done, _ = await asyncio.wait(
+                    pending, timeout=max(0.0, timeout), return_when=asyncio.FIRST_COMPLETED
+                )
+                if not done:
+                    if loop.time() >= deadline:
+                        raise TimeoutError("upstream deadline exceeded")
+                    hedged = True
+                    launch(hedge=True)
+                    continue
+
+                winner = None
+                for task in done:
+                    attempt = pending.pop(task)
+                    error = task.exception()
+                    if error is None and winner is None:
+                        self._record(attempt, "ok")
+                        winner = task.result()
+                    elif error is None:
+                        self._record(attempt, "cancelled")
+                        if discard is not None:
+                            await discard(task.result())
+                    else:
+                        self._record(attempt, "timeout" if isinstance(error, TimeoutError) else "error", error)
+                        last_error = error
+                        if not retryable(error):
+                            raise error
+                if winner is not None:
+                    return winner, deadline
+        finally:
+            for task in pending:
+                task.cancel()
+            results = await asyncio.gather(*pending, return_exceptions=True)
+            for attempt, result in zip(pending.values(), results):
+                self._record(attempt, "timeout" if loop.time() >= deadline else "cancelled")
+                if not isinstance(result, BaseException) and discard is not None:
+                    await discard(result)
+
+    def snapshot(self) -> dict:
+        return {
+            "hedge_after_seconds": self.hedge_delay(),
+            "routes": {
+                name: {
+                    "attempts": s.attempts,
+                    "ok": s.ok,
+                    "errors": s.errors,
+                    "timeouts": s.timeouts,
+                    "cancelled": s.cancelled,
+                    "hedges": s.hedges,
+                    "p50_first_token_seconds": s.percentile(0.5),
+                    "p95_first_token_seconds": s.percentile(0.95),
+                }
+                for name, s in self.stats.items()
+            },
+            "recent_attempts": [asdict(a) for a in self.recent],
+        }
+
+
+router = Router(load_routes(ROUTES_SPEC))
+
+
+def _http_client():
+    """Return the pooled HTTP client shared by every upstream call."""
+    import httpx
+    import litellm
+
+    if litellm.aclient_session is None:
+        limits = httpx.Limits(
+            max_connections=MAX_CONNECTIONS, max_keepalive_connections=MAX_CONNECTIONS
+        )
+        litellm.aclient_session = httpx.AsyncClient(limits=limits, timeout=httpx.Timeout(120.0))
+    return litellm.aclient_session
+
+
+async def aclose():
+    """Close the shared HTTP client; called on application shutdown."""
+    litellm = sys.modules.get("litellm")
+    if litellm is not None and litellm.aclient_session is not None:
+        await litellm.aclient_session.aclose()
+        litellm.aclient_session = None
+
+
+async def acompletion(**kwargs):
+    """litellm.acompletion, importing litellm on first call."""
+    import litellm
+
+    return await litellm.acompletion(**kwargs)
+
+
+def warm_up() -> None:
+    """Import litellm and build every doc type's response format ahead of the first turn."""
+    for config in DOC_REGISTRY.values():
+        _response_format(config.fields_class)
+
+
+class ReplyStreamParser:
+    """Incrementally extracts the top-level "reply" string from streamed JSON.
+
+    feed() takes raw content deltas as they arrive and returns whatever new
+    reply text can be decoded so far. Escape sequences split across chunks are
+    held back until complete.
+    """
+
+    def __init__(self):
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._expecting_key = False
+        self._string_is_key = False
+        self._capturing = False
+        self._key: str | None = None
+        self._buf: list[str] = []
+        self._pending = ""
+
+    def feed(self, chunk: str) -> str:
+        out: list[str] = []
+        for c in chunk:
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif c == "\\":
+                    self._escape = True
+                elif c == '"':
+                    self._in_string = False
+                    if self._string_is_key:
+                        self._key = "".join(self._buf)
+                    elif self._capturing:
+                        self._capturing = False
+                        self._pending += "".join(self._buf)
+                        out.append(self._decode(final=True))
+                    self._buf = []
+                    continue
+                if self._string_is_key or self._capturing:
+                    self._buf.append(c)
+            elif c == '"':
+                self._in_string = True
+                self._string_is_key = self._depth == 1 and self._expecting_key
+                self._capturing = (
+                    self._depth == 1 and not self._string_is_key and self._key == "reply"
+                )
+            elif c in "{[":
+                self._depth += 1
+                if self._depth == 1:
+                    self._expecting_key = c == "{"
+            elif c in "}]":
+                self._depth -= 1
+            elif c == ":" and self._depth == 1:
+                self._expecting_key = False
+            elif c == "," and self._depth == 1:
+                self._expecting_key = True
+
+        if self._capturing and self._buf:
+            self._pending += "".join(self._buf)
+            self._buf = []
+            out.append(self._decode(final=False))
+        return "".join(out)
+
+    def _decode(self, final: bool) -> str:
+        """Decode the complete prefix of pending raw string content."""
+        raw = self._pending
+        cut = len(raw)
+        if not final:
+            i = 0
+            while i < len(raw):
+                if raw[i] != "\\":
+                    i += 1
+                    continue
+                size = 6 if raw[i + 1:i + 2] == "u" else 2
+                # A high surrogate must be decoded together with its low half.
+                if size == 6 and raw[i + 2:i + 3].lower() == "d" and raw[i + 3:i + 4].lower() in "89ab":
+                    size = 12
+                if i + size > len(raw):
+                    cut = i
+                    break
+                i += size
+        self._pending = raw[cut:]
+        return json.loads(f'"{raw[:cut]}"', strict=False) if cut else ""
+
+
+@cache
 def _make_response_model(fields_class: Type[BaseModel]) -> Type[BaseModel]:
-    """Create a ChatResponse Pydantic model with the given fields class."""
+    """Create a ChatResponse Pydantic model with the given fields class.
+
+    Memoized per fields class so validators are built once per doc type.
+    """
     return create_model(
         "ChatResponse",
         reply=(str, ...),
@@ -25,26 +478,149 @@ def _make_response_model(fields_class: Type[BaseModel]) -> Type[BaseModel]:
     )
 
 
-def chat_completion(messages: list[dict], current_fields: dict, doc_type: str) -> ChatResult:
-    """Call LLM with conversation history and return reply + extracted fields."""
-    config = DOC_REGISTRY.get(doc_type)
-    if config is None:
-        config = DOC_REGISTRY["unknown"]
+@cache
+def _response_format(fields_class: Type[BaseModel]) -> dict:
+    """Return the JSON-schema response_format sent upstream, built once per fields class."""
+    from litellm.utils import type_to_response_format_param
+
+    return type_to_response_format_param(_make_response_model(fields_class))
+
 
+@dataclass
+class _Turn:
+    doc_type: str
+    messages: list[dict]
+    response_model: Type[BaseModel]
+    response_format: dict
+
+
+def _prepare(messages: list[dict], current_fields: dict, doc_type: str) -> _Turn:
+    """Assemble the upstream request for a turn.
+
+    The doc type's system prompt is always the first message, byte for byte,
+    so providers can cache it as a prompt prefix. History is compacted to the
+    doc type's token budget, and volatile state (fields collected so far)
+    goes in a trailing system message after it.
+    """
+    if doc_type not in DOC_REGISTRY:
+        doc_type = "unknown"
+    config = DOC_REGISTRY[doc_type]
+
+    history = compact_history(messages, config.history_token_budget)
+    llm_messages = [{"role": "system", "content": config.prompt}] + history
     filled = {k: v for k, v in current_fields.items() if v}
-    system_prompt = config.prompt
     if filled:
-        system_prompt += f"\n\nFields already collected: {filled}"
-
-    llm_messages = [{"role": "system", "content": system_prompt}] + messages
-    ResponseModel = _make_response_model(config.fields_class)
+        collected = json.dumps(filled, sort_keys=True, ensure_ascii=False)
+        llm_messages.append({"role": "system", "content": f"Fields already collected: {collected}"})
 
-    response = completion(
-        model=MODEL,
+    fields_class = config.fields_class
+    return _Turn(
+        doc_type=doc_type,
         messages=llm_messages,
-        response_format=ResponseModel,
-        reasoning_effort="low",
-        extra_body=EXTRA_BODY,
+        response_model=_make_response_model(fields_class),
+        response_format=_response_format(fields_class),
     )
-    result = ResponseModel.model_validate_json(response.choices[0].message.content)
-    return ChatResult(reply=result.reply, fields=result.fields.model_dump(exclude_none=True))
+
+
+def _cached_tokens(usage) -> int:
+    """Prompt tokens the provider served from its prompt cache, if reported."""
+    details = getattr(usage, "prompt_tokens_details", None)
+    cached = getattr(details, "cached_tokens", None)
+    if cached is None:
+        cached = getattr(usage, "cache_read_input_tokens", None)
+    return cached or 0
+
+
+def _record_usage(doc_type: str, usage) -> None:
+    if usage is None:
+        return
+    stats = usage_stats[doc_type]
+    prompt = getattr(usage, "prompt_tokens", 0) or 0
+    completion_tokens = getattr(usage, "completion_tokens", 0) or 0
+    cached = _cached_tokens(usage)
+    stats.calls += 1
+    stats.prompt_tokens += prompt
+    stats.completion_tokens += completion_tokens
+    stats.cached_tokens += cached
+    llm_tokens.inc(prompt, doc_type=doc_type, kind="prompt")
+    llm_tokens.inc(completion_tokens, doc_type=doc_type, kind="completion")
+    llm_tokens.inc(cached, doc_type=doc_type, kind="cached")
+    logger.info(
+        "llm usage doc_type=%s prompt_tokens=%d cached_tokens=%d completion_tokens=%d",
+        doc_type, prompt, cached, completion_tokens,
+    )
+
+
+def _request(route: Route, turn: _Turn) -> dict:
+    """acompletion() arguments for sending turn along route."""
+    kwargs = {
+        "model": route.model,
+        "messages": turn.messages,
+        "response_format": turn.response_format,
+        "reasoning_effort": "low",
+    }
+    if route.extra_body is not None:
+        kwargs["extra_body"] = route.extra_body
+    if route.api_base is not None:
+        kwargs["api_base"] = route.api_base
+    return kwargs
+
+
+def _validate(turn: _Turn, content: str) -> ChatResult:
+    with stage_duration.time(stage="validation", doc_type=turn.doc_type):
+        result = turn.response_model.model_validate_json(content)
+        return ChatResult(reply=result.reply, fields=result.fields.model_dump(exclude_none=True))
+
+
+async def _close_stream(opened) -> None:
+    chunks, _ = opened
+    aclose = getattr(chunks, "aclose", None)
+    if aclose is not None:
+        await aclose()
+
+
+async def stream_chat_completion(
+    messages: list[dict], current_fields: dict, doc_type: str
+) -> AsyncIterator[str | ChatResult]:
+    """Stream an LLM turn, yielding reply text deltas and finally the ChatResult.
+
+    Retries and hedges only happen before the first chunk arrives; after
+    that the stream is committed to its route, bounded by the call deadline.
+    """
+    turn = _prepare(messages, current_fields, doc_type)
+
+    async def open_attempt(route: Route):
+        response = await acompletion(
+            **_request(route, turn), stream=True, stream_options={"include_usage": True}
+        )
+        chunks = aiter(response)
+        return chunks, await anext(chunks, None)
+
+    _http_client()
+    loop = asyncio.get_running_loop()
+    parser = ReplyStreamParser()
+    content: list[str] = []
+    usage = None
+    try:
+        async with limiter.slot() as waited:
+            stage_duration.observe(waited, stage="queue_wait", doc_type=turn.doc_type)
+            start = time.perf_counter()
+            (chunks, chunk), deadline = await router.first(open_attempt, _close_stream)
+            stage_duration.observe(time.perf_counter() - start, stage="first_token", doc_type=turn.doc_type)
+            while chunk is not None:
+                usage = getattr(chunk, "usage", None) or usage
+                delta = chunk.choices[0].delta.content if chunk.choices else None
+                if delta:
+                    content.append(delta)
+                    text = parser.feed(delta)
+                    if text:
+                        yield text
+                chunk = await asyncio.wait_for(anext(chunks, None), max(0.0, deadline - loop.time()))
+            stage_duration.observe(time.perf_counter() - start, stage="upstream", doc_type=turn.doc_type)
+
+        _record_usage(turn.doc_type, usage)
+        result = _validate(turn, "".join(content))
+    except Exception as exc:
+        errors.inc(doc_type=turn.doc_type, error=type(exc).__name__)
+        raise
+    yield result
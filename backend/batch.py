@@ -0,0 +1,86 @@
+"""Batch rendering of cover pages, fanned out to a process pool for large batches.
+
+Small batches render inline on the event loop, since a compiled render is
+just a string join. Larger ones are split into chunks and rendered by worker
+processes; results are yielded in completion order, each tagged with the
+index of the item it belongs to.
+"""
+import asyncio
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import AsyncIterator
+
+from template_renderer import get_compiled
+
+# Batches smaller than this render inline instead of in the process pool.
+POOL_THRESHOLD = int(os.environ.get("BATCH_POOL_THRESHOLD", "64"))
+# Items sent to a worker per task, amortizing inter-process overhead.
+CHUNK_SIZE = int(os.environ.get("BATCH_CHUNK_SIZE", "32"))
+# Defaults to this server process's share of the cores when several run.
+MAX_WORKERS = int(os.environ.get("BATCH_MAX_WORKERS", "0")) or max(
+    1, (os.cpu_count() or 1) // int(os.environ.get("WEB_CONCURRENCY", "1"))
+)
+
+_pool: ProcessPoolExecutor | None = None
+
+
+def _executor() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        # forkserver: forking the threaded server process directly is unsafe.
+        context = multiprocessing.get_context("forkserver")
+        _pool = ProcessPoolExecutor(max_workers=MAX_WORKERS, mp_context=context)
+    return _pool
+
+
+def shutdown() -> None:
+    """Stop the worker processes; called on application shutdown."""
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(cancel_futures=True)
+        _pool = None
+
+
+def render_chunk(items: list[tuple[int, str, dict]]) -> list[dict]:
+    """Render (index, doc_type, fields) items, reporting failures per item."""
+    results = []
+    for index, doc_type, fields in items:
+        try:
+            compiled = get_compiled(doc_type)
+            if compiled is None:
+                raise ValueError(f"Template not available for document type: {doc_type}")
+            results.append({"index": index, "doc_type": doc_type, "html": compiled.render(fields)})
+        except Exception as exc:
+            results.append({"index": index, "doc_type": doc_type, "error": str(exc)})
+    return results
+
+
+async def render_batch(items: list[tuple[str, dict]]) -> AsyncIterator[dict]:
+    """Yield one result per (doc_type, fields) item, in completion order."""
+    indexed = [(i, doc_type, fields) for i, (doc_type, fields) in enumerate(items)]
+    if len(indexed) < POOL_THRESHOLD:
+        for result in render_chunk(indexed):
+            yield result
+        return
+
+    loop = asyncio.get_running_loop()
+    executor = _executor()
+
+    async def run(chunk: list[tuple[int, str, dict]]) -> list[dict]:
+        try:
+            return await loop.run_in_executor(executor, render_chunk, chunk)
+        except Exception as exc:
+            return [{"index": i, "doc_type": d, "error": str(exc)} for i, d, _ in chunk]
+
+    tasks = [
+        asyncio.ensure_future(run(indexed[start:start + CHUNK_SIZE]))
+        for start in range(0, len(indexed), CHUNK_SIZE)
+    ]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            for result in await next_done:
+                yield result
+    finally:
+        for task in tasks:
+            task.cancel()
@@ -0,0 +1,104 @@
+"""Local OpenAI-compatible chat completions server for load tests.
+
+Answers POST /v1/chat/completions with a canned structured reply, streamed
+or not, after a configurable first-token latency, at a configurable token
+rate, failing a configurable fraction of requests. Run from backend/:
+
+    uv run python benchmarks/fake_llm.py --port 9100 --latency 0.3 --tokens-per-second 400
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+# Characters per streamed token, roughly what a BPE tokenizer averages.
+CHARS_PER_TOKEN = 4
+
+REPLY = (
+    "Thanks, I've noted that. Next, what is the effective date of the agreement, "
+    "and which US state's law should govern it?"
+)
+
+
+def build_app(latency: float, tokens_per_second: float, error_rate: float) -> FastAPI:
+    app = FastAPI()
+
+    def completion_body(request_id: str, model: str) -> dict:
+        return {"id": request_id, "object": "chat.completion.chunk", "created": int(time.time()), "model": model}
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        model = body.get("model", "fake")
+        request_id = f"chatcmpl-{random.getrandbits(64):x}"
+        content = json.dumps({"reply": REPLY, "fields": {"purpose": "Evaluating a partnership"}})
+        prompt_tokens = sum(len(m.get("content") or "") for m in body.get("messages", [])) // CHARS_PER_TOKEN
+        usage = {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": len(content) // CHARS_PER_TOKEN,
+            "total_tokens": prompt_tokens + len(content) // CHARS_PER_TOKEN,
+        }
+
+        await asyncio.sleep(latency)
+        if random.random() < error_rate:
+            return JSONResponse(
+                {"error": {"message": "fake upstream failure", "type": "server_error"}}, status_code=503
+            )
+
+        if not body.get("stream"):
+            return {
+                **completion_body(request_id, model),
+                "object": "chat.completion",
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": content},
+                    "finish_reason": "stop",
+                }],
+                "usage": usage,
+            }
+
+        async def stream():
+            delay = 1 / tokens_per_second if tokens_per_second > 0 else 0
+            for i in range(0, len(content), CHARS_PER_TOKEN):
+                chunk = {
+                    **completion_body(request_id, model),
+                    "choices": [{
+                        "index": 0,
+                        "delta": {"content": content[i:i + CHARS_PER_TOKEN]},
+                        "finish_reason": None,
+                    }],
+                }
+                yield f"data: {json.dumps(chunk)}\n\n"
+                if delay:
+                    await asyncio.sleep(delay)
+            final = {
+                **completion_body(request_id, model),
+                "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}],
+            }
+            yield f"data: {json.dumps(final)}\n\n"
+            yield f"data: {json.dumps({**completion_body(request_id, model), 'choices': [], 'usage': usage})}\n\n"
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(stream(), media_type="text/event-stream")
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--port", type=int, default=9100)
+    parser.add_argument("--latency", type=float, default=0.3, help="seconds before the first token")
+    parser.add_argument("--tokens-per-second", type=float, default=400.0, help="0 streams at full speed")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests answered 503")
+    args = parser.parse_args()
+    app = build_app(args.latency, args.tokens_per_second, args.error_rate)
+    uvicorn.run(app, host="127.0.0.1", port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,242 @@
+"""Load test: the real app, served by uvicorn, against a local fake LLM.
+
+Starts benchmarks/fake_llm.py and the app (routed to the fake through
+LLM_ROUTES), then drives each scenario at a fixed concurrency and reports
+requests per second, latency percentiles and time to first byte. Results are
+written as JSON; pass --compare with an earlier file to see the change.
+Run from backend/:
+
+    uv run python benchmarks/load.py --concurrency 32 --requests 500
+    uv run python benchmarks/load.py --compare benchmarks/results/<earlier>.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+import httpx
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+RESULTS_DIR = Path(__file__).resolve().parent / "results"
+# Served by the static scenario; without it "/" is only a JSON placeholder.
+STATIC_INDEX = BACKEND_DIR / "static" / "index.html"
+STARTUP_TIMEOUT = 60.0
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def chat_request(i: int) -> tuple[str, str, dict]:
+    # A distinct message per request, so the chat cache never answers.
+    body = {"messages": [{"role": "user", "content": f"We need an NDA, request {i}"}], "doc_type": "mnda"}
+    return "POST", "/api/chat", body
+
+
+def preview_request(i: int) -> tuple[str, str, dict]:
+    # 50 distinct field sets, as from many users editing different drafts.
+    fields = {"providerName": f"Acme {i % 50}", "customerName": "Beta Inc"}
+    return "POST", "/api/preview", {"doc_type": "csa", "fields": fields, "annotate": True}
+
+
+def static_request(i: int) -> tuple[str, str, None]:
+    return "GET", "/", None
+
+
+SCENARIOS = {"chat": chat_request, "preview": preview_request, "static": static_request}
+
+
+def percentiles(samples: list[float]) -> dict:
+    if not samples:
+        return {"p50": None, "p95": None, "p99": None}
+    ordered = sorted(samples)
+
+    def at(q: float) -> float:
+        return round(ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1000, 3)
+
+    return {"p50": at(0.5), "p95": at(0.95), "p99": at(0.99)}
+
+
+async def run_scenario(base_url: str, make_request, requests: int, concurrency: int) -> dict:
+    latencies: list[float] = []
+    ttfbs: list[float] = []
+    errors = 0
+    issued = 0
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=120) as client:
+
+        async def worker():
+            nonlocal issued, errors
+            while issued < requests:
+                i = issued
+                issued += 1
+                method, path, body = make_request(i)
+                start = time.perf_counter()
+                first_byte = None
+                try:
+                    async with client.stream(method, path, json=body) as response:
+                        async for _ in response.aiter_raw():
+                            if first_byte is None:
+                                first_byte = time.perf_counter()
+                        ok = response.status_code < 400
+                except httpx.HTTPError:
+                    ok = False
+                end = time.perf_counter()
+                if not ok:
+                    errors += 1
+                    continue
+                latencies.append(end - start)
+                ttfbs.append((first_byte or end) - start)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+
+    return {
+        "requests": requests,
+        "errors": errors,
+        "seconds": round(elapsed, 3),
+        "rps": round(len(latencies) / elapsed, 2) if elapsed else None,
+        "latency_ms": percentiles(latencies),
+        "ttfb_ms": percentiles(ttfbs),
+    }
+
+
+def _wait_for(url: str) -> None:
+    deadline = time.perf_counter() + STARTUP_TIMEOUT
+    while time.perf_counter() < deadline:
+        try:
+            httpx.get(url, timeout=1)
+            return
+        except httpx.HTTPError:
+            time.sleep(0.05)
+    raise TimeoutError(f"{url} not ready after {STARTUP_TIMEOUT}s")
+
+
+def _commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def compare(previous: dict, current: dict) -> None:
+    print(f"\ncompared with {previous.get('commit')} ({previous.get('timestamp')})")
+    print(f"{'scenario':<10}{'rps':>18}{'p95 ms':>22}{'p95 ttfb ms':>22}")
+    for name, now in current["scenarios"].items():
+        before = previous.get("scenarios", {}).get(name)
+        if before is None:
+            continue
+
+        def delta(old, new) -> str:
+            if old in (None, 0) or new is None:
+                return f"{old} -> {new}"
+            return f"{old} -> {new} ({(new - old) / old:+.0%})"
+
+        print(
+            f"{name:<10}{delta(before['rps'], now['rps']):>18}"
+            f"{delta(before['latency_ms']['p95'], now['latency_ms']['p95']):>22}"
+            f"{delta(before['ttfb_ms']['p95'], now['ttfb_ms']['p95']):>22}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scenarios", help="comma-separated subset of " + ", ".join(SCENARIOS) + " (default: all)")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--requests", type=int, default=200, help="requests per scenario")
+    parser.add_argument("--latency", type=float, default=0.3, help="fake LLM seconds to first token")
+    parser.add_argument("--tokens-per-second", type=float, default=400.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--output", type=Path, help="results file (default: benchmarks/results/<commit>-<time>.json)")
+    parser.add_argument("--compare", type=Path, help="earlier results file to compare against")
+    args = parser.parse_args()
+    if args.scenarios is None:
+        scenarios = list(SCENARIOS)
+        if not STATIC_INDEX.exists():
+            scenarios.remove("static")
+            print(f"skipping static: {STATIC_INDEX} not found (build the frontend first)", file=sys.stderr)
+    else:
+        scenarios = [name.strip() for name in args.scenarios.split(",") if name.strip()]
+        if "static" in scenarios and not STATIC_INDEX.exists():
+            parser.error(f"static scenario needs the built frontend: {STATIC_INDEX} not found")
+
+    llm_port, app_port = _free_port(), _free_port()
+    processes = []
+    with tempfile.TemporaryDirectory() as tmp:
+        try:
+            processes.append(subprocess.Popen([
+                sys.executable, str(Path(__file__).with_name("fake_llm.py")), "--port", str(llm_port),
+                "--latency", str(args.latency), "--tokens-per-second", str(args.tokens_per_second),
+                "--error-rate", str(args.error_rate),
+            ]))
+            env = {
+                **os.environ,
+                "PRELEGAL_DB": os.path.join(tmp, "prelegal.db"),
+                "LLM_ROUTES": json.dumps([{
+                    "name": "fake", "model": "openai/fake-model", "api_base": f"http://127.0.0.1:{llm_port}/v1",
+                }]),
+                "OPENAI_API_KEY": "fake",
+                # Every request comes from one address: measure capacity, not the rate limits.
+                "CHAT_CLIENT_RATE": "0",
+                "CHAT_RATE": "0",
+                "PRELEGAL_WARMUP": "1",
+            }
+            processes.append(subprocess.Popen(
+                [sys.executable, "-m", "uvicorn", "main:app", "--port", str(app_port), "--log-level", "warning"],
+                cwd=BACKEND_DIR, env=env,
+            ))
+            _wait_for(f"http://127.0.0.1:{llm_port}/docs")
+            _wait_for(f"http://127.0.0.1:{app_port}/api/health")
+
+            base_url = f"http://127.0.0.1:{app_port}"
+            results = {}
+            for name in scenarios:
+                results[name] = asyncio.run(
+                    run_scenario(base_url, SCENARIOS[name], args.requests, args.concurrency)
+                )
+                r = results[name]
+                print(
+                    f"{name:<10} {r['rps']:>9} rps  p50 {r['latency_ms']['p50']} ms  "
+                    f"p95 {r['latency_ms']['p95']} ms  p99 {r['latency_ms']['p99']} ms  "
+                    f"ttfb p50 {r['ttfb_ms']['p50']} ms  errors {r['errors']}"
+                )
+        finally:
+            for process in processes:
+                process.terminate()
+                process.wait()
+
+    report = {
+        "commit": _commit(),
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "config": {
+            "concurrency": args.concurrency,
+            "requests": args.requests,
+            "latency": args.latency,
+            "tokens_per_second": args.tokens_per_second,
+            "error_rate": args.error_rate,
+        },
+        "scenarios": results,
+    }
+    output = args.output or RESULTS_DIR / f"{report['commit']}-{datetime.now():%Y%m%d-%H%M%S}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(report, indent=2) + "\n")
+    print(f"\nwrote {output}")
+    if args.compare:
+        compare(json.loads(args.compare.read_text()), report)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,43 @@
+"""Micro-benchmark: per-turn cost of building the structured response model.
+
+Compares the old per-turn path (create_model + response_format schema on every
+call) with the memoized lookups in ai.py. Run from backend/:
+
+    uv run python benchmarks/response_models.py
+"""
+import sys
+import timeit
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from litellm.utils import type_to_response_format_param  # noqa: E402
+from pydantic import create_model  # noqa: E402
+
+from ai import _make_response_model, _response_format  # noqa: E402
+from docs import DOC_REGISTRY  # noqa: E402
+
+NUMBER = 200
+
+
+def uncached_turn(fields_class):
+    model = create_model("ChatResponse", reply=(str, ...), fields=(fields_class, fields_class()))
+    return model, type_to_response_format_param(model)
+
+
+def cached_turn(fields_class):
+    return _make_response_model(fields_class), _response_format(fields_class)
+
+
+def main():
+    print(f"{'doc_type':<18}{'uncached (us)':>15}{'cached (us)':>13}{'speedup':>10}")
+    for doc_type, config in DOC_REGISTRY.items():
+        fields_class = config.fields_class
+        cached_turn(fields_class)  # warm the memo, as the first request would
+        before = timeit.timeit(lambda: uncached_turn(fields_class), number=NUMBER) / NUMBER
+        after = timeit.timeit(lambda: cached_turn(fields_class), number=NUMBER) / NUMBER
+        print(f"{doc_type:<18}{before * 1e6:>15.1f}{after * 1e6:>13.2f}{before / after:>9.0f}x")
+
+
+if __name__ == "__main__":
+    main()
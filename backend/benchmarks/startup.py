@@ -0,0 +1,89 @@
+"""Startup benchmark: import-time breakdown and time to a healthy /api/health.
+
+The import breakdown comes from ``python -X importtime -c "import main"`` and
+is grouped by top-level package. Time to healthy starts uvicorn in a fresh
+process and polls /api/health until it answers, once cold and once with
+PRELEGAL_WARMUP=1. Run from backend/:
+
+    uv run python benchmarks/startup.py
+"""
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from collections import defaultdict
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+TOP_N = 12
+HEALTH_TIMEOUT = 60.0
+
+
+def import_breakdown() -> tuple[float, list[tuple[str, float]]]:
+    """Return total import seconds for main and the slowest top-level packages."""
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import main"],
+        cwd=BACKEND_DIR, capture_output=True, text=True, check=True,
+    )
+    by_package: dict[str, float] = defaultdict(float)
+    total = 0.0
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        self_us, _, name = line[len("import time:"):].split("|")
+        by_package[name.strip().split(".")[0]] += int(self_us) / 1e6
+        total += int(self_us) / 1e6
+    ranked = sorted(by_package.items(), key=lambda item: item[1], reverse=True)
+    return total, ranked[:TOP_N]
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def time_to_healthy(warmup: bool) -> float:
+    """Seconds from spawning uvicorn until /api/health returns 200."""
+    port = _free_port()
+    with tempfile.TemporaryDirectory() as tmp:
+        env = {
+            **os.environ,
+            "PRELEGAL_DB": os.path.join(tmp, "prelegal.db"),
+            "PRELEGAL_WARMUP": "1" if warmup else "",
+        }
+        start = time.perf_counter()
+        server = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning"],
+            cwd=BACKEND_DIR, env=env,
+        )
+        try:
+            while time.perf_counter() - start < HEALTH_TIMEOUT:
+                try:
+                    with urllib.request.urlopen(f"http://127.0.0.1:{port}/api/health", timeout=1) as res:
+                        if res.status == 200:
+                            return time.perf_counter() - start
+                except OSError:
+                    time.sleep(0.02)
+            raise TimeoutError(f"/api/health not ready after {HEALTH_TIMEOUT}s")
+        finally:
+            server.terminate()
+            server.wait()
+
+
+def main():
+    total, ranked = import_breakdown()
+    print(f"import main: {total:.3f}s (self time, summed)")
+    print(f"{'package':<24}{'seconds':>10}")
+    for package, seconds in ranked:
+        print(f"{package:<24}{seconds:>10.3f}")
+    print()
+    print(f"time to healthy (cold):     {time_to_healthy(warmup=False):.3f}s")
+    print(f"time to healthy (warm-up):  {time_to_healthy(warmup=True):.3f}s")
+
+
+if __name__ == "__main__":
+    main()
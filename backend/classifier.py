@@ -0,0 +1,150 @@
+"""Local doc-type classification for the "unknown" chat flow.
+
+A BM25 index over each supported doc type's catalog.json descriptions, its
+standard terms' section headings and its line in CLASSIFIER_PROMPT is
+built once; scoring a message is a few dict lookups. A message is classified
+only when the best doc type clearly beats the runner-up; otherwise the
+caller falls back to the LLM classifier.
+"""
+import json
+import math
+import os
+import re
+from collections import Counter
+from dataclasses import dataclass
+from pathlib import Path
+
+from agreements import TEMPLATES_DIR
+from docs import DOC_REGISTRY
+from prompts import CLASSIFIER_PROMPT
+
+CATALOG_PATH = Path(os.environ.get("CATALOG_PATH") or Path(__file__).resolve().parent.parent / "catalog.json")
+# The top score must reach MIN_SCORE and beat the runner-up by MARGIN (a
+# fraction of the top score) for a local answer.
+MIN_SCORE = float(os.environ.get("CLASSIFIER_MIN_SCORE", "2.5"))
+MARGIN = float(os.environ.get("CLASSIFIER_MARGIN", "0.35"))
+
+# BM25 parameters; the usual defaults.
+K1 = 1.2
+B = 0.75
+
+_PROMPT_LINE = re.compile(r"^- (\w+): (.+)$", re.MULTILINE)
+_HEADING = re.compile(r'class="header_[23]"[^>]*>(.*?)</span>|^#+\s+(.+)$', re.MULTILINE)
+_WORD = re.compile(r"[a-z0-9]+")
+_STOPWORDS = frozenset(
+    "a an and are as at be between by can do for from has have how i in into is it its "
+    "me my need needs of on or our so that the their them this to us we what which who "
+    "will with want would you your".split()
+)
+# Words in every agreement's name; they say nothing about which one is meant.
+_GENERIC = frozenset({"agreement", "contract", "document"})
+
+
+def tokenize(text: str) -> list[str]:
+    tokens = []
+    for word in _WORD.findall(text.lower()):
+        if len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+            word = word[:-1]
+        if word not in _STOPWORDS and word not in _GENERIC:
+            tokens.append(word)
+    return tokens
+
+
+def _initials(name: str) -> str:
+    return "".join(word[0] for word in re.findall(r"[A-Za-z]+", name)).lower()
+
+
+def _corpus(catalog: list[dict]) -> dict[str, str]:
+    """Text describing each registered doc type, keyed by doc type."""
+    descriptions = dict(_PROMPT_LINE.findall(CLASSIFIER_PROMPT))
+    texts: dict[str, str] = {}
+    for doc_type, config in DOC_REGISTRY.items():
+        if doc_type == "unknown":
+            continue
+        # Name twice: it is the strongest signal. Initials and the key cover
+        # abbreviations like "NDA", "SLA" or "BAA".
+        parts = [config.name, config.name, _initials(config.name), doc_type.replace("_", " ")]
+        parts.append(descriptions.get(doc_type, ""))
+        for entry in catalog:
+            filename = os.path.basename(entry.get("filename", ""))
+            if filename == config.terms_file or entry.get("name", "").startswith(config.name):
+                parts.append(entry.get("description", ""))
+        if config.terms_file:
+            try:
+                source = (TEMPLATES_DIR / config.terms_file).read_text()
+            except OSError:
+                source = ""
+            parts.extend(m.group(1) or m.group(2) for m in _HEADING.finditer(source))
+        texts[doc_type] = "\n".join(parts)
+    return texts
+
+
+@dataclass
+class Classification:
+    doc_type: str | None  # None when the scores are too close or too low
+    scores: dict[str, float]
+
+
+class Index:
+    def __init__(self, documents: dict[str, str]):
+        self.doc_types = list(documents)
+        tokenized = [tokenize(text) for text in documents.values()]
+        self.lengths = [len(tokens) for tokens in tokenized]
+        self.avg_length = sum(self.lengths) / len(self.lengths) if self.lengths else 0.0
+        # term -> [(document number, term frequency)]
+        self.postings: dict[str, list[tuple[int, int]]] = {}
+        for number, tokens in enumerate(tokenized):
+            for term, tf in Counter(tokens).items():
+                self.postings.setdefault(term, []).append((number, tf))
+        n = len(tokenized)
+        self.idf = {
+            term: math.log(1 + (n - len(postings) + 0.5) / (len(postings) + 0.5))
+            for term, postings in self.postings.items()
+        }
+
+    @classmethod
+    def build(cls, catalog_path: Path = CATALOG_PATH) -> "Index":
+        try:
+            catalog = json.loads(Path(catalog_path).read_text())
+        except (OSError, ValueError):
+            catalog = []
+        return cls(_corpus(catalog))
+
+    def scores(self, text: str) -> dict[str, float]:
+        totals = [0.0] * len(self.doc_types)
+        for term in set(tokenize(text)):
+            idf = self.idf.get(term)
+            if idf is None:
+                continue
+            for number, tf in self.postings[term]:
+                norm = K1 * (1 - B + B * self.lengths[number] / self.avg_length)
+                totals[number] += idf * tf * (K1 + 1) / (tf + norm)
+        return {doc_type: score for doc_type, score in zip(self.doc_types, totals) if score > 0}
+
+    def classify(self, text: str, min_score: float = MIN_SCORE, margin: float = MARGIN) -> Classification:
+        scores = self.scores(text)
+        ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+        if not ranked or ranked[0][1] < min_score:
+            return Classification(None, scores)
+        best, top = ranked[0]
+        runner_up = ranked[1][1] if len(ranked) > 1 else 0.0
+        if top - runner_up < margin * top:
+            return Classification(None, scores)
+        return Classification(best, scores)
+
+
+_index: Index | None = None
+
+
+def get_index() -> Index:
+    """Build the index on first use; called at startup so requests never pay for it."""
+    global _index
+    if _index is None:
+        _index = Index.build()
+    return _index
+
+
+def classify(messages: list[dict]) -> Classification:
+    """Classify a conversation from everything the user has said so far."""
+    text = "\n".join(m["content"] for m in messages if m.get("role") == "user")
+    return get_index().classify(text)
@@ -0,0 +1,25 @@
+import os
+
+# litellm fetches its model cost map over the network on import unless told
+# to use the bundled copy; tests must not depend on that.
+os.environ.setdefault("LITELLM_LOCAL_MODEL_COST_MAP", "True")
+
+import pytest  # noqa: E402
+from fastapi.testclient import TestClient  # noqa: E402
+
+from exports import ExportQueue  # noqa: E402
+from main import app  # noqa: E402
+from sessions import SessionStore  # noqa: E402
+
+
+@pytest.fixture
+def session_client(tmp_path, monkeypatch):
+    """A client with the app's lifespan running against a throwaway database and export dir."""
+    import main
+
+    db_path = str(tmp_path / "prelegal.db")
+    monkeypatch.setattr(main, "DB_PATH", db_path)
+    monkeypatch.setattr(main, "sessions", SessionStore(db_path))
+    monkeypatch.setattr(main, "exports", ExportQueue(db_path, str(tmp_path / "exports"), workers=2))
+    with TestClient(app) as c:
+        yield c
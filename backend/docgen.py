@@ -0,0 +1,510 @@
+"""PDF and DOCX generation from rendered agreement HTML.
+
+The HTML that render_agreement produces (headings, paragraphs, nested
+numbered lists, bold/italic runs, simple tables and rules) is flattened into
+blocks of styled runs, which two small writers lay out: DOCX as raw
+WordprocessingML in a zip, PDF with the standard Helvetica fonts and their
+built-in metrics, so nothing needs to be installed or embedded. Output is
+deterministic: the same input always produces the same bytes.
+"""
+import re
+import unicodedata
+import zipfile
+import zlib
+from dataclasses import dataclass, field
+from html.parser import HTMLParser
+from io import BytesIO
+from xml.sax.saxutils import escape
+
+from agreements import render_agreement
+from docs import DOC_REGISTRY
+from template_renderer import render_template
+
+# Bump when layout changes, so cached exports are rendered afresh.
+GENERATOR_VERSION = 2
+
+FORMATS = {
+    "pdf": "application/pdf",
+    "docx": "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+}
+
+
+@dataclass
+class Run:
+    text: str
+    bold: bool = False
+    italic: bool = False
+
+
+@dataclass
+class Block:
+    kind: str  # heading | paragraph | item | rule
+    level: int = 0  # heading level
+    indent: int = 0  # list nesting depth
+    prefix: str = ""  # list marker, e.g. "2."
+    runs: list[Run] = field(default_factory=list)
+
+
+_HEADINGS = {"h1": 1, "h2": 2, "h3": 3, "h4": 4, "h5": 4, "h6": 4}
+_WHITESPACE = re.compile(r"\s+")
+
+
+class _BlockParser(HTMLParser):
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.blocks: list[Block] = []
+        self.current: Block | None = None
+        self.lists: list[list] = []  # [ordered, last number]
+        self.bold = 0
+        self.italic = 0
+        self.cells: list[list[Run]] | None = None
+
+    def _start(self, kind: str, **kwargs) -> Block:
+        self._finish()
+        self.current = Block(kind=kind, indent=len(self.lists), **kwargs)
+        return self.current
+
+    def _finish(self) -> None:
+        block, self.current = self.current, None
+        if block is None:
+            return
+        runs = block.runs
+        while runs and not runs[0].text.strip():
+            runs.pop(0)
+        while runs and not runs[-1].text.strip():
+            runs.pop()
+        if runs:
+            runs[0].text = runs[0].text.lstrip()
+            runs[-1].text = runs[-1].text.rstrip()
+            self.blocks.append(block)
+        elif block.kind == "item":
+            self.blocks.append(block)
+
+    def handle_starttag(self, tag, attrs):
+        attrs = dict(attrs)
+        if tag in _HEADINGS:
+            self._start("heading", level=_HEADINGS[tag])
+        elif tag == "p":
+            if not (self.current and self.current.kind == "item" and not self.current.runs):
+                self._start("paragraph")
+        elif tag in ("ol", "ul"):
+            self._finish()
+            start = attrs.get("start") or "1"
+            self.lists.append([tag == "ol", int(start) - 1 if start.isdigit() else 0])
+        elif tag == "li":
+            marker = "•"
+            if self.lists:
+                ordered, number = self.lists[-1]
+                if ordered:
+                    self.lists[-1][1] = number + 1
+                    marker = f"{number + 1}."
+            self._start("item", prefix=marker)
+            self.current.indent = max(0, len(self.lists) - 1)
+        elif tag in ("strong", "b"):
+            self.bold += 1
+        elif tag in ("em", "i"):
+            self.italic += 1
+        elif tag == "br":
+            self._add("\n")
+        elif tag == "hr":
+            self._finish()
+            self.blocks.append(Block(kind="rule"))
+        elif tag == "tr":
+            self._finish()
+            self.cells = []
+        elif tag in ("td", "th") and self.cells is not None:
+            self.cells.append([])
+
+    def handle_endtag(self, tag):
+        if tag in _HEADINGS or tag in ("p", "li"):
+            self._finish()
+        elif tag in ("ol", "ul"):
+            self._finish()
+            if self.lists:
+                self.lists.pop()
+        elif tag in ("strong", "b"):
+            self.bold = max(0, self.bold - 1)
+        elif tag in ("em", "i"):
+            self.italic = max(0, self.italic - 1)
+        elif tag == "tr" and self.cells is not None:
+            cells = [cell for cell in self.cells if "".join(r.text for r in cell).strip()]
+            self.cells = None
+            if cells:
+                block = self._start("paragraph")
+                for i, cell in enumerate(cells):
+                    if i:
+                        block.runs.append(Run("  |  "))
+                    block.runs.extend(cell)
+                self._finish()
+
+    def handle_data(self, data):
+        text = _WHITESPACE.sub(" ", data)
+        if self.cells is not None:
+            if self.cells:
+                self.cells[-1].append(Run(text, self.bold > 0, self.italic > 0))
+            return
+        if self.current is None:
+            if not text.strip():
+                return
+            self._start("paragraph")
+        self._add(text)
+
+    def _add(self, text: str) -> None:
+        if self.current is None:
+            return
+        bold, italic = self.bold > 0, self.italic > 0
+        runs = self.current.runs
+        if runs and runs[-1].bold == bold and runs[-1].italic == italic and text != "\n" and runs[-1].text != "\n":
+            runs[-1].text += text
+        else:
+            runs.append(Run(text, bold, italic))
+
+    def close(self):
+        super().close()
+        self._finish()
+
+
+def html_to_blocks(html: str) -> list[Block]:
+    """Flatten rendered agreement HTML into styled blocks."""
+    parser = _BlockParser()
+    parser.feed(html)
+    parser.close()
+    return parser.blocks
+
+
+# --- DOCX -------------------------------------------------------------------
+
+_W = "http://schemas.openxmlformats.org/wordprocessingml/2006/main"
+_ZIP_DATE = (1980, 1, 1, 0, 0, 0)
+_XML_INVALID = re.compile("[\x00-\x08\x0b\x0c\x0e-\x1f]")
+_DOCX_HEADING_HALF_POINTS = {1: 36, 2: 28, 3: 24, 4: 22}
+_DOCX_BODY_HALF_POINTS = 21
+
+
+def _docx_run(run: Run, half_points: int, bold: bool = False) -> str:
+    if run.text == "\n":
+        return "<w:r><w:br/></w:r>"
+    props = ""
+    if run.bold or bold:
+        props += "<w:b/>"
+    if run.italic:
+        props += "<w:i/>"
+    props += f'<w:sz w:val="{half_points}"/>'
+    text = escape(_XML_INVALID.sub("", run.text))
+    return f'<w:r><w:rPr>{props}</w:rPr><w:t xml:space="preserve">{text}</w:t></w:r>'
+
+
+def _docx_paragraph(block: Block) -> str:
+    if block.kind == "rule":
+        return (
+            '<w:p><w:pPr><w:pBdr><w:bottom w:val="single" w:sz="6" w:space="1" w:color="auto"/>'
+            "</w:pBdr></w:pPr></w:p>"
+        )
+    if block.kind == "heading":
+        size = _DOCX_HEADING_HALF_POINTS[block.level]
+        props = '<w:pPr><w:keepNext/><w:spacing w:before="240" w:after="120"/></w:pPr>'
+        return f"<w:p>{props}{''.join(_docx_run(r, size, bold=True) for r in block.runs)}</w:p>"
+
+    size = _DOCX_BODY_HALF_POINTS
+    runs = "".join(_docx_run(r, size) for r in block.runs)
+    indent = 360 * block.indent
+    if block.kind == "item":
+        props = f'<w:pPr><w:spacing w:after="120"/><w:ind w:left="{indent + 360}" w:hanging="360"/></w:pPr>'
+        runs = _docx_run(Run(block.prefix + "\t"), size) + runs
+    else:
+        props = f'<w:pPr><w:spacing w:after="120"/><w:ind w:left="{indent}"/></w:pPr>'
+    return f"<w:p>{props}{runs}</w:p>"
+
+
+def to_docx(blocks: list[Block], title: str) -> bytes:
+    body = "".join(_docx_paragraph(block) for block in blocks)
+    document = (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        f'<w:document xmlns:w="{_W}"><w:body>{body}'
+        '<w:sectPr><w:pgSz w:w="12240" w:h="15840"/>'
+        '<w:pgMar w:top="1440" w:right="1440" w:bottom="1440" w:left="1440" '
+        'w:header="720" w:footer="720" w:gutter="0"/></w:sectPr>'
+        "</w:body></w:document>"
+    )
+    parts = {
+        "[Content_Types].xml": (
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+            '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+            '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+            '<Default Extension="xml" ContentType="application/xml"/>'
+            '<Override PartName="/word/document.xml" ContentType="application/'
+            'vnd.openxmlformats-officedocument.wordprocessingml.document.main+xml"/>'
+            '<Override PartName="/docProps/core.xml" '
+            'ContentType="application/vnd.openxmlformats-package.core-properties+xml"/>'
+            "</Types>"
+        ),
+        "_rels/.rels": (
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+            '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+            '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/'
+            'relationships/officeDocument" Target="word/document.xml"/>'
+            '<Relationship Id="rId2" Type="http://schemas.openxmlformats.org/package/2006/'
+            'relationships/metadata/core-properties" Target="docProps/core.xml"/>'
+            "</Relationships>"
+        ),
+        "docProps/core.xml": (
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+            '<cp:coreProperties xmlns:cp="http://schemas.openxmlformats.org/package/2006/'
+            'metadata/core-properties" xmlns:dc="http://purl.org/dc/elements/1.1/">'
+            f"<dc:title>{escape(title)}</dc:title></cp:coreProperties>"
+        ),
+        "word/document.xml": document,
+    }
+    buffer = BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as archive:
+        for name, xml in parts.items():
+            archive.writestr(zipfile.ZipInfo(name, date_time=_ZIP_DATE), xml.encode())
+    return buffer.getvalue()
+
+
+# --- PDF --------------------------------------------------------------------
+
+# Advance widths (1/1000 em) of ASCII 32-126 from the Adobe Helvetica AFMs.
+# Oblique faces share the upright widths.
+_HELVETICA = (
+    278, 278, 355, 556, 556, 889, 667, 191, 333, 333, 389, 584, 278, 333, 278, 278,
+    556, 556, 556, 556, 556, 556, 556, 556, 556, 556, 278, 278, 584, 584, 584, 556,
+    1015, 667, 667, 722, 722, 667, 611, 778, 722, 278, 500, 667, 556, 833, 722, 778,
+    667, 778, 722, 667, 611, 722, 667, 944, 667, 667, 611, 278, 278, 278, 469, 556,
+    333, 556, 556, 500, 556, 556, 278, 556, 556, 222, 222, 500, 222, 833, 556, 556,
+    556, 556, 333, 500, 278, 556, 500, 722, 500, 500, 500, 334, 260, 334, 584,
+)
+_HELVETICA_BOLD = (
+    278, 333, 474, 556, 556, 889, 722, 238, 333, 333, 389, 584, 278, 333, 278, 278,
+    556, 556, 556, 556, 556, 556, 556, 556, 556, 556, 333, 333, 584, 584, 584, 611,
+    975, 722, 722, 722, 722, 667, 611, 778, 722, 278, 556, 722, 611, 833, 722, 778,
+    667, 778, 722, 667, 611, 722, 667, 944, 667, 667, 611, 333, 278, 333, 584, 556,
+    333, 556, 611, 556, 611, 556, 333, 611, 611, 278, 278, 556, 278, 889, 611, 611,
+    611, 611, 389, 556, 333, 611, 556, 778, 556, 556, 500, 389, 280, 389, 584,
+)
+_DEFAULT_WIDTH = 556
+_FONTS = {
+    (False, False): ("F1", "Helvetica"),
+    (True, False): ("F2", "Helvetica-Bold"),
+    (False, True): ("F3", "Helvetica-Oblique"),
+    (True, True): ("F4", "Helvetica-BoldOblique"),
+}
+
+PAGE_WIDTH, PAGE_HEIGHT = 612, 792  # US Letter, points
+MARGIN = 72
+INDENT = 18
+BODY_SIZE = 10.5
+HEADING_SIZES = {1: 18, 2: 14, 3: 12, 4: 11}
+LINE_HEIGHT = 1.35
+_TOKENS = re.compile(r"\n| +|[^ \n]+")
+
+
+class UnsupportedText(ValueError):
+    """Raised for text the PDF's standard fonts have no glyphs for."""
+
+
+def unsupported_pdf_characters(fields: dict) -> str:
+    """Characters in field values that a PDF export cannot show, in order of appearance."""
+    found = []
+    for value in fields.values():
+        for char in str(value):
+            if char not in found and not _encodable(char) and not _invisible(char):
+                found.append(char)
+    return "".join(found)
+
+
+def _encodable(char: str) -> bool:
+    try:
+        char.encode("cp1252")
+    except UnicodeEncodeError:
+        return False
+    return True
+
+
+def _invisible(char: str) -> bool:
+    """Format characters (LRM, RLM, zero-width space, ...) have no glyph; PDFs drop them."""
+    return unicodedata.category(char) == "Cf"
+
+
+def _encode(text: str) -> bytes:
+    """Encode for the WinAnsi-encoded standard fonts, refusing to substitute characters."""
+    if not text.isascii():
+        text = "".join(c for c in text if not _invisible(c))
+    try:
+        return text.encode("cp1252")
+    except UnicodeEncodeError:
+        chars = "".join(dict.fromkeys(c for c in text if not _encodable(c)))
+        raise UnsupportedText(
+            f"PDF export cannot show {chars!r}; export as DOCX to keep these characters"
+        ) from None
+
+
+def _width(text: bytes, bold: bool, size: float) -> float:
+    table = _HELVETICA_BOLD if bold else _HELVETICA
+    units = sum(table[b - 32] if 32 <= b <= 126 else _DEFAULT_WIDTH for b in text)
+    return units * size / 1000
+
+
+def _pdf_string(text: bytes) -> str:
+    out = []
+    for b in text:
+        if b in (0x28, 0x29, 0x5C):  # ( ) \
+            out.append("\\" + chr(b))
+        elif 32 <= b <= 126:
+            out.append(chr(b))
+        else:
+            out.append(f"\\{b:03o}")
+    return "(" + "".join(out) + ")"
+
+
+class _PdfLayout:
+    def __init__(self):
+        self.pages: list[list[str]] = []
+        self.y = 0.0
+        self._new_page()
+
+    def _new_page(self) -> None:
+        self.pages.append([])
+        self.y = PAGE_HEIGHT - MARGIN
+
+    def _ensure(self, height: float) -> None:
+        if self.y - height < MARGIN and self.y < PAGE_HEIGHT - MARGIN:
+            self._new_page()
+
+    def _line(self, x: float, segments: list[tuple[bytes, bool, bool]], size: float) -> None:
+        ops = [f"BT 1 0 0 1 {x:.2f} {self.y:.2f} Tm"]
+        font = None
+        for text, bold, italic in segments:
+            name = _FONTS[(bold, italic)][0]
+            if name != font:
+                ops.append(f"/{name} {size:g} Tf")
+                font = name
+            ops.append(f"{_pdf_string(text)} Tj")
+        ops.append("ET")
+        self.pages[-1].append(" ".join(ops))
+
+    def _wrap(self, runs: list[Run], width: float, size: float, bold: bool):
+        lines: list[list[tuple[bytes, bool, bool]]] = [[]]
+        used = 0.0
+        for run in runs:
+            run_bold = run.bold or bold
+            for token in _TOKENS.findall(run.text):
+                if token == "\n":
+                    lines.append([])
+                    used = 0.0
+                    continue
+                data = _encode(token)
+                advance = _width(data, run_bold, size)
+                if token.startswith(" "):
+                    if not lines[-1]:
+                        continue
+                elif used + advance > width and lines[-1]:
+                    while lines[-1] and not lines[-1][-1][0].strip():
+                        lines[-1].pop()
+                    lines.append([])
+                    used = 0.0
+                line = lines[-1]
+                if line and line[-1][1] == run_bold and line[-1][2] == run.italic:
+                    line[-1] = (line[-1][0] + data, run_bold, run.italic)
+                else:
+                    line.append((data, run_bold, run.italic))
+                used += advance
+        return [line for line in lines if line]
+
+    def add(self, block: Block) -> None:
+        left = MARGIN + INDENT * block.indent
+        right = PAGE_WIDTH - MARGIN
+        if block.kind == "rule":
+            self._ensure(12)
+            self.y -= 6
+            self.pages[-1].append(f"0.5 w {left:.2f} {self.y:.2f} m {right:.2f} {self.y:.2f} l S")
+            self.y -= 8
+            return
+
+        heading = block.kind == "heading"
+        size = HEADING_SIZES[block.level] if heading else BODY_SIZE
+        leading = size * LINE_HEIGHT
+        text_left = left + INDENT if block.kind == "item" else left
+        lines = self._wrap(block.runs, right - text_left, size, bold=heading)
+        if heading:
+            # Keep a heading with the first lines of what follows it.
+            self._ensure(leading * 4)
+            self.y -= size * 0.5
+        if block.kind == "item":
+            lines = lines or [[]]
+        for i, line in enumerate(lines):
+            self._ensure(leading)
+            self.y -= leading
+            if i == 0 and block.kind == "item":
+                self._line(left, [(_encode(block.prefix), False, False)], size)
+            if line:
+                self._line(text_left, line, size)
+        self.y -= size * 0.5
+
+
+def to_pdf(blocks: list[Block], title: str) -> bytes:
+    layout = _PdfLayout()
+    for block in blocks:
+        layout.add(block)
+    total = len(layout.pages)
+    for number, ops in enumerate(layout.pages, start=1):
+        footer = f"Page {number} of {total}".encode()
+        x = (PAGE_WIDTH - _width(footer, False, 8)) / 2
+        ops.append(f"BT 1 0 0 1 {x:.2f} {MARGIN / 2:.2f} Tm /F1 8 Tf {_pdf_string(footer)} Tj ET")
+
+    objects: list[bytes] = []
+
+    def add(body: bytes) -> int:
+        objects.append(body)
+        return len(objects)
+
+    catalog = add(b"")  # filled in once the page tree exists
+    pages = add(b"")
+    fonts = " ".join(
+        f"/{name} {add(f'<< /Type /Font /Subtype /Type1 /BaseFont /{base} /Encoding /WinAnsiEncoding >>'.encode())} 0 R"
+        for name, base in _FONTS.values()
+    )
+    kids = []
+    for ops in layout.pages:
+        stream = zlib.compress("\n".join(ops).encode("latin-1"), 6)
+        content = add(
+            f"<< /Length {len(stream)} /Filter /FlateDecode >>\nstream\n".encode() + stream + b"\nendstream"
+        )
+        kids.append(add(
+            f"<< /Type /Page /Parent {pages} 0 R /MediaBox [0 0 {PAGE_WIDTH} {PAGE_HEIGHT}] "
+            f"/Resources << /Font << {fonts} >> >> /Contents {content} 0 R >>".encode()
+        ))
+    objects[catalog - 1] = f"<< /Type /Catalog /Pages {pages} 0 R >>".encode()
+    objects[pages - 1] = (
+        f"<< /Type /Pages /Kids [{' '.join(f'{k} 0 R' for k in kids)}] /Count {len(kids)} >>".encode()
+    )
+    info = add(f"<< /Title {_pdf_string(_encode(title))} /Producer (Prelegal) >>".encode())
+
+    out = BytesIO()
+    out.write(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(out.tell())
+        out.write(f"{number} 0 obj\n".encode() + body + b"\nendobj\n")
+    xref = out.tell()
+    out.write(f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode())
+    for offset in offsets:
+        out.write(f"{offset:010d} 00000 n \n".encode())
+    out.write(
+        f"trailer\n<< /Size {len(objects) + 1} /Root {catalog} 0 R /Info {info} 0 R >>\n"
+        f"startxref\n{xref}\n%%EOF\n".encode()
+    )
+    return out.getvalue()
+
+
+def render_export(doc_type: str, fields: dict, fmt: str) -> bytes:
+    """Render doc_type's agreement (or just its cover page, if it has no standard terms) as fmt."""
+    if fmt not in FORMATS:
+        raise ValueError(f"Unsupported export format: {fmt}")
+    config = DOC_REGISTRY.get(doc_type)
+    if config is None:
+        raise ValueError(f"Unknown document type: {doc_type}")
+    html = render_agreement(doc_type, fields) or render_template(doc_type, fields)
+    blocks = html_to_blocks(html)
+    writer = to_pdf if fmt == "pdf" else to_docx
+    return writer(blocks, config.name)
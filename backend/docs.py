@@ -1,4 +1,5 @@
 """Document type registry mapping doc types to field models and prompts."""
+import os
 from dataclasses import dataclass
 from typing import Type
 from pydantic import BaseModel
@@ -19,12 +20,17 @@ from fields import (
 )
 from prompts import PROMPTS
 
+# Approximate tokens of conversation history forwarded to the model per turn.
+DEFAULT_HISTORY_TOKEN_BUDGET = int(os.environ.get("HISTORY_TOKEN_BUDGET", "6000"))
+
 
 @dataclass
 class DocConfig:
     name: str
     fields_class: Type[BaseModel]
     prompt: str
+    history_token_budget: int = DEFAULT_HISTORY_TOKEN_BUDGET
+    terms_file: str | None = None  # standard terms under templates/
 
 
 DOC_REGISTRY: dict[str, DocConfig] = {
@@ -32,60 +38,73 @@ DOC_REGISTRY: dict[str, DocConfig] = {
         name="Mutual Non-Disclosure Agreement",
         fields_class=PartialMNDAFields,
         prompt=PROMPTS["mnda"],
+        terms_file="Mutual-NDA.md",
     ),
     "csa": DocConfig(
         name="Cloud Service Agreement",
         fields_class=PartialCSAFields,
         prompt=PROMPTS["csa"],
+        terms_file="CSA.md",
     ),
     "sla": DocConfig(
         name="Service Level Agreement",
         fields_class=PartialSLAFields,
         prompt=PROMPTS["sla"],
+        terms_file="sla.md",
     ),
     "design_partner": DocConfig(
         name="Design Partner Agreement",
         fields_class=PartialDesignPartnerFields,
         prompt=PROMPTS["design_partner"],
+        terms_file="design-partner-agreement.md",
     ),
     "psa": DocConfig(
         name="Professional Services Agreement",
         fields_class=PartialPSAFields,
         prompt=PROMPTS["psa"],
+        terms_file="psa.md",
     ),
     "dpa": DocConfig(
         name="Data Processing Agreement",
         fields_class=PartialDPAFields,
         prompt=PROMPTS["dpa"],
+        terms_file="DPA.md",
     ),
     "partnership": DocConfig(
         name="Partnership Agreement",
         fields_class=PartialPartnershipFields,
         prompt=PROMPTS["partnership"],
+        terms_file="Partnership-Agreement.md",
     ),
     "software_license": DocConfig(
         name="Software License Agreement",
         fields_class=PartialSoftwareLicenseFields,
         prompt=PROMPTS["software_license"],
+        terms_file="Software-License-Agreement.md",
     ),
     "pilot": DocConfig(
         name="Pilot Agreement",
         fields_class=PartialPilotFields,
         prompt=PROMPTS["pilot"],
+        terms_file="Pilot-Agreement.md",
     ),
     "baa": DocConfig(
         name="Business Associate Agreement",
         fields_class=PartialBAAFields,
         prompt=PROMPTS["baa"],
+        terms_file="BAA.md",
     ),
     "ai_addendum": DocConfig(
         name="AI Addendum",
         fields_class=PartialAIAddendumFields,
         prompt=PROMPTS["ai_addendum"],
+        terms_file="AI-Addendum.md",
     ),
     "unknown": DocConfig(
         name="Unknown",
         fields_class=UnknownDocFields,
         prompt=PROMPTS["unknown"],
+        # Classification only needs the user's recent description.
+        history_token_budget=min(DEFAULT_HISTORY_TOKEN_BUDGET, 1500),
     ),
 }
@@ -0,0 +1,336 @@
+"""Background export of agreements to PDF and DOCX.
+
+Submitting an export records a job in the application database and queues
+it; a fixed number of dispatcher tasks hand queued jobs to a process pool,
+since layout is pure CPU. Finished files are stored under EXPORT_DIR, named
+by a hash of everything that affects the output, so an identical export is
+served from disk instead of being rendered again. Job state lives in SQLite,
+so with several server processes any of them can answer a poll or download.
+Database calls run on a dedicated thread, so waiting on another process's
+write lock never stalls the event loop.
+
+Queued jobs live in the memory of the process that accepted them. A job
+whose process has gone away (or that has made no progress in JOB_TIMEOUT)
+is reported as failed rather than left queued. A periodic sweep deletes
+files and job records older than MAX_AGE and trims EXPORT_DIR to MAX_BYTES,
+least recently used first.
+"""
+import asyncio
+import logging
+import multiprocessing
+import os
+import secrets
+import socket
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from dataclasses import dataclass, replace
+
+from agreements import get_standard_terms
+from docgen import FORMATS, GENERATOR_VERSION, render_export
+from response_cache import cache_key, normalize_fields
+from sessions import connect
+from template_renderer import template_version
+
+logger = logging.getLogger(__name__)
+
+EXPORT_DIR = os.environ.get("EXPORT_DIR") or os.path.join(os.path.dirname(__file__), "exports")
+# Jobs waiting for a worker beyond this are refused rather than queued.
+QUEUE_SIZE = int(os.environ.get("EXPORT_QUEUE_SIZE", "64"))
+# Worker processes; defaults to this server process's share of the cores.
+MAX_WORKERS = int(os.environ.get("EXPORT_MAX_WORKERS", "0")) or max(
+    1, (os.cpu_count() or 1) // int(os.environ.get("WEB_CONCURRENCY", "1"))
+)
+# Files and job records older than this many seconds are deleted.
+MAX_AGE = float(os.environ.get("EXPORT_MAX_AGE", str(7 * 24 * 3600)))
+# EXPORT_DIR is trimmed to this many bytes, least recently used files first.
+MAX_BYTES = int(os.environ.get("EXPORT_MAX_BYTES", str(1 << 30)))
+SWEEP_INTERVAL = float(os.environ.get("EXPORT_SWEEP_INTERVAL", "600"))
+# A job still queued or running this long after its last update is taken to be lost.
+JOB_TIMEOUT = float(os.environ.get("EXPORT_JOB_TIMEOUT", "600"))
+
+INTERRUPTED = "Export was interrupted by a server restart; submit it again"
+
+
+class QueueFull(Exception):
+    """Raised by submit when QUEUE_SIZE jobs are already waiting."""
+
+
+@dataclass
+class ExportJob:
+    id: str
+    doc_type: str
+    format: str
+    key: str
+    status: str  # queued | running | done | failed | expired
+    error: str | None = None
+
+    @property
+    def filename(self) -> str:
+        return f"{self.key}.{self.format}"
+
+    def summary(self) -> dict:
+        return {"id": self.id, "doc_type": self.doc_type, "format": self.format, "status": self.status, "error": self.error}
+
+
+def export_key(doc_type: str, fmt: str, fields: dict) -> str:
+    """Hash of the inputs that determine an export's bytes."""
+    terms = get_standard_terms(doc_type)
+    return cache_key(
+        "export",
+        GENERATOR_VERSION,
+        doc_type,
+        fmt,
+        template_version(doc_type),
+        terms.mtime_ns if terms else None,
+        normalize_fields(fields),
+    )
+
+
+def _process_gone(owner: str) -> bool:
+    """Whether the server process that owns a job ("host:pid") has exited."""
+    host, _, pid = owner.rpartition(":")
+    if host != socket.gethostname() or not pid.isdigit():
+        return False  # another machine's process; only JOB_TIMEOUT can tell
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return True
+    except PermissionError:
+        return False
+    return False
+
+
+def sweep(db_path: str, export_dir: str, max_age: float = MAX_AGE, max_bytes: int = MAX_BYTES) -> int:
+    """Delete expired exports and job records, then trim export_dir to max_bytes; returns files removed."""
+    now = time.time()
+    removed = 0
+    kept = []
+    for entry in os.scandir(export_dir):
+        try:
+            stat = entry.stat()
+        except FileNotFoundError:
+            continue
+        # Leftover temporaries from a crashed render are always stale after an hour.
+        limit = min(max_age, 3600) if entry.name.endswith(".tmp") else max_age
+        if now - stat.st_mtime > limit:
+            removed += _unlink(entry.path)
+        else:
+            kept.append((stat.st_mtime, stat.st_size, entry.path))
+    total = 0
+    for _, size, path in sorted(kept, reverse=True):
+        total += size
+        if total > max_bytes:
+            removed += _unlink(path)
+
+    conn = connect(db_path)
+    try:
+        with conn:
+            conn.execute(
+                "DELETE FROM export_jobs WHERE created_at < datetime('now', ?)", (f"-{int(max_age)} seconds",)
+            )
+    finally:
+        conn.close()
+    return removed
+
+
+def _unlink(path: str) -> int:
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        return 0
+    return 1
+
+
+def write_export(doc_type: str, fields: dict, fmt: str, path: str) -> None:
+    """Render an export to path; runs in a worker process."""
+    data = render_export(doc_type, fields, fmt)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)  # readers never see a partial file
+
+
+class ExportQueue:
+    def __init__(
+        self,
+        db_path: str,
+        export_dir: str = EXPORT_DIR,
+        workers: int = MAX_WORKERS,
+        queue_size: int = QUEUE_SIZE,
+        sweep_interval: float = SWEEP_INTERVAL,
+    ):
+        self.db_path = db_path
+        self.export_dir = export_dir
+        self.workers = workers
+        self.queue_size = queue_size
+        self.sweep_interval = sweep_interval
+        self.owner = ""
+        self._queue: asyncio.Queue | None = None
+        self._dispatchers: list[asyncio.Task] = []
+        self._sweeper: asyncio.Task | None = None
+        self._pool: ProcessPoolExecutor | None = None
+        # The one thread that uses the connection.
+        self._db_thread: ThreadPoolExecutor | None = None
+        # Renders in progress in this process, by key, so concurrent identical
+        # jobs share one render.
+        self._inflight: dict[str, asyncio.Future] = {}
+        self._conn = None
+
+    async def start(self) -> None:
+        os.makedirs(self.export_dir, exist_ok=True)
+        self._db_thread = ThreadPoolExecutor(1, thread_name_prefix="export-db")
+        self._conn = await self._in_db_thread(connect, self.db_path)
+        self.owner = f"{socket.gethostname()}:{os.getpid()}"
+        await self._in_db_thread(self._fail_lost, None, True)
+        self._queue = asyncio.Queue(self.queue_size)
+        # forkserver: forking the threaded server process directly is unsafe.
+        context = multiprocessing.get_context("forkserver")
+        self._pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=context)
+        self._dispatchers = [asyncio.create_task(self._dispatch()) for _ in range(self.workers)]
+        self._sweeper = asyncio.create_task(self._sweep_loop())
+
+    async def stop(self) -> None:
+        tasks = [*self._dispatchers, *([self._sweeper] if self._sweeper else [])]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._dispatchers = []
+        self._sweeper = None
+        if self._pool is not None:
+            self._pool.shutdown(cancel_futures=True)
+            self._pool = None
+        if self._conn is not None:
+            await self._in_db_thread(self._conn.close)
+            self._conn = None
+        if self._db_thread is not None:
+            self._db_thread.shutdown()
+            self._db_thread = None
+
+    def path(self, job: ExportJob) -> str:
+        return os.path.join(self.export_dir, job.filename)
+
+    async def submit(self, doc_type: str, fields: dict, fmt: str) -> ExportJob:
+        """Record and queue an export; already-rendered exports complete immediately."""
+        if fmt not in FORMATS:
+            raise ValueError(f"Unsupported export format: {fmt}")
+        job = ExportJob(
+            id=secrets.token_urlsafe(16),
+            doc_type=doc_type,
+            format=fmt,
+            key=export_key(doc_type, fmt, fields),
+            status="queued",
+        )
+        if os.path.exists(self.path(job)):
+            job.status = "done"
+            try:
+                os.utime(self.path(job))  # recently used: the sweep trims oldest first
+            except OSError:
+                pass
+        elif self._queue.full():
+            raise QueueFull()
+        else:
+            self._queue.put_nowait((replace(job), fields))  # the dispatcher's own copy
+        # Submitted to the database thread before a dispatcher can run, so
+        # the row exists before the job's first status update.
+        await self._in_db_thread(self._insert, job)
+        return job
+
+    async def get(self, job_id: str) -> ExportJob | None:
+        return await self._in_db_thread(self._load, job_id)
+
+    def _load(self, job_id: str) -> ExportJob | None:
+        query = "SELECT id, doc_type, format, cache_key, status, error FROM export_jobs WHERE id = ?"
+        row = self._conn.execute(query, (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = ExportJob(*row)
+        if job.status in ("queued", "running") and self._fail_lost(job_id):
+            job.status, job.error = "failed", INTERRUPTED
+        elif job.status == "done" and not os.path.exists(self.path(job)):
+            job.status = "expired"
+        return job
+
+    def stats(self) -> dict:
+        return {
+            "queued": self._queue.qsize() if self._queue else 0,
+            "rendering": len(self._inflight),
+            "workers": self.workers,
+        }
+
+    def _insert(self, job: ExportJob) -> None:
+        with self._conn:
+            self._conn.execute(
+                "INSERT INTO export_jobs (id, doc_type, format, cache_key, status, owner) VALUES (?, ?, ?, ?, ?, ?)",
+                (job.id, job.doc_type, job.format, job.key, job.status, self.owner),
+            )
+
+    def _fail_lost(self, job_id: str | None = None, startup: bool = False) -> int:
+        """Fail unfinished jobs whose process has exited or that have stalled; returns how many.
+
+        At startup, jobs recorded under this process's own host:pid belong to
+        an earlier process that had the same pid, so they are lost too.
+        """
+        query = (
+            "SELECT id, owner, updated_at < datetime('now', ?) FROM export_jobs "
+            "WHERE status IN ('queued', 'running')"
+        )
+        params: tuple = (f"-{int(JOB_TIMEOUT)} seconds",)
+        if job_id is not None:
+            query += " AND id = ?"
+            params += (job_id,)
+        lost = [
+            (INTERRUPTED, row_id)
+            for row_id, owner, stale in self._conn.execute(query, params).fetchall()
+            if stale
+            or (owner == self.owner and startup)
+            or (owner and owner != self.owner and _process_gone(owner))
+        ]
+        if lost:
+            with self._conn:
+                self._conn.executemany(
+                    "UPDATE export_jobs SET status = 'failed', error = ?, updated_at = CURRENT_TIMESTAMP "
+                    "WHERE id = ? AND status IN ('queued', 'running')",
+                    lost,
+                )
+        return len(lost)
+
+    async def _in_db_thread(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._db_thread, fn, *args)
+
+    async def _sweep_loop(self) -> None:
+        while True:
+            try:
+                await asyncio.to_thread(sweep, self.db_path, self.export_dir)
+            except Exception:
+                logger.exception("Export sweep failed")
+            await asyncio.sleep(self.sweep_interval)
+
+    def _update(self, job: ExportJob) -> None:
+        with self._conn:
+            self._conn.execute(
+                "UPDATE export_jobs SET status = ?, error = ?, updated_at = CURRENT_TIMESTAMP WHERE id = ?",
+                (job.status, job.error, job.id),
+            )
+
+    async def _dispatch(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            job, fields = await self._queue.get()
+            job.status = "running"
+            await self._in_db_thread(self._update, job)
+            try:
+                render = self._inflight.get(job.key)
+                if render is None and not os.path.exists(self.path(job)):
+                    render = loop.run_in_executor(
+                        self._pool, write_export, job.doc_type, fields, job.format, self.path(job)
+                    )
+                    self._inflight[job.key] = render
+                    render.add_done_callback(lambda _, key=job.key: self._inflight.pop(key, None))
+                if render is not None:
+                    await asyncio.shield(render)
+                job.status = "done"
+            except asyncio.CancelledError:
+                raise
+            except Exception as exc:
+                job.status, job.error = "failed", str(exc) or type(exc).__name__
+            await self._in_db_thread(self._update, job)
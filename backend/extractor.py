@@ -0,0 +1,172 @@
+"""Speculative field extraction from a user turn, before the LLM replies.
+
+Field kinds come from each doc type's prompt: a field whose description asks
+for an ISO date, a US or EU member state, or a number of years can often be
+read straight off a short answer. Values are only filled when the turn is
+unambiguous (one value, one open field it could belong to), and are
+provisional: the LLM's fields for the turn confirm or override them.
+"""
+import re
+from datetime import date, datetime
+from functools import cache
+
+from docs import DOC_REGISTRY
+
+US_STATES = (
+    "Alabama", "Alaska", "Arizona", "Arkansas", "California", "Colorado", "Connecticut",
+    "Delaware", "Florida", "Georgia", "Hawaii", "Idaho", "Illinois", "Indiana", "Iowa",
+    "Kansas", "Kentucky", "Louisiana", "Maine", "Maryland", "Massachusetts", "Michigan",
+    "Minnesota", "Mississippi", "Missouri", "Montana", "Nebraska", "Nevada", "New Hampshire",
+    "New Jersey", "New Mexico", "New York", "North Carolina", "North Dakota", "Ohio",
+    "Oklahoma", "Oregon", "Pennsylvania", "Rhode Island", "South Carolina", "South Dakota",
+    "Tennessee", "Texas", "Utah", "Vermont", "Virginia", "Washington", "West Virginia",
+    "Wisconsin", "Wyoming",
+)
+EU_MEMBER_STATES = (
+    "Austria", "Belgium", "Bulgaria", "Croatia", "Cyprus", "Czechia", "Denmark", "Estonia",
+    "Finland", "France", "Germany", "Greece", "Hungary", "Ireland", "Italy", "Latvia",
+    "Lithuania", "Luxembourg", "Malta", "Netherlands", "Poland", "Portugal", "Romania",
+    "Slovakia", "Slovenia", "Spain", "Sweden",
+)
+_NUMBER_WORDS = {
+    "one": 1, "two": 2, "three": 3, "four": 4, "five": 5,
+    "six": 6, "seven": 7, "eight": 8, "nine": 9, "ten": 10,
+}
+
+_FIELD_LINE = re.compile(r"^- (\w+): (.+)$", re.MULTILINE)
+_ISO_DATE = re.compile(r"\b(\d{4})-(\d{1,2})-(\d{1,2})\b")
+_US_DATE = re.compile(r"\b(\d{1,2})/(\d{1,2})/(\d{4})\b")
+_MONTHS = "January|February|March|April|May|June|July|August|September|October|November|December"
+_MONTH_FIRST = re.compile(rf"\b({_MONTHS})\.?\s+(\d{{1,2}})(?:st|nd|rd|th)?,?\s+(\d{{4}})\b", re.I)
+_DAY_FIRST = re.compile(rf"\b(\d{{1,2}})(?:st|nd|rd|th)?\s+({_MONTHS})\.?,?\s+(\d{{4}})\b", re.I)
+_YEARS = re.compile(rf"\b(\d{{1,2}}|{'|'.join(_NUMBER_WORDS)})\s*(?:-\s*)?years?\b", re.I)
+_BARE_NUMBER = re.compile(r"^\s*(\d{1,2})\s*\.?\s*$")
+_CAMEL = re.compile(r"[A-Z]?[a-z]+|\d+")
+_WORD = re.compile(r"[a-z0-9]+")
+
+
+def _place_pattern(names: tuple[str, ...]) -> re.Pattern:
+    return re.compile(r"\b(" + "|".join(re.escape(n) for n in names) + r")\b", re.I)
+
+
+_US_STATE = _place_pattern(US_STATES)
+_EU_STATE = _place_pattern(EU_MEMBER_STATES)
+
+
+def _dates(text: str) -> set[str]:
+    found = set()
+
+    def add(year: int, month: int, day: int) -> None:
+        try:
+            found.add(date(year, month, day).isoformat())
+        except ValueError:
+            pass
+
+    for y, m, d in _ISO_DATE.findall(text):
+        add(int(y), int(m), int(d))
+    for m, d, y in _US_DATE.findall(text):
+        add(int(y), int(m), int(d))
+    for month, d, y in _MONTH_FIRST.findall(text):
+        add(int(y), datetime.strptime(month[:3], "%b").month, int(d))
+    for d, month, y in _DAY_FIRST.findall(text):
+        add(int(y), datetime.strptime(month[:3], "%b").month, int(d))
+    return found
+
+
+def _places(pattern: re.Pattern, names: tuple[str, ...], text: str) -> set[str]:
+    canonical = {n.lower(): n for n in names}
+    return {canonical[" ".join(m.lower().split())] for m in pattern.findall(text)}
+
+
+def _years(text: str) -> set[str]:
+    found = {str(_NUMBER_WORDS.get(n.lower()) or int(n)) for n in _YEARS.findall(text)}
+    if not found and (bare := _BARE_NUMBER.match(text)):
+        found.add(str(int(bare.group(1))))
+    return found
+
+
+# Description phrase -> value extractor for that kind of field.
+_KINDS = {
+    "ISO format YYYY-MM-DD": _dates,
+    "EU member state": lambda text: _places(_EU_STATE, EU_MEMBER_STATES, text),
+    "US state": lambda text: _places(_US_STATE, US_STATES, text),
+    "Number of years": _years,
+}
+
+# Words in a question that ask for a value of each kind, besides the field's own name.
+_ASKED_BY = {
+    "ISO format YYYY-MM-DD": {"date", "when", "start", "starts", "begin", "begins", "effective"},
+    "EU member state": {"state", "country", "law", "governing", "jurisdiction"},
+    "US state": {"state", "law", "governing", "jurisdiction"},
+    "Number of years": {"years", "year", "long", "term", "duration"},
+}
+
+
+@cache
+def field_kinds(doc_type: str) -> dict[str, str]:
+    """Map each extractable field of doc_type to the description phrase that identifies its kind."""
+    config = DOC_REGISTRY.get(doc_type)
+    if config is None:
+        return {}
+    kinds = {}
+    for name, description in _FIELD_LINE.findall(config.prompt):
+        if name not in config.fields_class.model_fields:
+            continue
+        kind = next((k for k in _KINDS if k in description), None)
+        if kind is not None:
+            kinds[name] = kind
+    return kinds
+
+
+def _pick(candidates: list[str], kind: str, question: str) -> str | None:
+    """Choose the one open field a value belongs to, using the assistant's last question.
+
+    A value is only taken when the question asks for it: a state inside a
+    company name or street address given for another question is not one.
+    """
+    words = {name: {w.lower() for w in _CAMEL.findall(name)} for name in candidates}
+    asked = set(_WORD.findall(question.lower()))
+    if len(candidates) == 1:
+        [name] = candidates
+        return name if (words[name] | _ASKED_BY[kind]) & asked else None
+    shared = set.intersection(*words.values())
+    mentioned = [name for name in candidates if (words[name] - shared) & asked]
+    return mentioned[0] if len(mentioned) == 1 else None
+
+
+def extract_fields(messages: list[dict], current_fields: dict, doc_type: str) -> dict:
+    """Return fields that can be filled from the latest user message without the LLM."""
+    kinds = field_kinds(doc_type)
+    if not kinds or not messages or messages[-1].get("role") != "user":
+        return {}
+    text = messages[-1]["content"]
+    question = next(
+        (m["content"] for m in reversed(messages[:-1]) if m.get("role") == "assistant"), ""
+    )
+
+    extracted = {}
+    for kind, extract in _KINDS.items():
+        open_fields = [
+            name for name, k in kinds.items() if k == kind and not current_fields.get(name)
+        ]
+        if not open_fields:
+            continue
+        values = extract(text)
+        if len(values) != 1:
+            continue
+        name = _pick(open_fields, kind, question)
+        if name is not None:
+            extracted[name] = values.pop()
+    return extracted
+
+
+def reconcile(speculative: dict, llm_fields: dict, previous: dict) -> dict:
+    """Fields to send once the LLM has answered.
+
+    The LLM's fields win. A speculative value the LLM did not confirm is
+    reverted to what the field held before the turn ("" if it was empty).
+    """
+    reverted = {
+        name: previous.get(name, "") for name in speculative if name not in llm_fields
+    }
+    return {**reverted, **llm_fields}
@@ -0,0 +1,44 @@
+"""Bounds the conversation history sent upstream on each chat turn.
+
+The client re-sends the full conversation every turn. Only the most recent
+messages are forwarded verbatim; older turns are replaced by a short note,
+since the fields extracted from them are already sent with every request.
+"""
+import os
+
+# Most recent messages forwarded verbatim, before the token budget is applied.
+MAX_MESSAGES = int(os.environ.get("HISTORY_MAX_MESSAGES", "16"))
+
+OMITTED_NOTE = (
+    "{count} earlier messages of this conversation were omitted to save space. "
+    "Everything learned from them is in the fields already collected; "
+    "do not ask for those again."
+)
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (~4 characters per token) good enough for budgeting."""
+    return len(text) // 4 + 1
+
+
+def compact_history(
+    messages: list[dict], token_budget: int, max_messages: int = MAX_MESSAGES
+) -> list[dict]:
+    """Keep the newest messages that fit the budget, noting how many were dropped.
+
+    The latest message is always kept, even if it alone exceeds the budget.
+    """
+    kept: list[dict] = []
+    used = 0
+    for message in reversed(messages[-max_messages:]):
+        cost = estimate_tokens(message["content"])
+        if kept and used + cost > token_budget:
+            break
+        kept.append(message)
+        used += cost
+    kept.reverse()
+
+    omitted = len(messages) - len(kept)
+    if not omitted:
+        return messages
+    return [{"role": "system", "content": OMITTED_NOTE.format(count=omitted)}] + kept
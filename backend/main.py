@@ -1,44 +1,99 @@
 import asyncio
 import json
 import os
-import sqlite3
+import time
 from contextlib import asynccontextmanager
+from dataclasses import asdict
 
 from dotenv import load_dotenv
-from fastapi import FastAPI
-from fastapi.responses import FileResponse, StreamingResponse
-from fastapi.staticfiles import StaticFiles
+from fastapi import FastAPI, Header, HTTPException, Request
+from fastapi.responses import FileResponse, PlainTextResponse, StreamingResponse
 from pydantic import BaseModel
 
 load_dotenv()  # loads .env from cwd or parent dirs; Docker injects vars via env_file
 
-from ai import chat_completion  # noqa: E402 (must be after load_dotenv)
-from template_renderer import render_template  # noqa: E402
+import batch  # noqa: E402
+import profiling  # noqa: E402
+import sse  # noqa: E402
+from admission import IN_PROGRESS, NEW, Admission, Rejected  # noqa: E402
+from agreements import get_standard_terms, prerender_standard_terms, render_agreement  # noqa: E402
+from ai import ChatResult, aclose, limiter, router, stream_chat_completion, usage_stats, warm_up  # noqa: E402 (must be after load_dotenv)
+from classifier import classify, get_index  # noqa: E402
+from docs import DOC_REGISTRY  # noqa: E402
+from docgen import FORMATS, unsupported_pdf_characters  # noqa: E402
+from exports import ExportQueue, QueueFull  # noqa: E402
+from extractor import extract_fields, reconcile  # noqa: E402
+from metrics import (  # noqa: E402
+    CONTENT_TYPE,
+    MetricsMiddleware,
+    cache_lookups,
+    classifications,
+    errors,
+    observe_parse,
+    registry,
+    stage_duration,
+)
+from response_cache import (  # noqa: E402
+    cache_key,
+    chat_cache,
+    normalize_fields,
+    normalize_messages,
+)
+from migrations import migrate  # noqa: E402
+from sessions import SessionStore  # noqa: E402
+from singleflight import FlightGroup  # noqa: E402
+from static_files import StaticIndex  # noqa: E402
+from template_renderer import get_compiled, render_template  # noqa: E402
 
 STATIC_DIR = os.path.join(os.path.dirname(__file__), "static")
-DB_PATH = os.path.join(os.path.dirname(__file__), "prelegal.db")
+DB_PATH = os.environ.get("PRELEGAL_DB") or os.path.join(os.path.dirname(__file__), "prelegal.db")
+# Import litellm and build response formats before accepting traffic, rather
+# than on the first chat turn.
+WARMUP = os.environ.get("PRELEGAL_WARMUP", "").lower() in ("1", "true", "yes")
 
 
 def init_db():
-    """Create fresh SQLite database with initial schema."""
-    if os.path.exists(DB_PATH):
-        os.remove(DB_PATH)
-    conn = sqlite3.connect(DB_PATH)
-    conn.execute(
-        "CREATE TABLE users (id INTEGER PRIMARY KEY, email TEXT UNIQUE, "
-        "created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)"
-    )
-    conn.commit()
-    conn.close()
+    """Create or migrate the SQLite schema; existing data is kept across restarts."""
+    migrate(DB_PATH)
+
+
+sessions = SessionStore(DB_PATH)
+admission = Admission()
+chat_flights = FlightGroup()
+exports = ExportQueue(DB_PATH)
+static_index: StaticIndex | None = None
+
+
+def get_static_index() -> StaticIndex | None:
+    """Index the frontend export on first use; None if it hasn't been built."""
+    global static_index
+    if static_index is None and os.path.exists(STATIC_DIR):
+        static_index = StaticIndex.build(STATIC_DIR)
+    return static_index
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     init_db()
+    prerender_standard_terms()
+    get_index()
+    get_static_index()
+    if WARMUP:
+        await asyncio.to_thread(warm_up)
+    await sessions.start()
+    await exports.start()
     yield
+    await chat_flights.aclose()
+    await exports.stop()
+    await sessions.stop()
+    await aclose()
+    batch.shutdown()
 
 
 app = FastAPI(title="Prelegal API", lifespan=lifespan)
+app.add_middleware(MetricsMiddleware)
+if profiling.enabled():
+    app.add_middleware(profiling.ProfilingMiddleware)
 
 
 @app.get("/api/health")
@@ -46,80 +101,370 @@ async def health():
     return {"status": "ok"}
 
 
+@app.get("/metrics")
+async def metrics():
+    """Prometheus text exposition of request, stage, token, cache and error metrics."""
+    return PlainTextResponse(registry.render(), media_type=CONTENT_TYPE)
+
+
+@app.get("/api/stats")
+async def stats():
+    """Report in-process counters for upstream LLM concurrency, routing and token usage.
+
+    With several workers, each reports its own counters; "worker" says which answered.
+    """
+    return {
+        "worker": os.getpid(),
+        "admission": admission.snapshot(),
+        "upstream": limiter.snapshot(),
+        "routing": router.snapshot(),
+        "usage": {doc_type: asdict(s) for doc_type, s in usage_stats.items()},
+        "cache": {"chat": chat_cache.stats()},
+        "single_flight": {"chat": chat_flights.stats()},
+        "sessions": sessions.stats(),
+        "exports": exports.stats(),
+    }
+
+
 class ChatMessage(BaseModel):
     role: str
     content: str
 
 
 class ChatRequest(BaseModel):
-    messages: list[ChatMessage]
-    fields: dict
+    messages: list[ChatMessage] = []
+    fields: dict = {}
+    doc_type: str = "mnda"
+    # With a session, the client sends only the new user message.
+    session_id: str | None = None
+    message: str | None = None
+
+
+class SessionRequest(BaseModel):
     doc_type: str = "mnda"
 
 
 class PreviewRequest(BaseModel):
     doc_type: str
     fields: dict
+    annotate: bool = False
+
+
+class ExportRequest(BaseModel):
+    doc_type: str
+    fields: dict = {}
+    format: str = "pdf"
+
+
+class SlotsRequest(BaseModel):
+    doc_type: str
+    fields: dict
+
+
+class BatchPreviewRequest(BaseModel):
+    items: list[SlotsRequest]
+
+
+# Joins the classifier's reply and the first drafting reply in a chained turn.
+CHAIN_SEPARATOR = "\n\n"
+BATCH_MAX_ITEMS = int(os.environ.get("BATCH_MAX_ITEMS", "5000"))
+
+
+def doc_label(doc_type: str) -> str:
+    """A doc type as a metrics label: registered types as-is, anything a client made up as "other"."""
+    return doc_type if doc_type in DOC_REGISTRY else "other"
+
+
+async def timed_emit(frames, doc_type: str):
+    """Pass SSE frames through, recording time spent handing them to the client."""
+    emitting = 0.0
+    async for frame in frames:
+        start = time.perf_counter()
+        yield frame
+        emitting += time.perf_counter() - start
+    stage_duration.observe(emitting, stage="sse_emit", doc_type=doc_type)
+
+
+@app.post("/api/sessions")
+async def create_session(request: SessionRequest):
+    """Start a server-side drafting session."""
+    if request.doc_type not in DOC_REGISTRY:
+        raise HTTPException(status_code=422, detail=f"Unknown doc_type: {request.doc_type}")
+    return asdict(await sessions.create(request.doc_type))
+
+
+@app.get("/api/sessions/{session_id}")
+async def get_session(session_id: str):
+    """Return a session's doc type, collected fields and message history."""
+    session = await sessions.get(session_id)
+    if session is None:
+        raise HTTPException(status_code=404, detail="Session not found")
+    return asdict(session)
 
 
 @app.post("/api/chat")
-async def chat(request: ChatRequest):
+async def chat(request: ChatRequest, http_request: Request):
     """Stream AI chat response with extracted document fields."""
+    observe_parse(http_request.scope, doc_label(request.doc_type))
     messages = [m.model_dump() for m in request.messages]
-    result = await asyncio.to_thread(
-        chat_completion, messages, request.fields, request.doc_type
-    )
+    fields = request.fields
+    doc_type = request.doc_type
+    session = None
+    if request.session_id:
+        session = await sessions.get(request.session_id)
+        if session is None:
+            raise HTTPException(status_code=404, detail="Session not found")
+        if not request.message:
+            raise HTTPException(status_code=422, detail="message is required with session_id")
+        messages = session.messages + [{"role": "user", "content": request.message}]
+        fields = {**session.fields, **fields}
+        doc_type = session.doc_type
+
+    client = http_request.client.host if http_request.client else "unknown"
+    label = doc_label(doc_type)
+    key = cache_key(doc_type, normalize_messages(messages), normalize_fields(fields))
+    # Identical turns in flight share one upstream call; a session's turn
+    # is only identical to a retry of itself.
+    flight_key = cache_key(key, request.session_id)
+    flight = chat_flights.get(flight_key)
+    cached = await chat_cache.get(key) if flight is None else None
+    if flight is None:
+        cache_lookups.inc(cache="chat", doc_type=label, result="miss" if cached is None else "hit")
+    ticket = None
+    try:
+        admission.check_client(client)
+        if cached is None and flight is None:
+            # Only turns that reach the LLM wait for a slot; cache hits are cheap.
+            in_progress = session is not None or any(m["role"] == "assistant" for m in messages)
+            with stage_duration.time(stage="admission", doc_type=label):
+                ticket = await admission.acquire(IN_PROGRESS if in_progress else NEW)
+    except Rejected as exc:
+        errors.inc(doc_type=label, error=f"rejected_{exc.status_code}")
+        raise HTTPException(status_code=exc.status_code, detail=exc.detail, headers=exc.headers)
 
     async def generate():
-        words = result.reply.split(" ")
-        for i, word in enumerate(words):
-            chunk = word if i == len(words) - 1 else word + " "
-            yield f"data: {json.dumps({'type': 'text', 'delta': chunk})}\n\n"
-
-        # Emit doc_type event for the "unknown" classifier flow
-        if request.doc_type == "unknown":
-            detected = result.fields.get("detectedDocType")
+        speculative = {}
+        if cached is not None:
+            result = ChatResult(reply=cached["reply"], fields=cached["fields"])
+            detected = cached.get("detected")
+            yield {"type": "text", "delta": result.reply}
+            if detected:
+                yield {"type": "doc_type", "data": detected}
+        else:
+            # Fill obvious fields from the user's answer while the LLM works.
+            speculative = extract_fields(messages, fields, doc_type)
+            if speculative:
+                yield {"type": "fields", "data": speculative, "speculative": True}
+            result = None
+            detected = None
+            if doc_type == "unknown":
+                # A clear match in the local index skips the LLM classifier turn.
+                detected = classify(messages).doc_type
+                classifications.inc(classifier="local" if detected else "llm")
+            if detected:
+                reply = f"It sounds like a {DOC_REGISTRY[detected].name} is the right fit."
+                result = ChatResult(reply=reply, fields={})
+                yield {"type": "text", "delta": result.reply}
+            else:
+                async for item in stream_chat_completion(messages, fields, doc_type):
+                    if isinstance(item, ChatResult):
+                        result = item
+                    else:
+                        yield {"type": "text", "delta": item}
+                # Emit doc_type event for the "unknown" classifier flow
+                detected = result.fields.get("detectedDocType") if doc_type == "unknown" else None
+                if detected not in DOC_REGISTRY or detected == "unknown":
+                    detected = None
             if detected:
-                yield f"data: {json.dumps({'type': 'doc_type', 'data': detected})}\n\n"
+                yield {"type": "doc_type", "data": detected}
+                # Chain into the detected doc type's prompt so the first
+                # drafting question arrives in this turn, not the next one.
+                classifier_reply = result.reply
+                yield {"type": "text", "delta": CHAIN_SEPARATOR}
+                async for item in stream_chat_completion(messages, {}, detected):
+                    if isinstance(item, ChatResult):
+                        result = ChatResult(
+                            reply=classifier_reply + CHAIN_SEPARATOR + item.reply, fields=item.fields
+                        )
+                    else:
+                        yield {"type": "text", "delta": item}
+            await chat_cache.set(key, {**asdict(result), "detected": detected})
+
+        reconciled = reconcile(speculative, result.fields, fields)
+        yield {"type": "fields", "data": reconciled}
+
+        if session is not None:
+            await sessions.append(
+                session.id,
+                [messages[-1], {"role": "assistant", "content": result.reply}],
+                result.fields if detected else {**fields, **result.fields},
+                detected or doc_type,
+            )
+        yield {"type": "done"}
+
+    if cached is None:
+        if flight is None:
+            # A duplicate may have started while this one waited for admission.
+            flight = chat_flights.get(flight_key)
+            if flight is not None:
+                ticket.release()
+            else:
+                flight = chat_flights.start(flight_key, generate(), on_done=ticket.release)
+        events = flight.subscribe()
+    else:
+        events = generate()
+    return StreamingResponse(timed_emit(sse.stream(events), label), media_type="text/event-stream")
 
-        yield f"data: {json.dumps({'type': 'fields', 'data': result.fields})}\n\n"
-        yield f"data: {json.dumps({'type': 'done'})}\n\n"
 
-    return StreamingResponse(generate(), media_type="text/event-stream")
+@app.post("/api/preview")
+async def preview(request: PreviewRequest, http_request: Request):
+    """Render document template with substituted fields, returning HTML.
+
+    With annotate, slots are wrapped so /api/preview/slots patches can be applied.
+    """
+    label = doc_label(request.doc_type)
+    observe_parse(http_request.scope, label)
+    # Rendering a compiled template takes microseconds; caching it would cost more.
+    with stage_duration.time(stage="render", doc_type=label):
+        compiled = get_compiled(request.doc_type)
+        if compiled is None:
+            return {"html": render_template(request.doc_type, request.fields), "version": None}
+        html = compiled.render(request.fields, request.annotate)
+    return {"html": html, "version": compiled.version}
+
+
+@app.post("/api/preview/batch")
+async def preview_batch(request: BatchPreviewRequest):
+    """Render many cover pages, streaming NDJSON results in completion order.
+
+    Each line is {"index", "doc_type", "html"} or {"index", "doc_type", "error"}.
+    """
+    if len(request.items) > BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=413, detail=f"At most {BATCH_MAX_ITEMS} items per batch")
+    items = [(item.doc_type, item.fields) for item in request.items]
 
+    async def generate():
+        async for result in batch.render_batch(items):
+            yield json.dumps(result) + "\n"
 
-@app.post("/api/preview")
-async def preview(request: PreviewRequest):
-    """Render document template with substituted fields, returning HTML."""
-    html = render_template(request.doc_type, request.fields)
+    return StreamingResponse(generate(), media_type="application/x-ndjson")
+
+
+@app.post("/api/preview/slots")
+async def preview_slots(request: SlotsRequest):
+    """Render only the changed fields' slots for patching an annotated preview.
+
+    Clients compare the returned version with the one from their last full
+    render and fall back to /api/preview when the template has changed.
+    """
+    compiled = get_compiled(request.doc_type)
+    if compiled is None:
+        raise HTTPException(status_code=404, detail=f"No template for {request.doc_type}")
+    return {"version": compiled.version, "slots": compiled.render_slots(request.fields)}
+
+
+@app.post("/api/agreement")
+async def agreement(request: PreviewRequest):
+    """Render the full agreement: cover page followed by the standard terms."""
+    with stage_duration.time(stage="render", doc_type=doc_label(request.doc_type)):
+        html = render_agreement(request.doc_type, request.fields)
+    if html is None:
+        raise HTTPException(status_code=404, detail=f"No standard terms for {request.doc_type}")
     return {"html": html}
 
 
-if os.path.exists(STATIC_DIR):
-    next_static = os.path.join(STATIC_DIR, "_next")
-    if os.path.exists(next_static):
-        app.mount("/_next", StaticFiles(directory=next_static), name="next-assets")
+@app.get("/api/agreement/{doc_type}/sections")
+async def agreement_sections(doc_type: str):
+    """List the standard terms' top-level sections so clients can fetch them by anchor."""
+    terms = get_standard_terms(doc_type)
+    if terms is None:
+        raise HTTPException(status_code=404, detail=f"No standard terms for {doc_type}")
+    return {"title": terms.title, "sections": [s.summary() for s in terms.sections]}
+
+
+@app.get("/api/agreement/{doc_type}/sections/{anchor}")
+async def agreement_section(doc_type: str, anchor: str):
+    """Return a single pre-rendered section of the standard terms."""
+    terms = get_standard_terms(doc_type)
+    section = terms.section(anchor) if terms else None
+    if section is None:
+        raise HTTPException(status_code=404, detail=f"No section {anchor} for {doc_type}")
+    return {**section.summary(), "html": section.html}
+
+
+@app.post("/api/exports", status_code=202)
+async def create_export(request: ExportRequest):
+    """Queue a PDF or DOCX export of the full agreement; poll the returned id for completion."""
+    if request.doc_type not in DOC_REGISTRY:
+        raise HTTPException(status_code=404, detail=f"No template for {request.doc_type}")
+    if request.format not in FORMATS:
+        raise HTTPException(status_code=422, detail=f"format must be one of {', '.join(FORMATS)}")
+    if request.format == "pdf" and (chars := unsupported_pdf_characters(request.fields)):
+        # The PDF fonts cover Western European text only; substituting would corrupt party names.
+        raise HTTPException(
+            status_code=422, detail=f"PDF export cannot show {chars!r}; export as DOCX to keep these characters"
+        )
+    try:
+        job = await exports.submit(request.doc_type, request.fields, request.format)
+    except QueueFull:
+        raise HTTPException(status_code=503, detail="Export queue is full", headers={"Retry-After": "5"})
+    return job.summary()
+
+
+@app.get("/api/exports/{job_id}")
+async def get_export(job_id: str):
+    """Report an export's status: queued, running, done, failed or expired."""
+    job = await exports.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Export not found")
+    return job.summary()
+
+
+@app.get("/api/exports/{job_id}/download")
+async def download_export(job_id: str):
+    """Return a finished export's file."""
+    job = await exports.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Export not found")
+    if job.status == "expired":
+        raise HTTPException(status_code=410, detail="Export has expired; submit it again")
+    if job.status != "done":
+        raise HTTPException(status_code=409, detail=f"Export is {job.status}")
+    return FileResponse(
+        exports.path(job),
+        media_type=FORMATS[job.format],
+        filename=f"{job.doc_type}.{job.format}",
+        headers={"Cache-Control": "private, max-age=31536000, immutable"},
+    )
 
 
-@app.get("/{path:path}")
-async def serve_frontend(path: str):
-    """Serve Next.js static export, falling back to index.html."""
-    if not os.path.exists(STATIC_DIR):
-        return {"error": "Frontend not built"}
+def require_profile_token(token: str | None) -> None:
+    # 404 rather than 403 so the endpoints don't advertise themselves.
+    if not profiling.authorized(token):
+        raise HTTPException(status_code=404, detail="Not found")
+
 
-    if not path or path == "/":
-        return FileResponse(os.path.join(STATIC_DIR, "index.html"))
+@app.get("/api/profiles")
+async def list_profiles(x_prelegal_profile: str | None = Header(default=None)):
+    """List recent request profiles, newest first. Requires the profiling token."""
+    require_profile_token(x_prelegal_profile)
+    return {"profiles": await asyncio.to_thread(profiling.list_profiles, profiling.PROFILE_DIR)}
 
-    exact = os.path.join(STATIC_DIR, path)
-    if os.path.isfile(exact):
-        return FileResponse(exact)
 
-    dir_index = os.path.join(STATIC_DIR, path, "index.html")
-    if os.path.isfile(dir_index):
-        return FileResponse(dir_index)
+@app.get("/api/profiles/{profile_id}")
+async def get_profile(profile_id: str, x_prelegal_profile: str | None = Header(default=None)):
+    """Return one profile in speedscope's format. Requires the profiling token."""
+    require_profile_token(x_prelegal_profile)
+    path = profiling.profile_path(profile_id, profiling.PROFILE_DIR)
+    if path is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return FileResponse(path, media_type="application/json", filename=path.name)
 
-    html_file = exact + ".html"
-    if os.path.isfile(html_file):
-        return FileResponse(html_file)
 
-    return FileResponse(os.path.join(STATIC_DIR, "index.html"))
+@app.get("/{path:path}")
+async def serve_frontend(path: str, request: Request):
+    """Serve Next.js static export, falling back to index.html."""
+    index = get_static_index()
+    if index is None:
+        return {"error": "Frontend not built"}
+    return index.respond(path, request)
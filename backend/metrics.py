@@ -0,0 +1,202 @@
+"""In-process Prometheus metrics, exposed in the text exposition format.
+
+Counters and histograms are kept per label set in plain dicts; /metrics
+renders them on scrape. There is no client library or push gateway: any
+Prometheus-compatible scraper can read the endpoint directly.
+
+Each server process keeps its own metrics, and every sample carries a
+worker label (the process id), so series from different uvicorn workers
+never mix; aggregate across workers in queries, e.g. sum without (worker).
+"""
+import bisect
+import math
+import os
+import time
+from contextlib import contextmanager
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Seconds; spans cache hits (sub-millisecond) to slow LLM turns.
+DEFAULT_BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0,
+)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: tuple[str, ...], values: tuple, extra: str = "") -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _number(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labels: tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.label_names = labels
+        self._values: dict[tuple, float] = {}
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = tuple(labels[name] for name in self.label_names)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(tuple(labels[name] for name in self.label_names), 0)
+
+    def render(self, constant: str = "") -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for key, value in sorted(self._values.items()):
+            lines.append(f"{self.name}{_labels(self.label_names, key, constant)} {_number(value)}")
+        return lines
+
+
+class Histogram:
+    def __init__(
+        self, name: str, help: str, labels: tuple[str, ...] = (), buckets: tuple[float, ...] = DEFAULT_BUCKETS
+    ):
+        self.name = name
+        self.help = help
+        self.label_names = labels
+        self.buckets = tuple(sorted(buckets))
+        # label values -> [per-bucket counts..., +Inf count, sum]
+        self._series: dict[tuple, list[float]] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        key = tuple(labels[name] for name in self.label_names)
+        series = self._series.get(key)
+        if series is None:
+            series = self._series[key] = [0] * (len(self.buckets) + 1) + [0.0]
+        series[bisect.bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def count(self, **labels) -> int:
+        series = self._series.get(tuple(labels[name] for name in self.label_names))
+        return int(sum(series[:-1])) if series else 0
+
+    def render(self, constant: str = "") -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        prefix = f"{constant}," if constant else ""
+        for key, series in sorted(self._series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), series[:-1]):
+                cumulative += count
+                le = _labels(self.label_names, key, f'{prefix}le="{_number(bound)}"')
+                lines.append(f"{self.name}_bucket{le} {cumulative}")
+            labels = _labels(self.label_names, key, constant)
+            lines.append(f"{self.name}_sum{labels} {_number(series[-1])}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class Registry:
+    def __init__(self, worker_label: bool = False):
+        self.worker_label = worker_label
+        self._metrics: list[Counter | Histogram] = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        # Read at render time: the registry may be created before workers fork.
+        constant = f'worker="{os.getpid()}"' if self.worker_label else ""
+        lines: list[str] = []
+        for metric in self._metrics:
+            lines.extend(metric.render(constant))
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry(worker_label=True)
+
+http_requests = registry.register(Counter(
+    "prelegal_http_requests_total", "HTTP requests by route and status.", ("method", "route", "status"),
+))
+http_duration = registry.register(Histogram(
+    "prelegal_http_request_duration_seconds",
+    "Time from request start until the last response byte is sent.",
+    ("method", "route"),
+))
+stage_duration = registry.register(Histogram(
+    "prelegal_stage_duration_seconds",
+    "Time spent in each stage of request handling.",
+    ("stage", "doc_type"),
+))
+llm_tokens = registry.register(Counter(
+    "prelegal_llm_tokens_total", "Tokens reported by the upstream provider.", ("doc_type", "kind"),
+))
+cache_lookups = registry.register(Counter(
+    "prelegal_cache_lookups_total", "Response cache lookups by outcome.", ("cache", "doc_type", "result"),
+))
+classifications = registry.register(Counter(
+    "prelegal_classifications_total",
+    "Unknown-flow turns by classifier: the local index, or the LLM when it was unsure.",
+    ("classifier",),
+))
+errors = registry.register(Counter(
+    "prelegal_errors_total", "Errors by class.", ("doc_type", "error"),
+))
+
+
+# ASGI scope key holding the request's start time, for stages timed from it.
+START_KEY = "prelegal.start"
+
+
+def observe_parse(scope: dict, doc_type: str) -> None:
+    """Record time from request arrival until the handler has its parsed body."""
+    start = scope.get(START_KEY)
+    if start is not None:
+        stage_duration.observe(time.perf_counter() - start, stage="parse", doc_type=doc_type)
+
+
+class MetricsMiddleware:
+    """ASGI middleware recording a count and duration for every HTTP request.
+
+    Requests are labelled by route template (e.g. /api/sessions/{session_id})
+    so label cardinality stays bounded; the duration runs until the final
+    body chunk, so streamed responses are timed in full.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        scope[START_KEY] = start
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = scope.get("route")
+            label = getattr(route, "path", None) or "unmatched"
+            method = scope["method"]
+            http_requests.inc(method=method, route=label, status=str(status))
+            http_duration.observe(time.perf_counter() - start, method=method, route=label)
@@ -0,0 +1,63 @@
+"""Schema migrations for the application database, applied at startup.
+
+PRAGMA user_version records how many migrations a database has had. The
+version check and the migrations run in one BEGIN IMMEDIATE transaction, so
+when several workers boot at once the first applies them and the others wait,
+then find the schema current. Add new steps to the end of MIGRATIONS; never
+edit or reorder existing ones.
+"""
+from sessions import connect
+
+MIGRATIONS: tuple[tuple[str, ...], ...] = (
+    # 1: initial schema. IF NOT EXISTS because databases created before
+    # versioning already have these tables at user_version 0.
+    (
+        "CREATE TABLE IF NOT EXISTS users (id INTEGER PRIMARY KEY, email TEXT UNIQUE, "
+        "created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)",
+        "CREATE TABLE IF NOT EXISTS sessions (id TEXT PRIMARY KEY, doc_type TEXT NOT NULL, "
+        "fields TEXT NOT NULL DEFAULT '{}', created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP, "
+        "updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)",
+        "CREATE TABLE IF NOT EXISTS session_messages (session_id TEXT NOT NULL "
+        "REFERENCES sessions (id), seq INTEGER NOT NULL, role TEXT NOT NULL, "
+        "content TEXT NOT NULL, PRIMARY KEY (session_id, seq))",
+    ),
+    # 2: background PDF/DOCX exports.
+    (
+        "CREATE TABLE export_jobs (id TEXT PRIMARY KEY, doc_type TEXT NOT NULL, "
+        "format TEXT NOT NULL, cache_key TEXT NOT NULL, status TEXT NOT NULL, error TEXT, "
+        "created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP, updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)",
+    ),
+    # 3: which server process ("host:pid") holds an export job, so jobs of
+    # a process that died can be failed; and an index for expiry sweeps.
+    (
+        "ALTER TABLE export_jobs ADD COLUMN owner TEXT",
+        "CREATE INDEX export_jobs_created_at ON export_jobs (created_at)",
+    ),
+    # 4: index for sweeping idle sessions.
+    (
+        "CREATE INDEX sessions_updated_at ON sessions (updated_at)",
+    ),
+)
+
+
+def migrate(db_path: str, migrations: tuple[tuple[str, ...], ...] = MIGRATIONS) -> int:
+    """Bring the database at db_path up to date; returns the resulting version."""
+    conn = connect(db_path)
+    conn.isolation_level = None  # transactions are managed explicitly below
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            version = conn.execute("PRAGMA user_version").fetchone()[0]
+            for statements in migrations[version:]:
+                for sql in statements:
+                    conn.execute(sql)
+            if version < len(migrations):
+                version = len(migrations)
+                conn.execute(f"PRAGMA user_version = {version}")
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return version
+    finally:
+        conn.close()
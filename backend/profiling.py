@@ -0,0 +1,195 @@
+"""On-demand sampling profiles of individual API requests.
+
+Off unless PROFILE_TOKEN or PROFILE_SAMPLE_RATE is set; when off, the
+middleware is not installed and requests run exactly as before. When on, a
+request is profiled if it carries the PROFILE_HEADER with the token, or at
+random with probability PROFILE_SAMPLE_RATE. A sampler thread records every
+thread's stack each PROFILE_INTERVAL for the duration of the request, and
+the samples are written to PROFILE_DIR in speedscope's file format (open at
+https://www.speedscope.app or convert to a flamegraph). Samples cover the
+whole process, so requests served concurrently show up too.
+"""
+import asyncio
+import json
+import os
+import random
+import secrets
+import sys
+import threading
+import time
+from pathlib import Path
+
+PROFILE_DIR = Path(os.environ.get("PROFILE_DIR") or Path(__file__).resolve().parent / "profiles")
+# Shared secret: requests sending it in PROFILE_HEADER are profiled, and it
+# is required to list and fetch profiles.
+TOKEN = os.environ.get("PROFILE_TOKEN", "")
+# Fraction of /api requests profiled without the header.
+SAMPLE_RATE = float(os.environ.get("PROFILE_SAMPLE_RATE", "0"))
+INTERVAL = float(os.environ.get("PROFILE_INTERVAL", "0.001"))
+# Profiles kept on disk; the oldest are deleted beyond this.
+KEEP = int(os.environ.get("PROFILE_KEEP", "50"))
+
+PROFILE_HEADER = "x-prelegal-profile"
+SUFFIX = ".speedscope.json"
+
+
+def enabled() -> bool:
+    return bool(TOKEN) or SAMPLE_RATE > 0
+
+
+def authorized(token: str | None) -> bool:
+    return bool(TOKEN) and token is not None and secrets.compare_digest(token, TOKEN)
+
+
+class Sampler:
+    """Records the stack of every other thread at a fixed interval."""
+
+    def __init__(self, interval: float = INTERVAL):
+        self.interval = interval
+        self.frames: list[dict] = []
+        self._frame_ids: dict[tuple, int] = {}
+        # thread id -> ([stack of frame ids], [seconds]) per sample
+        self.samples: dict[int, tuple[list[list[int]], list[float]]] = {}
+        self.thread_names: dict[int, str] = {}
+        self.start = 0.0
+        self.end = 0.0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="profile-sampler", daemon=True)
+
+    def __enter__(self) -> "Sampler":
+        self.start = time.perf_counter()
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self._stop.set()
+        self._thread.join()
+        self.end = time.perf_counter()
+
+    def _frame_id(self, code) -> int:
+        key = (code.co_name, code.co_filename, code.co_firstlineno)
+        frame_id = self._frame_ids.get(key)
+        if frame_id is None:
+            frame_id = self._frame_ids[key] = len(self.frames)
+            name = getattr(code, "co_qualname", code.co_name)
+            self.frames.append({"name": name, "file": code.co_filename, "line": code.co_firstlineno})
+        return frame_id
+
+    def _run(self) -> None:
+        me = threading.get_ident()
+        last = self.start
+        # Sample on entry too, so even a request shorter than the interval has one.
+        while True:
+            now = time.perf_counter()
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == me:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(self._frame_id(frame.f_code))
+                    frame = frame.f_back
+                stack.reverse()
+                if thread_id not in self.samples:
+                    # Named now: the thread may be gone by the time the profile is written.
+                    self.thread_names.update((t.ident, t.name) for t in threading.enumerate())
+                stacks, weights = self.samples.setdefault(thread_id, ([], []))
+                stacks.append(stack)
+                weights.append(now - last)
+            last = now
+            if self._stop.wait(self.interval):
+                return
+
+    def speedscope(self, name: str) -> dict:
+        duration = self.end - self.start
+        return {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "name": name,
+            "exporter": "prelegal",
+            "shared": {"frames": self.frames},
+            "profiles": [
+                {
+                    "type": "sampled",
+                    "name": self.thread_names.get(thread_id, f"thread {thread_id}"),
+                    "unit": "seconds",
+                    "startValue": 0,
+                    "endValue": duration,
+                    "samples": stacks,
+                    "weights": weights,
+                }
+                for thread_id, (stacks, weights) in self.samples.items()
+            ],
+        }
+
+
+def new_id() -> str:
+    """A profile id; ids sort by creation time."""
+    return f"{time.strftime('%Y%m%d-%H%M%S')}-{secrets.token_hex(4)}"
+
+
+def save(profile_id: str, profile: dict, directory: Path = PROFILE_DIR, keep: int = KEEP) -> None:
+    """Write a profile and delete the oldest beyond keep."""
+    directory.mkdir(parents=True, exist_ok=True)
+    (directory / f"{profile_id}{SUFFIX}").write_text(json.dumps(profile))
+    for old in sorted(directory.glob(f"*{SUFFIX}"))[:-keep]:
+        old.unlink(missing_ok=True)
+
+
+def list_profiles(directory: Path = PROFILE_DIR) -> list[dict]:
+    """Saved profiles, newest first."""
+    profiles = []
+    for path in sorted(directory.glob(f"*{SUFFIX}"), reverse=True):
+        try:
+            with path.open() as f:
+                name = json.load(f).get("name", "")
+        except (OSError, ValueError):
+            continue
+        profiles.append({"id": path.name[: -len(SUFFIX)], "request": name, "bytes": path.stat().st_size})
+    return profiles
+
+
+def profile_path(profile_id: str, directory: Path = PROFILE_DIR) -> Path | None:
+    path = directory / f"{profile_id}{SUFFIX}"
+    # Ids are generated here; anything else (e.g. a path) is not one.
+    if path.parent != directory or not path.is_file():
+        return None
+    return path
+
+
+class ProfilingMiddleware:
+    """ASGI middleware profiling selected /api requests; install only when enabled()."""
+
+    def __init__(self, app, sample_rate: float = SAMPLE_RATE, directory: Path = PROFILE_DIR):
+        self.app = app
+        self.sample_rate = sample_rate
+        self.directory = directory
+
+    def _selected(self, scope) -> bool:
+        path = scope["path"]
+        if not path.startswith("/api/") or path.startswith("/api/profiles"):
+            return False
+        for name, value in scope["headers"]:
+            if name.decode("latin-1") == PROFILE_HEADER:
+                return authorized(value.decode("latin-1"))
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self._selected(scope):
+            await self.app(scope, receive, send)
+            return
+
+        profile_id = new_id()
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                # Tell the caller where to fetch the profile from.
+                message["headers"] = [*message.get("headers", []), (b"x-profile-id", profile_id.encode())]
+            await send(message)
+
+        with Sampler() as sampler:
+            await self.app(scope, receive, send_wrapper)
+        elapsed_ms = (sampler.end - sampler.start) * 1000
+        name = f"{scope['method']} {scope['path']} {status} {elapsed_ms:.0f}ms"
+        await asyncio.to_thread(save, profile_id, sampler.speedscope(name), self.directory)
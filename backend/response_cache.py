@@ -0,0 +1,163 @@
+"""Content-addressed LRU cache for chat turns.
+
+Entries live in memory with a TTL and a size cap. When a database path is
+given, entries are also written to SQLite so they survive restarts and can be
+shared between processes; that I/O runs on a dedicated thread, never on the
+event loop. Values must be JSON-serializable.
+"""
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any
+
+# Expired rows are purged from the persistent tier every this many writes.
+PRUNE_EVERY = 256
+
+
+def cache_key(*parts: Any) -> str:
+    """Stable SHA-256 key over the canonical JSON encoding of parts."""
+    canonical = json.dumps(parts, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+
+def normalize_messages(messages: list[dict]) -> list[list[str]]:
+    """Reduce messages to what affects the model: role and trimmed content."""
+    return [[m["role"], m["content"].strip()] for m in messages]
+
+
+def normalize_fields(fields: dict) -> dict:
+    """Drop empty values, which render and prompt the same as missing ones."""
+    return {k: v for k, v in fields.items() if v}
+
+
+class ResponseCache:
+    """In-memory LRU with TTL, optionally backed by a SQLite table."""
+
+    def __init__(self, name: str, max_entries: int, ttl_seconds: float, db_path: str | None = None):
+        self.name = name
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.db_path = db_path
+        self._entries: OrderedDict[str, tuple[float, Any]] = OrderedDict()
+        self._db: sqlite3.Connection | None = None
+        # One thread owns the connection; created on first persistent lookup.
+        self._db_thread: ThreadPoolExecutor | None = None
+        self.hits = 0
+        self.persistent_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._db_writes = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0 and self.ttl_seconds > 0
+
+    async def get(self, key: str) -> Any | None:
+        if not self.enabled:
+            return None
+        entry = self._entries.get(key)
+        if entry is not None:
+            expires_at, value = entry
+            if expires_at > time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return value
+            del self._entries[key]
+
+        value = await self._in_db_thread(self._db_get, key)
+        if value is not None:
+            self.persistent_hits += 1
+            self._remember(key, value)
+            return value
+        self.misses += 1
+        return None
+
+    async def set(self, key: str, value: Any) -> None:
+        if not self.enabled:
+            return
+        self._remember(key, value)
+        await self._in_db_thread(self._db_set, key, value)
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.persistent_hits + self.misses
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "persistent_hits": self.persistent_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round((self.hits + self.persistent_hits) / lookups, 4) if lookups else 0.0,
+        }
+
+    def _remember(self, key: str, value: Any) -> None:
+        self._entries[key] = (time.monotonic() + self.ttl_seconds, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    async def _in_db_thread(self, fn, *args) -> Any | None:
+        if not self.db_path:
+            return None
+        if self._db_thread is None:
+            self._db_thread = ThreadPoolExecutor(1, thread_name_prefix=f"{self.name}-cache")
+        return await asyncio.get_running_loop().run_in_executor(self._db_thread, fn, *args)
+
+    def _connection(self) -> sqlite3.Connection | None:
+        if self.db_path and self._db is None:
+            # Shared by every worker process: wait out their writes rather than fail.
+            self._db = sqlite3.connect(self.db_path, check_same_thread=False, timeout=30)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS response_cache (namespace TEXT, key TEXT, "
+                "value TEXT, expires_at REAL, PRIMARY KEY (namespace, key))"
+            )
+            self._db.commit()
+        return self._db
+
+    def _db_get(self, key: str) -> Any | None:
+        db = self._connection()
+        if db is None:
+            return None
+        row = db.execute(
+            "SELECT value FROM response_cache WHERE namespace = ? AND key = ? AND expires_at > ?",
+            (self.name, key, time.time()),
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def _db_set(self, key: str, value: Any) -> None:
+        db = self._connection()
+        if db is None:
+            return
+        now = time.time()
+        self._db_writes += 1
+        with db:
+            db.execute(
+                "INSERT OR REPLACE INTO response_cache VALUES (?, ?, ?, ?)",
+                (self.name, key, json.dumps(value), now + self.ttl_seconds),
+            )
+            if self._db_writes % PRUNE_EVERY == 0:
+                db.execute(
+                    "DELETE FROM response_cache WHERE namespace = ? AND expires_at <= ?",
+                    (self.name, now),
+                )
+
+
+# Optional persistent tier shared by every cache, e.g. RESPONSE_CACHE_DB=cache.db
+CACHE_DB_PATH = os.environ.get("RESPONSE_CACHE_DB") or None
+
+chat_cache = ResponseCache(
+    "chat",
+    max_entries=int(os.environ.get("CHAT_CACHE_SIZE", "1024")),
+    ttl_seconds=float(os.environ.get("CHAT_CACHE_TTL", "600")),
+    db_path=CACHE_DB_PATH,
+)
\ No newline at end of file
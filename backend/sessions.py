@@ -0,0 +1,233 @@
+"""Server-side drafting sessions persisted in SQLite.
+
+The database runs in WAL mode so readers never block the writer. Reads run
+on a small pool of connections in worker threads; writes go through a single
+writer that commits everything queued since its last transaction together
+(group commit), so bursts of chat turns cost one fsync instead of many.
+
+Sessions idle for longer than TTL (by updated_at) are treated as gone and
+deleted, with their messages, by a periodic sweep through the same writer.
+"""
+import asyncio
+import json
+import logging
+import os
+import secrets
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+
+logger = logging.getLogger(__name__)
+
+# Read connections (and threads) available to concurrent requests.
+READ_POOL_SIZE = int(os.environ.get("SESSION_READ_POOL_SIZE", "4"))
+# Upper bound on queued writes committed in one transaction.
+MAX_WRITE_BATCH = 256
+# Seconds since its last turn after which a session and its messages are deleted; 0 keeps them.
+TTL = float(os.environ.get("SESSION_TTL", str(30 * 24 * 3600)))
+SWEEP_INTERVAL = float(os.environ.get("SESSION_SWEEP_INTERVAL", "3600"))
+
+
+@dataclass
+class Session:
+    id: str
+    doc_type: str
+    fields: dict = field(default_factory=dict)
+    messages: list[dict] = field(default_factory=list)
+
+
+def connect(db_path: str) -> sqlite3.Connection:
+    """Open a connection tuned for concurrent access to a WAL database."""
+    conn = sqlite3.connect(db_path, check_same_thread=False, timeout=30)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
+
+
+class SessionStore:
+    def __init__(
+        self,
+        db_path: str,
+        read_pool_size: int = READ_POOL_SIZE,
+        ttl: float = TTL,
+        sweep_interval: float = SWEEP_INTERVAL,
+    ):
+        self.db_path = db_path
+        self.read_pool_size = read_pool_size
+        self.ttl = ttl
+        self.sweep_interval = sweep_interval
+        self._local = threading.local()
+        self._connections: list[sqlite3.Connection] = []
+        self._readers: ThreadPoolExecutor | None = None
+        self._writer: ThreadPoolExecutor | None = None
+        self._queue: asyncio.Queue | None = None
+        self._writer_task: asyncio.Task | None = None
+        self._sweeper: asyncio.Task | None = None
+        self.batches = 0
+        self.writes = 0
+
+    async def start(self) -> None:
+        self._readers = ThreadPoolExecutor(self.read_pool_size, thread_name_prefix="session-read")
+        self._writer = ThreadPoolExecutor(1, thread_name_prefix="session-write")
+        self._queue = asyncio.Queue()
+        self._writer_task = asyncio.create_task(self._write_loop())
+        if self.ttl > 0:
+            self._sweeper = asyncio.create_task(self._sweep_loop())
+
+    async def stop(self) -> None:
+        if self._writer_task is None:
+            return
+        if self._sweeper is not None:
+            self._sweeper.cancel()
+            await asyncio.gather(self._sweeper, return_exceptions=True)
+            self._sweeper = None
+        await self._queue.put(None)
+        await self._writer_task
+        self._writer_task = None
+        self._readers.shutdown()
+        self._writer.shutdown()
+        for conn in self._connections:
+            conn.close()
+        self._connections.clear()
+
+    async def create(self, doc_type: str) -> Session:
+        session = Session(id=secrets.token_urlsafe(16), doc_type=doc_type)
+        await self._submit([(
+            "INSERT INTO sessions (id, doc_type, fields) VALUES (?, ?, '{}')",
+            (session.id, doc_type),
+        )])
+        return session
+
+    async def get(self, session_id: str) -> Session | None:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._readers, self._load, session_id)
+
+    async def append(
+        self, session_id: str, messages: list[dict], fields: dict, doc_type: str
+    ) -> None:
+        """Record a completed turn: new messages plus the session's latest state."""
+        statements = [
+            (
+                "INSERT INTO session_messages (session_id, seq, role, content) VALUES "
+                "(?, (SELECT COALESCE(MAX(seq), -1) + 1 FROM session_messages "
+                "WHERE session_id = ?), ?, ?)",
+                (session_id, session_id, m["role"], m["content"]),
+            )
+            for m in messages
+        ]
+        statements.append((
+            "UPDATE sessions SET doc_type = ?, fields = ?, updated_at = CURRENT_TIMESTAMP "
+            "WHERE id = ?",
+            (doc_type, json.dumps(fields), session_id),
+        ))
+        await self._submit(statements)
+
+    async def expire(self) -> None:
+        """Delete sessions idle for longer than the TTL, and their messages."""
+        cutoff = (f"-{int(self.ttl)} seconds",)
+        idle = "SELECT id FROM sessions WHERE updated_at < datetime('now', ?)"
+        await self._submit([
+            (f"DELETE FROM session_messages WHERE session_id IN ({idle})", cutoff),
+            ("DELETE FROM sessions WHERE updated_at < datetime('now', ?)", cutoff),
+        ])
+
+    def stats(self) -> dict:
+        return {
+            "write_batches": self.batches,
+            "writes": self.writes,
+            "pending_writes": self._queue.qsize() if self._queue else 0,
+        }
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = connect(self.db_path)
+            self._local.conn = conn
+            self._connections.append(conn)
+        return conn
+
+    def _load(self, session_id: str) -> Session | None:
+        conn = self._connection()
+        query = "SELECT doc_type, fields FROM sessions WHERE id = ?"
+        params: tuple = (session_id,)
+        if self.ttl > 0:
+            # Expired but not swept yet: already gone as far as callers can tell.
+            query += " AND updated_at >= datetime('now', ?)"
+            params += (f"-{int(self.ttl)} seconds",)
+        row = conn.execute(query, params).fetchone()
+        if row is None:
+            return None
+        messages = conn.execute(
+            "SELECT role, content FROM session_messages WHERE session_id = ? ORDER BY seq",
+            (session_id,),
+        ).fetchall()
+        return Session(
+            id=session_id,
+            doc_type=row[0],
+            fields=json.loads(row[1]),
+            messages=[{"role": role, "content": content} for role, content in messages],
+        )
+
+    async def _submit(self, statements: list[tuple[str, tuple]]) -> None:
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((statements, future))
+        await future
+
+    def _commit(self, batch: list[list[tuple[str, tuple]]]) -> None:
+        conn = self._connection()
+        # IMMEDIATE takes the write lock up front, so writers in other worker
+        # processes wait on the busy timeout instead of failing to upgrade.
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            for statements in batch:
+                for sql, params in statements:
+                    conn.execute(sql, params)
+        except BaseException:
+            conn.rollback()
+            raise
+        conn.commit()
+
+    async def _sweep_loop(self) -> None:
+        while True:
+            try:
+                await self.expire()
+            except sqlite3.Error:
+                logger.exception("Session sweep failed")
+            await asyncio.sleep(self.sweep_interval)
+
+    async def _write_loop(self) -> None:
+        loop = asyncio.get_running_loop()
+        stopping = False
+        while not stopping:
+            item = await self._queue.get()
+            pending = []
+            while item is not None:
+                pending.append(item)
+                if len(pending) >= MAX_WRITE_BATCH or self._queue.empty():
+                    break
+                item = self._queue.get_nowait()
+            stopping = item is None
+            if not pending:
+                continue
+            try:
+                await loop.run_in_executor(self._writer, self._commit, [s for s, _ in pending])
+                outcomes = [None] * len(pending)
+            except sqlite3.Error:
+                # Retry one by one so a single bad write fails only its caller.
+                outcomes = []
+                for statements, _ in pending:
+                    try:
+                        await loop.run_in_executor(self._writer, self._commit, [statements])
+                        outcomes.append(None)
+                    except sqlite3.Error as exc:
+                        outcomes.append(exc)
+            self.batches += 1
+            self.writes += len(pending)
+            for (_, future), error in zip(pending, outcomes):
+                if future.done():
+                    continue
+                if error is None:
+                    future.set_result(None)
+                else:
+                    future.set_exception(error)
@@ -0,0 +1,94 @@
+"""Single-flight execution of identical concurrent streamed requests.
+
+The first request for a key starts a Flight: a task that runs the event
+stream to completion and records every event. Identical requests arriving
+while it runs subscribe to the same Flight instead of starting their own,
+and get a replay of the events emitted so far followed by the rest live.
+The Flight finishes even if every subscriber disconnects, so the work
+already paid for still reaches the caches and the session.
+
+Only /api/chat uses it. /api/preview renders synchronously on the event
+loop from a compiled template in microseconds, so identical previews in one
+process never overlap and there is nothing to share.
+"""
+import asyncio
+from typing import AsyncIterator, Callable
+
+
+class Flight:
+    def __init__(self, events: AsyncIterator[dict], on_done: Callable[[], None] | None = None):
+        self.events: list[dict] = []
+        self.done = False
+        self.error: Exception | None = None
+        self._changed = asyncio.Event()
+        self._on_done = on_done
+        self.task = asyncio.create_task(self._run(events))
+
+    async def _run(self, events: AsyncIterator[dict]) -> None:
+        try:
+            async for event in events:
+                self.events.append(event)
+                self._notify()
+        except Exception as exc:
+            self.error = exc
+        finally:
+            # Before subscribers see the end, so whatever on_done frees is
+            # already free when their responses complete.
+            if self._on_done is not None:
+                self._on_done()
+            self.done = True
+            self._notify()
+
+    def _notify(self) -> None:
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def subscribe(self) -> AsyncIterator[dict]:
+        """Yield every event of the flight, from the first, as they become available."""
+        position = 0
+        while True:
+            while position < len(self.events):
+                yield self.events[position]
+                position += 1
+            if self.done:
+                if self.error is not None:
+                    raise self.error
+                return
+            await self._changed.wait()
+
+
+class FlightGroup:
+    """In-flight Flights by key; a key is free again as soon as its Flight ends."""
+
+    def __init__(self):
+        self._flights: dict[str, Flight] = {}
+        self.started = 0
+        self.joined = 0
+
+    def get(self, key: str) -> Flight | None:
+        flight = self._flights.get(key)
+        if flight is not None:
+            self.joined += 1
+        return flight
+
+    def start(self, key: str, events: AsyncIterator[dict], on_done: Callable[[], None] | None = None) -> Flight:
+        def finished() -> None:
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+            if on_done is not None:
+                on_done()
+
+        flight = Flight(events, finished)
+        self._flights[key] = flight
+        self.started += 1
+        return flight
+
+    async def aclose(self) -> None:
+        """Cancel flights still running; called on application shutdown."""
+        flights = list(self._flights.values())
+        for flight in flights:
+            flight.task.cancel()
+        await asyncio.gather(*(f.task for f in flights), return_exceptions=True)
+
+    def stats(self) -> dict:
+        return {"in_flight": len(self._flights), "started": self.started, "joined": self.joined}
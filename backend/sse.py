@@ -0,0 +1,116 @@
+"""Server-sent events writer for /api/chat.
+
+Events are dicts in the schema ChatPanel consumes ({"type": "text", "delta"},
+{"type": "fields", "data"}, ...). Consecutive text deltas are merged into
+one frame until about FRAME_BYTES of text is buffered or FRAME_INTERVAL has
+passed, so a long reply costs a few writes instead of one per word. The first
+delta is sent immediately to keep time to first token low. While the source
+is idle, a comment line goes out every KEEPALIVE_SECONDS so proxies don't
+drop the connection.
+"""
+import asyncio
+import json
+import os
+import time
+from typing import AsyncIterator
+
+try:
+    import orjson
+except ImportError:  # optional: the stdlib encoder produces the same events
+    orjson = None
+
+FRAME_BYTES = int(os.environ.get("SSE_FRAME_BYTES", "1024"))
+FRAME_INTERVAL = float(os.environ.get("SSE_FRAME_INTERVAL", "0.05"))
+KEEPALIVE_SECONDS = float(os.environ.get("SSE_KEEPALIVE", "15"))
+
+KEEPALIVE = b": keep-alive\n\n"
+_DONE = object()
+
+
+def encode(event: dict) -> bytes:
+    """Serialize one event as an SSE data frame."""
+    if orjson is not None:
+        return b"data: " + orjson.dumps(event) + b"\n\n"
+    return b"data: " + json.dumps(event, ensure_ascii=False, separators=(",", ":")).encode() + b"\n\n"
+
+
+async def stream(
+    events: AsyncIterator[dict],
+    frame_bytes: int = FRAME_BYTES,
+    frame_interval: float = FRAME_INTERVAL,
+    keepalive: float = KEEPALIVE_SECONDS,
+) -> AsyncIterator[bytes]:
+    """Encode events as SSE frames, coalescing text deltas and sending keep-alives."""
+    queue: asyncio.Queue = asyncio.Queue()
+
+    async def pump():
+        try:
+            async for event in events:
+                await queue.put(event)
+            await queue.put(_DONE)
+        except Exception as exc:
+            await queue.put(exc)
+
+    producer = asyncio.create_task(pump())
+    pending: list[str] = []
+    pending_bytes = 0
+    pending_since = 0.0
+    sent_text = False
+    last_sent = time.monotonic()
+
+    def flush_text() -> bytes:
+        nonlocal pending_bytes
+        frame = encode({"type": "text", "delta": "".join(pending)})
+        pending.clear()
+        pending_bytes = 0
+        return frame
+
+    try:
+        while True:
+            now = time.monotonic()
+            if pending:
+                timeout = max(0.0, pending_since + frame_interval - now)
+            else:
+                timeout = max(0.0, last_sent + keepalive - now)
+
+            if not queue.empty():
+                event = queue.get_nowait()
+            else:
+                try:
+                    event = await asyncio.wait_for(queue.get(), timeout)
+                except TimeoutError:
+                    if pending:
+                        yield flush_text()
+                    else:
+                        yield KEEPALIVE
+                    last_sent = time.monotonic()
+                    continue
+
+            if isinstance(event, Exception):
+                raise event
+            if event is not _DONE and event.get("type") == "text":
+                delta = event["delta"]
+                if not sent_text:
+                    sent_text = True
+                    yield encode(event)
+                    last_sent = time.monotonic()
+                    continue
+                if not pending:
+                    pending_since = time.monotonic()
+                pending.append(delta)
+                pending_bytes += len(delta)
+                if pending_bytes >= frame_bytes:
+                    yield flush_text()
+                    last_sent = time.monotonic()
+                continue
+
+            frames = flush_text() if pending else b""
+            if event is _DONE:
+                if frames:
+                    yield frames
+                return
+            yield frames + encode(event)
+            last_sent = time.monotonic()
+    finally:
+        producer.cancel()
+        await asyncio.gather(producer, return_exceptions=True)
@@ -0,0 +1,143 @@
+"""Serves the Next.js static export from an index built once at startup.
+
+Every file under the export directory is mapped to the routes it answers
+(exact path, ``dir/`` -> ``dir/index.html``, ``page`` -> ``page.html``), so a
+request is a dict lookup rather than a series of stat calls. Files up to
+MEMORY_LIMIT bytes are held in memory along with precompressed gzip (and
+brotli, if installed) variants. Each representation has a strong ETag, and
+hashed ``_next/static`` assets are marked immutable.
+"""
+import gzip
+import hashlib
+import mimetypes
+import os
+from dataclasses import dataclass, field
+
+from fastapi import Request, Response
+from fastapi.responses import FileResponse
+
+try:
+    import brotli
+except ImportError:  # optional: gzip variants are still served
+    brotli = None
+
+# Files larger than this are streamed from disk instead of held in memory.
+MEMORY_LIMIT = int(os.environ.get("STATIC_MEMORY_LIMIT", str(512 * 1024)))
+# Smaller bodies are not worth compressing.
+MIN_COMPRESS_SIZE = 256
+
+IMMUTABLE = "public, max-age=31536000, immutable"
+REVALIDATE = "no-cache"
+
+_COMPRESSIBLE = ("text/", "application/javascript", "application/json", "image/svg+xml",
+                 "application/xml", "application/manifest+json")
+
+
+@dataclass
+class Asset:
+    path: str
+    media_type: str
+    etag: str
+    cache_control: str
+    body: bytes | None = None
+    variants: dict[str, tuple[bytes, str]] = field(default_factory=dict)
+
+
+def _etag_matches(if_none_match: str, etag: str) -> bool:
+    tags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+    return "*" in tags or etag in tags
+
+
+def _negotiate(accept_encoding: str, available: dict) -> str | None:
+    accepted = {}
+    for part in accept_encoding.split(","):
+        name, _, params = part.strip().partition(";")
+        q = 1.0
+        if params.strip().startswith("q="):
+            try:
+                q = float(params.strip()[2:])
+            except ValueError:
+                q = 0.0
+        accepted[name.strip().lower()] = q
+    for encoding in ("br", "gzip"):
+        if encoding in available and accepted.get(encoding, 0) > 0:
+            return encoding
+    return None
+
+
+def _load_asset(path: str, rel: str) -> Asset:
+    media_type = mimetypes.guess_type(path)[0] or "application/octet-stream"
+    cache_control = IMMUTABLE if rel.startswith("_next/static/") else REVALIDATE
+    digest = hashlib.sha256()
+    size = os.path.getsize(path)
+    body = None
+    with open(path, "rb") as f:
+        if size <= MEMORY_LIMIT:
+            body = f.read()
+            digest.update(body)
+        else:
+            for block in iter(lambda: f.read(1 << 16), b""):
+                digest.update(block)
+    tag = digest.hexdigest()[:32]
+    asset = Asset(path=path, media_type=media_type, etag=f'"{tag}"', cache_control=cache_control,
+                  body=body)
+
+    if body is not None and len(body) >= MIN_COMPRESS_SIZE and media_type.startswith(_COMPRESSIBLE):
+        candidates = {"gzip": gzip.compress(body, compresslevel=9, mtime=0)}
+        if brotli is not None:
+            candidates["br"] = brotli.compress(body)
+        for encoding, compressed in candidates.items():
+            if len(compressed) < len(body):
+                asset.variants[encoding] = (compressed, f'"{tag}-{encoding}"')
+    return asset
+
+
+class StaticIndex:
+    def __init__(self, routes: dict[str, Asset]):
+        self.routes = routes
+        self.fallback = routes.get("")
+
+    @classmethod
+    def build(cls, root: str) -> "StaticIndex":
+        assets: dict[str, Asset] = {}
+        for dirpath, _, filenames in os.walk(root):
+            for name in filenames:
+                path = os.path.join(dirpath, name)
+                rel = os.path.relpath(path, root).replace(os.sep, "/")
+                assets[rel] = _load_asset(path, rel)
+
+        # Same precedence as the old per-request lookup: exact file, then
+        # directory index, then "<path>.html".
+        routes = dict(assets)
+        for rel, asset in assets.items():
+            if rel == "index.html" or rel.endswith("/index.html"):
+                routes.setdefault(rel.removesuffix("index.html").rstrip("/"), asset)
+        for rel, asset in assets.items():
+            if rel.endswith(".html"):
+                routes.setdefault(rel.removesuffix(".html"), asset)
+        return cls(routes)
+
+    def lookup(self, path: str) -> Asset | None:
+        path = path.strip("/")
+        asset = self.routes.get(path)
+        if asset is None and not path.startswith("_next/"):
+            asset = self.fallback
+        return asset
+
+    def respond(self, path: str, request: Request) -> Response:
+        asset = self.lookup(path)
+        if asset is None:
+            return Response(status_code=404)
+
+        encoding = _negotiate(request.headers.get("accept-encoding", ""), asset.variants)
+        body, etag = asset.variants[encoding] if encoding else (asset.body, asset.etag)
+        headers = {"Cache-Control": asset.cache_control, "Vary": "Accept-Encoding", "ETag": etag}
+
+        if_none_match = request.headers.get("if-none-match")
+        if if_none_match and _etag_matches(if_none_match, etag):
+            return Response(status_code=304, headers=headers)
+        if body is None:
+            return FileResponse(asset.path, media_type=asset.media_type, headers=headers)
+        if encoding:
+            headers["Content-Encoding"] = encoding
+        return Response(body, media_type=asset.media_type, headers=headers)
@@ -1,27 +1,107 @@
-"""Renders document cover page templates with field substitution."""
+"""Renders document cover page templates with field substitution.
+
+Each cover page is compiled once into static HTML fragments interleaved with
+``{{field}}`` slots, so a render is a string join. Compiled templates are
+cached per doc type and recompiled when the file's mtime changes.
+"""
+import html
 import re
+from dataclasses import dataclass
 from pathlib import Path
 
-import markdown
 
 COVER_PAGES_DIR = Path(__file__).parent.parent / "templates" / "cover-pages"
 
+_FIELD_PATTERN = re.compile(r"\{\{(\w+)\}\}")
+# Alphanumeric-only marker so markdown passes it through untouched.
+_SLOT_PATTERN = re.compile(r"prelegalslot(\d+)x")
 
-def render_template(doc_type: str, fields: dict) -> str:
-    """Substitute fields into cover page template and return HTML.
 
-    Unknown fields render as italicized [fieldName] placeholders.
-    """
+@dataclass(frozen=True)
+class CompiledTemplate:
+    """Static HTML fragments with a field slot between each consecutive pair."""
+    fragments: tuple[str, ...]
+    slots: tuple[str, ...]
+    mtime_ns: int
+
+    @property
+    def version(self) -> str:
+        """Opaque identifier clients use to tell whether patched HTML is still current."""
+        return str(self.mtime_ns)
+
+    def render(self, fields: dict, annotate: bool = False) -> str:
+        """Join fragments and slot values.
+
+        With annotate, each slot is wrapped in <span data-field="..."> so a
+        client can later patch individual slots in place.
+        """
+        parts = [self.fragments[0]]
+        for key, fragment in zip(self.slots, self.fragments[1:]):
+            value = render_slot(key, fields.get(key))
+            parts.append(f'<span data-field="{key}">{value}</span>' if annotate else value)
+            parts.append(fragment)
+        return "".join(parts)
+
+    def render_slots(self, fields: dict) -> dict[str, str]:
+        """Render only the given fields that appear as slots in this template."""
+        return {key: render_slot(key, value) for key, value in fields.items() if key in self.slots}
+
+
+_compiled: dict[str, CompiledTemplate] = {}
+
+
+def render_slot(key: str, value) -> str:
+    """Render a single field value, or its italicized placeholder if empty."""
+    return html.escape(str(value), quote=False) if value else f"<em>[{key}]</em>"
+
+
+def compile_source(source: str, mtime_ns: int = 0) -> CompiledTemplate:
+    """Compile cover page markdown into fragments and slots."""
+    import markdown
+
+    names: list[str] = []
+
+    def mark(m: re.Match) -> str:
+        names.append(m.group(1))
+        return f"prelegalslot{len(names) - 1}x"
+
+    rendered = markdown.markdown(_FIELD_PATTERN.sub(mark, source), extensions=["tables"])
+    pieces = _SLOT_PATTERN.split(rendered)
+    return CompiledTemplate(
+        fragments=tuple(pieces[0::2]),
+        slots=tuple(names[int(i)] for i in pieces[1::2]),
+        mtime_ns=mtime_ns,
+    )
+
+
+def get_compiled(doc_type: str) -> CompiledTemplate | None:
+    """Return the compiled cover page for doc_type, recompiling if it changed on disk."""
     template_path = COVER_PAGES_DIR / f"{doc_type}.md"
-    if not template_path.exists():
-        return f"<p><em>Template not available for document type: {doc_type}</em></p>"
+    try:
+        mtime_ns = template_path.stat().st_mtime_ns
+    except OSError:
+        _compiled.pop(doc_type, None)
+        return None
+
+    compiled = _compiled.get(doc_type)
+    if compiled is None or compiled.mtime_ns != mtime_ns:
+        compiled = compile_source(template_path.read_text(), mtime_ns)
+        _compiled[doc_type] = compiled
+    return compiled
 
-    source = template_path.read_text()
 
-    def replace(m: re.Match) -> str:
-        key = m.group(1)
-        value = fields.get(key, "")
-        return value if value else f"<em>[{key}]</em>"
+def template_version(doc_type: str) -> str | None:
+    """Return an identifier that changes whenever the cover page file changes."""
+    compiled = get_compiled(doc_type)
+    return compiled.version if compiled else None
 
-    substituted = re.sub(r"\{\{(\w+)\}\}", replace, source)
-    return markdown.markdown(substituted, extensions=["tables"])
+
+def render_template(doc_type: str, fields: dict, annotate: bool = False) -> str:
+    """Substitute fields into cover page template and return HTML.
+
+    Unknown fields render as italicized [fieldName] placeholders.
+    """
+    compiled = get_compiled(doc_type)
+    if compiled is None:
+        return f"<p><em>Template not available for document type: {doc_type}</em></p>"
+    return compiled.render(fields, annotate)
@@ -0,0 +1,124 @@
+import asyncio
+from unittest.mock import patch
+
+import pytest
+from fastapi.testclient import TestClient
+
+from admission import IN_PROGRESS, NEW, Admission, Rejected, TokenBucket
+from main import app
+
+
+def test_token_bucket_refills_at_rate():
+    bucket = TokenBucket(rate=10, burst=2)
+    assert bucket.take() == 0 and bucket.take() == 0
+    wait = bucket.take()
+    assert 0 < wait <= 0.1
+    bucket.updated -= wait
+    assert bucket.take() == 0
+
+
+def test_client_over_its_rate_gets_429_with_retry_after():
+    admission = Admission(client_rate=1, client_burst=2)
+    admission.check_client("a")
+    admission.check_client("a")
+    with pytest.raises(Rejected) as exc:
+        admission.check_client("a")
+    assert exc.value.status_code == 429 and exc.value.headers == {"Retry-After": "1"}
+    admission.check_client("b")  # other clients are unaffected
+
+
+def test_queue_admits_in_progress_turns_first():
+    async def run():
+        admission = Admission(max_active=1, queue_size=4, rate=0)
+        first = await admission.acquire()
+        order = []
+
+        async def turn(name, priority):
+            ticket = await admission.acquire(priority)
+            order.append(name)
+            ticket.release()
+
+        tasks = [asyncio.create_task(turn("new", NEW)), asyncio.create_task(turn("ongoing", IN_PROGRESS))]
+        await asyncio.sleep(0)
+        assert admission.snapshot()["queue_depth"] == 2
+        first.release()
+        first.release()  # idempotent
+        await asyncio.gather(*tasks)
+        return order, admission.snapshot()
+
+    order, snapshot = asyncio.run(run())
+    assert order == ["ongoing", "new"]
+    assert snapshot["active"] == 0 and snapshot["admitted"] == 3
+
+
+def test_full_queue_rejects_new_turns_and_evicts_for_in_progress_ones():
+    async def run():
+        admission = Admission(max_active=1, queue_size=1, rate=0)
+        held = await admission.acquire()
+        waiting_new = asyncio.create_task(admission.acquire(NEW))
+        await asyncio.sleep(0)
+        with pytest.raises(Rejected) as full:
+            await admission.acquire(NEW)
+        assert full.value.status_code == 503
+
+        waiting_ongoing = asyncio.create_task(admission.acquire(IN_PROGRESS))
+        await asyncio.sleep(0)
+        with pytest.raises(Rejected):
+            await waiting_new  # evicted to make room
+        held.release()
+        (await waiting_ongoing).release()
+        return admission.snapshot()
+
+    snapshot = asyncio.run(run())
+    assert snapshot["rejected"]["queue_full"] == 2 and snapshot["active"] == 0
+
+
+def test_queued_turn_times_out_with_503():
+    async def run():
+        admission = Admission(max_active=1, queue_timeout=0.05, rate=0)
+        await admission.acquire()
+        with pytest.raises(Rejected) as exc:
+            await admission.acquire()
+        return exc.value, admission.snapshot()
+
+    exc, snapshot = asyncio.run(run())
+    assert exc.status_code == 503 and "Retry-After" in exc.headers
+    assert snapshot["queue_depth"] == 0 and snapshot["rejected"]["queue_timeout"] == 1
+
+
+def test_global_rate_paces_queued_turns():
+    async def run():
+        admission = Admission(max_active=10, rate=50, rate_burst=1)
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        tickets = [await admission.acquire() for _ in range(3)]
+        return loop.time() - start, tickets
+
+    elapsed, tickets = asyncio.run(run())
+    assert len(tickets) == 3 and elapsed >= 0.03
+
+
+def test_chat_endpoint_rejects_over_limit_client(monkeypatch):
+    import main
+    from ai import ChatResult
+
+    monkeypatch.setattr(main, "admission", Admission(client_rate=0.01, client_burst=1))
+
+    async def stream(*args):
+        yield ChatResult(reply="Hi", fields={})
+
+    body = {"messages": [{"role": "user", "content": "Hello admission"}], "doc_type": "mnda"}
+    client = TestClient(app)
+    with patch("main.stream_chat_completion", side_effect=stream):
+        assert client.post("/api/chat", json=body).status_code == 200
+        r = client.post("/api/chat", json=body)
+    assert r.status_code == 429 and int(r.headers["retry-after"]) >= 1
+    stats = client.get("/api/stats").json()["admission"]
+    assert stats["active"] == 0 and stats["rejected"]["client_rate"] == 1
+
+
+def test_client_rate_limit_is_off_by_default():
+    admission = Admission()
+    for _ in range(100):
+        admission.check_client("proxy")
+    assert admission.snapshot()["rejected"]["client_rate"] == 0
@@ -0,0 +1,267 @@
+"""Tests for LLM response handling in ai.py with a mocked litellm."""
+import asyncio
+import json
+import time
+import subprocess
+import sys
+from pathlib import Path
+from types import SimpleNamespace
+from unittest.mock import AsyncMock, patch
+
+from ai import (
+    ChatResult,
+    ReplyStreamParser,
+    Route,
+    Router,
+    UpstreamLimiter,
+    _prepare,
+    load_routes,
+    retryable,
+    stream_chat_completion,
+    usage_stats,
+)
+from docs import DOC_REGISTRY
+
+
+async def aiter_of(items):
+    for item in items:
+        yield item
+
+
+async def collect(stream) -> list:
+    return [item async for item in stream]
+
+
+def feed_in_chunks(doc: str, size: int) -> str:
+    parser = ReplyStreamParser()
+    return "".join(parser.feed(doc[i:i + size]) for i in range(0, len(doc), size))
+
+
+def test_reply_parser_decodes_escapes_split_across_chunks():
+    reply = 'Say "hi"\nthen wave 👋 \\ done'
+    doc = json.dumps({"reply": reply, "fields": {}})
+    for size in (1, 2, 3, 5, 8):
+        assert feed_in_chunks(doc, size) == reply
+
+
+def test_reply_parser_ignores_nested_reply_keys():
+    doc = json.dumps({"fields": {"reply": "nested"}, "reply": "top level"})
+    assert feed_in_chunks(doc, 4) == "top level"
+
+
+def test_stream_chat_completion_yields_deltas_then_result():
+    doc = json.dumps({"reply": "What is the purpose?", "fields": {"purpose": "Evaluation"}})
+    chunks = [
+        SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=doc[i:i + 6]))])
+        for i in range(0, len(doc), 6)
+    ]
+    with patch("ai.acompletion", AsyncMock(return_value=aiter_of(chunks))) as mock_completion:
+        items = asyncio.run(
+            collect(stream_chat_completion([{"role": "user", "content": "Hi"}], {}, "mnda"))
+        )
+
+    assert mock_completion.call_args.kwargs["stream"] is True
+    *deltas, result = items
+    assert len(deltas) > 1
+    assert "".join(deltas) == "What is the purpose?"
+    assert result == ChatResult(reply="What is the purpose?", fields={"purpose": "Evaluation"})
+
+
+def test_upstream_limiter_bounds_in_flight_calls_and_tracks_waits():
+    limiter = UpstreamLimiter(2)
+    peak = 0
+
+    async def call():
+        nonlocal peak
+        async with limiter.slot():
+            peak = max(peak, limiter.in_flight)
+            await asyncio.sleep(0.01)
+
+    async def run():
+        await asyncio.gather(*(call() for _ in range(6)))
+
+    asyncio.run(run())
+    snapshot = limiter.snapshot()
+    assert peak == 2
+    assert snapshot["acquired"] == 6
+    assert snapshot["in_flight"] == 0 and snapshot["queue_depth"] == 0
+    assert snapshot["max_wait_seconds"] > 0
+
+
+def test_response_model_and_schema_are_reused_across_turns():
+    a = _prepare([], {}, "pilot")
+    b = _prepare([{"role": "user", "content": "Hi"}], {"a": "b"}, "pilot")
+    assert a.response_model is b.response_model
+    assert a.response_format is b.response_format
+    assert a.response_format["type"] == "json_schema"
+    assert _prepare([], {}, "csa").response_model is not a.response_model
+
+
+def test_system_prompt_prefix_is_stable_and_fields_follow_history():
+    history = [{"role": "user", "content": "Hi"}, {"role": "assistant", "content": "Hello"}]
+    first = _prepare(history[:1], {}, "mnda").messages
+    later = _prepare(history, {"purpose": "Eval", "governingLaw": "Delaware", "x": ""}, "mnda").messages
+
+    assert first[0] == later[0]
+    assert first[0]["content"] == DOC_REGISTRY["mnda"].prompt
+    assert later[1:3] == history
+    assert later[-1] == {
+        "role": "system",
+        "content": 'Fields already collected: {"governingLaw": "Delaware", "purpose": "Eval"}',
+    }
+    assert len(first) == 2
+
+
+def test_stream_records_cached_prompt_tokens():
+    doc = json.dumps({"reply": "Hi", "fields": {}})
+    usage = SimpleNamespace(
+        prompt_tokens=900, completion_tokens=12,
+        prompt_tokens_details=SimpleNamespace(cached_tokens=768),
+    )
+    chunks = [
+        SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=doc))], usage=None),
+        SimpleNamespace(choices=[], usage=usage),
+    ]
+    before = usage_stats["pilot"].cached_tokens
+    with patch("ai.acompletion", AsyncMock(return_value=aiter_of(chunks))):
+        asyncio.run(collect(stream_chat_completion([{"role": "user", "content": "Hi"}], {}, "pilot")))
+    assert usage_stats["pilot"].cached_tokens == before + 768
+
+
+def test_long_history_is_compacted_to_recent_messages():
+    history = [
+        {"role": "user" if i % 2 == 0 else "assistant", "content": f"message {i} " + "x" * 400}
+        for i in range(40)
+    ]
+    messages = _prepare(history, {"purpose": "Eval"}, "mnda").messages
+
+    assert messages[0]["content"] == DOC_REGISTRY["mnda"].prompt
+    assert messages[1]["role"] == "system"
+    assert "earlier messages" in messages[1]["content"]
+    assert messages[-2] == history[-1]
+    assert messages[-1]["content"].startswith("Fields already collected")
+    kept = messages[2:-1]
+    assert kept == history[-len(kept):]
+    assert len(kept) < len(history)
+
+
+def test_importing_main_does_not_import_litellm():
+    code = "import sys, main; print('litellm' in sys.modules, 'markdown' in sys.modules)"
+    out = subprocess.run(
+        [sys.executable, "-c", code], cwd=Path(__file__).parent,
+        capture_output=True, text=True, check=True,
+    ).stdout
+    assert out.split() == ["False", "False"]
+
+
+ROUTES = [Route(name="primary", model="a"), Route(name="backup", model="b")]
+
+
+def test_load_routes_defaults_to_pinned_model():
+    [route] = load_routes("")
+    assert route.extra_body == {"provider": {"order": ["cerebras"]}}
+    routes = load_routes('[{"model": "m"}, {"model": "m", "api_base": "http://x"}]')
+    assert [r.name for r in routes] == ["m", "m#1"]
+    assert routes[1].api_base == "http://x"
+
+
+def test_router_falls_back_to_next_route_after_error():
+    router = Router(ROUTES, max_attempts=3)
+
+    async def open_attempt(route):
+        if route.name == "primary":
+            raise ConnectionError("provider down")
+        return route.name
+
+    result, _ = asyncio.run(router.first(open_attempt))
+    assert result == "backup"
+    assert [(a.route, a.outcome) for a in router.recent] == [("primary", "error"), ("backup", "ok")]
+
+
+def test_router_raises_last_error_when_attempts_are_exhausted():
+    router = Router(ROUTES, max_attempts=2)
+
+    async def open_attempt(route):
+        raise ConnectionError(route.name)
+
+    try:
+        asyncio.run(router.first(open_attempt))
+    except ConnectionError as exc:
+        assert str(exc) == "backup"
+    else:
+        raise AssertionError("expected ConnectionError")
+    assert router.snapshot()["routes"]["primary"]["errors"] == 1
+
+
+class StatusError(Exception):
+    def __init__(self, status_code):
+        super().__init__(f"HTTP {status_code}")
+        self.status_code = status_code
+
+
+def test_only_transient_errors_are_retryable():
+    for error in (TimeoutError(), ConnectionError(), StatusError(408), StatusError(429), StatusError(503)):
+        assert retryable(error), error
+    for error in (StatusError(400), StatusError(401), StatusError(403), ValueError("bad")):
+        assert not retryable(error), error
+
+
+def test_router_does_not_retry_client_errors():
+    router = Router(ROUTES, max_attempts=3)
+    calls = []
+
+    async def open_attempt(route):
+        calls.append(route.name)
+        raise StatusError(401)
+
+    try:
+        asyncio.run(router.first(open_attempt))
+    except StatusError as exc:
+        assert exc.status_code == 401
+    else:
+        raise AssertionError("expected StatusError")
+    assert calls == ["primary"]
+
+
+def test_router_hedges_slow_first_token_and_cancels_the_loser():
+    router = Router(ROUTES, max_attempts=3, hedge_after="0.05")
+    closed = []
+
+    async def open_attempt(route):
+        await asyncio.sleep(1 if route.name == "primary" else 0.01)
+        return route.name
+
+    async def discard(result):
+        closed.append(result)
+
+    start = time.perf_counter()
+    result, _ = asyncio.run(router.first(open_attempt, discard))
+    assert result == "backup"
+    assert time.perf_counter() - start < 0.5
+    outcomes = {(a.route, a.hedge, a.outcome) for a in router.recent}
+    assert outcomes == {("primary", False, "cancelled"), ("backup", True, "ok")}
+    assert router.snapshot()["routes"]["backup"]["hedges"] == 1
+
+
+def test_router_enforces_deadline():
+    router = Router(ROUTES, max_attempts=3, deadline=0.05)
+
+    async def open_attempt(route):
+        await asyncio.sleep(1)
+
+    start = time.perf_counter()
+    try:
+        asyncio.run(router.first(open_attempt))
+    except TimeoutError:
+        pass
+    else:
+        raise AssertionError("expected TimeoutError")
+    assert time.perf_counter() - start < 0.5
+    assert router.recent[0].outcome == "timeout"
+
+
+def test_p95_hedge_delay_waits_for_enough_samples():
+    router = Router(ROUTES, hedge_after="p95")
+    assert router.hedge_delay() is None
+    router.stats["primary"].latencies.extend(i / 100 for i in range(1, 101))
+    assert router.hedge_delay() == 0.96
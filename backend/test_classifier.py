@@ -0,0 +1,43 @@
+import pytest
+
+from classifier import Index, classify, get_index, tokenize
+
+
+@pytest.mark.parametrize("message, doc_type", [
+    ("We need an NDA before sharing our roadmap", "mnda"),
+    ("Acme Corp needs a SaaS contract", "csa"),
+    ("Need uptime guarantees for our cloud service", "sla"),
+    ("GDPR data processing terms with our vendor", "dpa"),
+    ("License our on-premise software to a customer", "software_license"),
+    ("Early access program in exchange for feedback", "design_partner"),
+    ("A statement of work for consulting", "psa"),
+    ("They want to evaluate the product for 90 days before buying", "pilot"),
+    ("Our billing vendor will process PHI for our clinic under HIPAA", "baa"),
+    ("An addendum covering use of AI models and training data", "ai_addendum"),
+])
+def test_clear_descriptions_are_classified_locally(message, doc_type):
+    assert get_index().classify(message).doc_type == doc_type
+
+
+@pytest.mark.parametrize("message", ["Hi", "I need a contract", "A lease", "machine learning"])
+def test_vague_or_unsupported_requests_defer_to_llm(message):
+    assert get_index().classify(message).doc_type is None
+
+
+def test_close_scores_defer_to_llm():
+    index = Index({"a": "alpha shared", "b": "beta shared", "c": "gamma"})
+    assert index.classify("alpha", min_score=0).doc_type == "a"
+    assert index.classify("alpha beta", min_score=0).doc_type is None
+
+
+def test_classify_uses_every_user_message():
+    messages = [
+        {"role": "user", "content": "Hello"},
+        {"role": "assistant", "content": "What kind of service level agreement do you need?"},
+        {"role": "user", "content": "Something to cover patient health information under HIPAA"},
+    ]
+    assert classify(messages).doc_type == "baa"
+
+
+def test_tokenize_drops_stopwords_and_plurals():
+    assert tokenize("We need the Services agreements") == ["service"]
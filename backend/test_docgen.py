@@ -0,0 +1,107 @@
+import io
+import re
+import zipfile
+import zlib
+
+import pytest
+
+from docgen import UnsupportedText, html_to_blocks, render_export, to_docx, to_pdf, unsupported_pdf_characters
+from docs import DOC_REGISTRY
+
+HTML = """
+<h1>Agreement</h1>
+<p>Plain <strong>bold</strong> and <em>italic</em> text.</p>
+<table><tr><th></th><th>Party 1</th></tr><tr><td>Company</td><td>Acme</td></tr></table>
+<hr />
+<ol start="3">
+<li><p><strong>Use.</strong> Intro</p>
+<ol><li>Nested one</li><li>Nested two</li></ol>
+</li>
+<li>Next</li>
+</ol>
+"""
+
+
+def test_html_to_blocks_keeps_structure_and_styles():
+    blocks = html_to_blocks(HTML)
+    kinds = [(b.kind, b.indent, b.prefix) for b in blocks]
+    assert kinds == [
+        ("heading", 0, ""),
+        ("paragraph", 0, ""),
+        ("paragraph", 0, ""),
+        ("paragraph", 0, ""),
+        ("rule", 0, ""),
+        ("item", 0, "3."),
+        ("item", 1, "1."),
+        ("item", 1, "2."),
+        ("item", 0, "4."),
+    ]
+    runs = [(r.text, r.bold, r.italic) for r in blocks[1].runs]
+    assert runs == [("Plain ", False, False), ("bold", True, False), (" and ", False, False),
+                    ("italic", False, True), (" text.", False, False)]
+    assert "".join(r.text for r in blocks[3].runs) == "Company  |  Acme"
+    assert blocks[5].runs[0].text == "Use." and blocks[5].runs[0].bold
+
+
+def pdf_text(data: bytes) -> str:
+    streams = re.findall(rb"stream\n(.*?)\nendstream", data, re.S)
+    return b"".join(zlib.decompress(s) for s in streams).decode("latin-1")
+
+
+def test_pdf_is_well_formed_and_paginates():
+    blocks = html_to_blocks("<p>" + "word (x) " * 3000 + "</p>")
+    data = to_pdf(blocks, "Title")
+    assert data.startswith(b"%PDF-1.4") and data.endswith(b"%%EOF\n")
+    pages = int(re.search(rb"/Count (\d+)", data).group(1))
+    assert pages > 1
+    text = pdf_text(data)
+    assert f"Page {pages} of {pages}" in text
+    assert r"\(x\)" in text
+    # Every xref offset points at the object it names.
+    xref = int(re.search(rb"startxref\n(\d+)", data).group(1))
+    entries = data[xref:].split(b"\n")[3:]
+    for number, entry in enumerate(entries[: pages * 2 + 7], start=1):
+        offset = int(entry[:10])
+        assert data[offset:].startswith(f"{number} 0 obj".encode())
+
+
+def test_docx_is_a_valid_package():
+    data = to_docx(html_to_blocks(HTML), "Agreement")
+    with zipfile.ZipFile(io.BytesIO(data)) as archive:
+        assert {"[Content_Types].xml", "_rels/.rels", "word/document.xml"} <= set(archive.namelist())
+        document = archive.read("word/document.xml").decode()
+    assert "<w:b/>" in document and "<w:i/>" in document
+    assert "Nested two" in document
+
+
+def test_exports_are_deterministic():
+    fields = {"purpose": "Evaluation", "party1Company": "Acme & Co"}
+    for fmt in ("pdf", "docx"):
+        assert render_export("mnda", fields, fmt) == render_export("mnda", fields, fmt)
+    assert b"Acme &amp; Co" in zipfile.ZipFile(io.BytesIO(render_export("mnda", fields, "docx"))).read(
+        "word/document.xml"
+    )
+
+
+def test_pdf_refuses_characters_its_fonts_cannot_show():
+    fields = {"party1Company": "Łódź Sp. z o.o.", "party2Company": "株式会社テスト"}
+    assert unsupported_pdf_characters(fields) == "Łź株式会社テスト"
+    assert unsupported_pdf_characters({"party1Company": "Société Générale – Zürich"}) == ""
+    with pytest.raises(UnsupportedText, match="DOCX"):
+        render_export("mnda", fields, "pdf")
+    document = zipfile.ZipFile(io.BytesIO(render_export("mnda", fields, "docx"))).read("word/document.xml")
+    assert "Łódź Sp. z o.o.".encode() in document and "株式会社テスト".encode() in document
+
+
+@pytest.mark.parametrize("doc_type", [d for d in DOC_REGISTRY if d != "unknown"])
+@pytest.mark.parametrize("fmt", ["pdf", "docx"])
+def test_every_doc_type_exports(doc_type, fmt):
+    data = render_export(doc_type, {}, fmt)
+    assert data.startswith(b"%PDF-" if fmt == "pdf" else b"PK")
+
+
+def test_pdf_drops_invisible_format_characters():
+    fields = {"party1Company": "Acme\u200e Widgets\u200b"}
+    assert unsupported_pdf_characters(fields) == ""
+    text = pdf_text(render_export("mnda", fields, "pdf"))
+    assert "Acme" in text and "Widgets" in text
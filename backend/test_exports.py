@@ -0,0 +1,199 @@
+import asyncio
+import os
+import socket
+import sqlite3
+import subprocess
+import sys
+import threading
+import time
+
+import pytest
+
+from exports import INTERRUPTED, ExportQueue, QueueFull, sweep
+from migrations import migrate
+
+
+def wait_for(client, job_id: str) -> dict:
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        job = client.get(f"/api/exports/{job_id}").json()
+        if job["status"] not in ("queued", "running"):
+            return job
+        time.sleep(0.05)
+    raise TimeoutError(job_id)
+
+
+def test_export_submit_poll_download(session_client):
+    body = {"doc_type": "mnda", "fields": {"purpose": "Evaluation"}, "format": "pdf"}
+    r = session_client.post("/api/exports", json=body)
+    assert r.status_code == 202
+    job = r.json()
+    assert job["status"] in ("queued", "done")
+
+    assert wait_for(session_client, job["id"])["status"] == "done"
+    download = session_client.get(f"/api/exports/{job['id']}/download")
+    assert download.status_code == 200
+    assert download.headers["content-type"] == "application/pdf"
+    assert 'filename="mnda.pdf"' in download.headers["content-disposition"]
+    assert download.content.startswith(b"%PDF")
+
+    # Identical input: served from the export cache without queueing.
+    again = session_client.post("/api/exports", json=body).json()
+    assert again["status"] == "done" and again["id"] != job["id"]
+    assert session_client.get(f"/api/exports/{again['id']}/download").content == download.content
+
+
+def test_export_docx_cover_page_only(session_client):
+    job = session_client.post("/api/exports", json={"doc_type": "pilot", "fields": {}, "format": "docx"}).json()
+    assert wait_for(session_client, job["id"])["status"] == "done"
+    download = session_client.get(f"/api/exports/{job['id']}/download")
+    assert download.content.startswith(b"PK")
+
+
+def test_export_errors(session_client):
+    assert session_client.post("/api/exports", json={"doc_type": "nope", "fields": {}}).status_code == 404
+    assert session_client.post("/api/exports", json={"doc_type": "mnda", "format": "odt"}).status_code == 422
+    r = session_client.post(
+        "/api/exports", json={"doc_type": "mnda", "fields": {"party1Company": "Łódź"}, "format": "pdf"}
+    )
+    assert r.status_code == 422 and "DOCX" in r.json()["detail"]
+    assert session_client.get("/api/exports/missing").status_code == 404
+    assert session_client.get("/api/exports/missing/download").status_code == 404
+
+
+def test_identical_concurrent_exports_render_once(tmp_path, monkeypatch):
+    db_path = str(tmp_path / "app.db")
+    migrate(db_path)
+    renders = []
+
+    async def run():
+        queue = ExportQueue(db_path, str(tmp_path / "exports"), workers=4)
+        await queue.start()
+        loop = asyncio.get_running_loop()
+
+        def counting_executor(pool, fn, *args):
+            if pool is queue._pool:  # not the sweep's thread
+                renders.append(args)
+            return original(pool, fn, *args)
+
+        original = loop.run_in_executor
+        monkeypatch.setattr(loop, "run_in_executor", counting_executor)
+        try:
+            jobs = [await queue.submit("mnda", {"purpose": "Same"}, "docx") for _ in range(4)]
+            while any(job.status in ("queued", "running") for job in [await queue.get(j.id) for j in jobs]):
+                await asyncio.sleep(0.02)
+            return [(await queue.get(j.id)).status for j in jobs]
+        finally:
+            await queue.stop()
+
+    assert asyncio.run(run()) == ["done"] * 4
+    assert len(renders) == 1
+
+
+def test_full_queue_refuses_new_jobs(tmp_path):
+    db_path = str(tmp_path / "app.db")
+    migrate(db_path)
+
+    async def run():
+        queue = ExportQueue(db_path, str(tmp_path / "exports"), workers=1, queue_size=1)
+        await queue.start()
+        for task in queue._dispatchers:  # nothing drains the queue
+            task.cancel()
+        try:
+            await queue.submit("mnda", {"purpose": "a"}, "pdf")
+            with pytest.raises(QueueFull):
+                await queue.submit("mnda", {"purpose": "b"}, "pdf")
+        finally:
+            await queue.stop()
+
+    asyncio.run(run())
+
+
+def test_sweep_deletes_old_exports_and_trims_to_size(tmp_path):
+    db_path = str(tmp_path / "app.db")
+    migrate(db_path)
+    export_dir = tmp_path / "exports"
+    export_dir.mkdir()
+    now = time.time()
+    for name, age in [("old.pdf", 10_000), ("stale.pdf.123.tmp", 4000), ("a.pdf", 30), ("b.pdf", 20), ("c.pdf", 10)]:
+        path = export_dir / name
+        path.write_bytes(b"x" * 100)
+        os.utime(path, (now - age, now - age))
+    conn = sqlite3.connect(db_path)
+    with conn:
+        conn.execute(
+            "INSERT INTO export_jobs (id, doc_type, format, cache_key, status, created_at) "
+            "VALUES ('old', 'mnda', 'pdf', 'old', 'done', datetime('now', '-3 hours'))"
+        )
+        conn.execute("INSERT INTO export_jobs (id, doc_type, format, cache_key, status) VALUES ('new', 'mnda', 'pdf', 'c', 'done')")
+
+    assert sweep(db_path, str(export_dir), max_age=7200, max_bytes=250) == 3
+    assert sorted(os.listdir(export_dir)) == ["b.pdf", "c.pdf"]  # a.pdf was least recently used
+    assert [row[0] for row in conn.execute("SELECT id FROM export_jobs")] == ["new"]
+
+
+def test_done_export_whose_file_was_swept_is_expired(session_client):
+    job = session_client.post("/api/exports", json={"doc_type": "mnda", "format": "docx", "fields": {}}).json()
+    assert wait_for(session_client, job["id"])["status"] == "done"
+    import main
+
+    for name in os.listdir(main.exports.export_dir):
+        os.remove(os.path.join(main.exports.export_dir, name))
+    assert session_client.get(f"/api/exports/{job['id']}").json()["status"] == "expired"
+    assert session_client.get(f"/api/exports/{job['id']}/download").status_code == 410
+
+
+def test_startup_fails_jobs_orphaned_by_a_dead_process(tmp_path):
+    db_path = str(tmp_path / "app.db")
+    migrate(db_path)
+    exited = subprocess.run([sys.executable, "-c", "import os; print(os.getpid())"], capture_output=True, text=True)
+    host = socket.gethostname()
+    rows = [
+        ("dead", "queued", f"{host}:{exited.stdout.strip()}", "datetime('now')"),
+        ("reused", "running", f"{host}:{os.getpid()}", "datetime('now')"),
+        ("stalled", "running", "elsewhere:1", "datetime('now', '-1 day')"),
+        ("remote", "queued", "elsewhere:1", "datetime('now')"),
+    ]
+    conn = sqlite3.connect(db_path)
+    with conn:
+        for job_id, status, owner, updated in rows:
+            conn.execute(
+                "INSERT INTO export_jobs (id, doc_type, format, cache_key, status, owner, updated_at) "
+                f"VALUES (?, 'mnda', 'pdf', ?, ?, ?, {updated})",
+                (job_id, job_id, status, owner),
+            )
+
+    async def run():
+        queue = ExportQueue(db_path, str(tmp_path / "exports"), workers=1)
+        await queue.start()
+        try:
+            return {job_id: await queue.get(job_id) for job_id, *_ in rows}
+        finally:
+            await queue.stop()
+
+    jobs = asyncio.run(run())
+    for job_id in ("dead", "reused", "stalled"):
+        assert (jobs[job_id].status, jobs[job_id].error) == ("failed", INTERRUPTED)
+    # Another machine's job that is still making progress is left alone.
+    assert jobs["remote"].status == "queued"
+
+
+def test_database_calls_run_off_the_event_loop(tmp_path):
+    db_path = str(tmp_path / "app.db")
+    migrate(db_path)
+    threads = []
+
+    async def run():
+        queue = ExportQueue(db_path, str(tmp_path / "exports"), workers=1)
+        await queue.start()
+        insert, load = queue._insert, queue._load
+        queue._insert = lambda job: threads.append(threading.current_thread().name) or insert(job)
+        queue._load = lambda job_id: threads.append(threading.current_thread().name) or load(job_id)
+        try:
+            job = await queue.submit("mnda", {}, "docx")
+            await queue.get(job.id)
+        finally:
+            await queue.stop()
+
+    asyncio.run(run())
+    assert threads == ["export-db_0", "export-db_0"]
@@ -0,0 +1,68 @@
+from extractor import extract_fields, field_kinds, reconcile
+
+
+def turn(question: str, answer: str) -> list[dict]:
+    return [{"role": "assistant", "content": question}, {"role": "user", "content": answer}]
+
+
+def test_field_kinds_come_from_prompt_descriptions():
+    kinds = field_kinds("mnda")
+    assert kinds["effectiveDate"] == "ISO format YYYY-MM-DD"
+    assert kinds["governingLaw"] == "US state"
+    assert kinds["mndaTermYears"] == "Number of years"
+    assert "purpose" not in kinds
+    assert field_kinds("dpa") == {"governingMemberState": "EU member state"}
+
+
+def test_dates_are_normalized_to_iso():
+    for answer in ("2026-03-03", "March 3rd, 2026", "3 March 2026", "3/3/2026"):
+        assert extract_fields(turn("When does it start?", answer), {}, "csa") == {
+            "effectiveDate": "2026-03-03"
+        }
+    assert extract_fields(turn("When does it start?", "2026-02-30"), {}, "csa") == {}
+
+
+def test_state_names_are_canonicalized():
+    assert extract_fields(turn("Which state's law?", "new york please"), {}, "csa") == {
+        "governingLaw": "New York"
+    }
+    assert extract_fields(turn("Which state's law?", "Delaware or Texas?"), {}, "csa") == {}
+
+
+def test_ambiguous_fields_use_the_assistant_question():
+    assert extract_fields(turn("How long should the MNDA term last?", "3 years"), {}, "mnda") == {
+        "mndaTermYears": "3"
+    }
+    assert extract_fields(
+        turn("And how long does confidentiality last?", "five years"), {}, "mnda"
+    ) == {"confidentialityTermYears": "5"}
+    assert extract_fields(turn("How many years?", "3"), {}, "mnda") == {}
+    assert extract_fields(turn("How many years?", "3"), {"mndaTermYears": "2"}, "mnda") == {
+        "confidentialityTermYears": "3"
+    }
+
+
+def test_values_are_only_taken_when_the_question_asks_for_them():
+    assert extract_fields(turn("Who is party 1?", "Georgia Pacific LLC"), {}, "csa") == {}
+    assert extract_fields(turn("What is the provider's address?", "12 Washington St"), {}, "csa") == {}
+    assert extract_fields(turn("Who signs for the customer?", "Jane, since 2026-01-05"), {}, "csa") == {}
+    assert extract_fields(turn("Which state's law governs?", "Georgia"), {}, "csa") == {
+        "governingLaw": "Georgia"
+    }
+
+
+def test_filled_fields_and_non_user_turns_are_left_alone():
+    assert extract_fields(turn("Which state?", "Texas"), {"governingLaw": "Ohio"}, "csa") == {}
+    assert extract_fields([{"role": "assistant", "content": "Texas"}], {}, "csa") == {}
+    assert extract_fields(turn("Which state?", "Texas"), {}, "unknown") == {}
+
+
+def test_reconcile_lets_llm_override_and_reverts_unconfirmed_values():
+    speculative = {"governingLaw": "Texas", "effectiveDate": "2026-01-01"}
+    llm_fields = {"effectiveDate": "2026-01-02", "providerName": "Acme"}
+    assert reconcile(speculative, llm_fields, {"governingLaw": "Ohio"}) == {
+        "governingLaw": "Ohio",
+        "effectiveDate": "2026-01-02",
+        "providerName": "Acme",
+    }
+    assert reconcile(speculative, {}, {}) == {"governingLaw": "", "effectiveDate": ""}
@@ -0,0 +1,33 @@
+"""Tests for conversation history compaction."""
+from history import compact_history, estimate_tokens
+
+
+def turn(i: int, size: int = 40) -> dict:
+    return {"role": "user" if i % 2 == 0 else "assistant", "content": str(i) * size}
+
+
+def test_short_history_is_returned_unchanged():
+    messages = [turn(i) for i in range(4)]
+    assert compact_history(messages, token_budget=1000) is messages
+
+
+def test_history_is_capped_by_message_count():
+    messages = [turn(i) for i in range(10)]
+    compacted = compact_history(messages, token_budget=10_000, max_messages=4)
+    assert compacted[0]["role"] == "system"
+    assert compacted[0]["content"].startswith("6 earlier messages")
+    assert compacted[1:] == messages[-4:]
+
+
+def test_history_is_capped_by_token_budget():
+    messages = [turn(i, size=400) for i in range(10)]
+    budget = estimate_tokens("x" * 400) * 3
+    compacted = compact_history(messages, token_budget=budget)
+    assert compacted[1:] == messages[-3:]
+
+
+def test_latest_message_is_always_kept():
+    messages = [turn(0), turn(1, size=10_000)]
+    compacted = compact_history(messages, token_budget=10)
+    assert compacted[-1] == messages[-1]
+    assert len(compacted) == 2
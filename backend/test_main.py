@@ -1,33 +1,83 @@
 """Tests for the /api/chat and /api/preview endpoints with mocked AI."""
+import asyncio
 import json
+import os
+import sqlite3
 from unittest.mock import patch
 
 import pytest
 from fastapi.testclient import TestClient
 
 from ai import ChatResult
+from classifier import Classification
 from main import app
+from response_cache import chat_cache
+from sessions import SessionStore
 
 client = TestClient(app)
+WORKER = f'worker="{os.getpid()}"'
+
+
+@pytest.fixture(autouse=True)
+def clear_chat_cache():
+    chat_cache.clear()
 
 
 def make_ai_response(reply: str, **field_kwargs) -> ChatResult:
     return ChatResult(reply=reply, fields={k: v for k, v in field_kwargs.items() if v is not None})
 
 
+def stream_of(result: ChatResult):
+    """Build a stream_chat_completion stand-in that yields the reply word by word."""
+    async def stream(*args):
+        words = result.reply.split(" ")
+        for i, word in enumerate(words):
+            yield word if i == len(words) - 1 else word + " "
+        yield result
+    return stream
+
+
 def test_health():
     r = client.get("/api/health")
     assert r.status_code == 200
     assert r.json() == {"status": "ok"}
 
 
+def test_metrics_expose_request_and_stage_series():
+    client.post("/api/preview", json={"doc_type": "pilot", "fields": {"providerName": "Acme"}})
+    client.post("/api/preview", json={"doc_type": "pilot", "fields": {"providerName": "Acme"}})
+    r = client.get("/metrics")
+    assert r.status_code == 200
+    assert r.headers["content-type"].startswith("text/plain; version=0.0.4")
+    body = r.text
+    assert 'prelegal_http_requests_total{method="POST",route="/api/preview",status="200",' + WORKER + '}' in body
+    assert 'prelegal_stage_duration_seconds_count{stage="render",doc_type="pilot",' + WORKER + '}' in body
+    assert 'prelegal_stage_duration_seconds_count{stage="parse",doc_type="pilot",' + WORKER + '}' in body
+
+
+def test_metrics_label_unregistered_doc_types_as_other():
+    client.post("/api/preview", json={"doc_type": "made-up-type-123", "fields": {}})
+    body = client.get("/metrics").text
+    assert "made-up-type-123" not in body
+    assert 'prelegal_stage_duration_seconds_count{stage="parse",doc_type="other",' + WORKER + '}' in body
+
+
+def test_stats_reports_upstream_limiter():
+    r = client.get("/api/stats")
+    assert r.status_code == 200
+    upstream = r.json()["upstream"]
+    assert upstream["in_flight"] == 0
+    assert upstream["queue_depth"] == 0
+    assert upstream["limit"] > 0
+
+
 def test_chat_streams_text_and_fields():
     mock_result = make_ai_response(
         "Hello! What is the purpose of this NDA?",
         party1Company="Acme Corp",
         party2Company="Beta Inc",
     )
-    with patch("main.chat_completion", return_value=mock_result):
+    with patch("main.stream_chat_completion", side_effect=stream_of(mock_result)):
         r = client.post(
             "/api/chat",
             json={
@@ -59,7 +109,7 @@ def test_chat_streams_text_and_fields():
 
 def test_chat_no_fields_extracted():
     mock_result = make_ai_response("Sure, let's get started!")
-    with patch("main.chat_completion", return_value=mock_result):
+    with patch("main.stream_chat_completion", side_effect=stream_of(mock_result)):
         r = client.post(
             "/api/chat",
             json={"messages": [{"role": "user", "content": "hi"}], "fields": {}, "doc_type": "mnda"},
@@ -74,10 +124,39 @@ def test_chat_no_fields_extracted():
     assert fields_event["data"] == {}
 
 
+def test_chat_emits_speculative_fields_before_reply():
+    mock_result = make_ai_response("Noted, Delaware law.", governingLaw="Delaware")
+    messages = [
+        {"role": "assistant", "content": "Which state's law should govern?"},
+        {"role": "user", "content": "Delaware"},
+    ]
+    with patch("main.stream_chat_completion", side_effect=stream_of(mock_result)):
+        r = client.post("/api/chat", json={"messages": messages, "fields": {}, "doc_type": "mnda"})
+    events = [json.loads(line[6:]) for line in r.text.splitlines() if line.startswith("data: ")]
+
+    assert events[0] == {"type": "fields", "data": {"governingLaw": "Delaware"}, "speculative": True}
+    assert events[-2] == {"type": "fields", "data": {"governingLaw": "Delaware"}}
+
+
+def test_chat_reverts_speculative_fields_the_llm_did_not_confirm():
+    mock_result = make_ai_response("Which state, Texas or Ohio?")
+    messages = [
+        {"role": "assistant", "content": "Which state's law should govern?"},
+        {"role": "user", "content": "Probably Texas"},
+    ]
+    with patch("main.stream_chat_completion", side_effect=stream_of(mock_result)):
+        r = client.post("/api/chat", json={"messages": messages, "fields": {}, "doc_type": "mnda"})
+    events = [json.loads(line[6:]) for line in r.text.splitlines() if line.startswith("data: ")]
+    fields_events = [e for e in events if e["type"] == "fields"]
+
+    assert fields_events[0]["data"] == {"governingLaw": "Texas"}
+    assert fields_events[-1]["data"] == {"governingLaw": ""}
+
+
 def test_chat_passes_messages_fields_and_doc_type_to_ai():
     mock_result = make_ai_response("Got it.")
-    with patch("main.chat_completion") as mock_fn:
-        mock_fn.return_value = mock_result
+    with patch("main.stream_chat_completion") as mock_fn:
+        mock_fn.side_effect = stream_of(mock_result)
         client.post(
             "/api/chat",
             json={
@@ -93,16 +172,98 @@ def test_chat_passes_messages_fields_and_doc_type_to_ai():
     assert call_args[2] == "mnda"
 
 
-def test_unknown_doc_type_emits_doc_type_event():
-    mock_result = make_ai_response(
+def test_identical_chat_turn_is_served_from_cache():
+    mock_result = make_ai_response("What is the purpose?", purpose="Evaluation")
+    body = {"messages": [{"role": "user", "content": "Hi"}], "fields": {}, "doc_type": "mnda"}
+    with patch("main.stream_chat_completion", side_effect=stream_of(mock_result)) as mock_fn:
+        client.post("/api/chat", json=body)
+        body["messages"][0]["content"] = "  Hi "
+        body["fields"] = {"purpose": ""}
+        second = client.post("/api/chat", json=body)
+
+    assert mock_fn.call_count == 1
+    events = [json.loads(line[6:]) for line in second.text.splitlines() if line.startswith("data: ")]
+    assert "".join(e["delta"] for e in events if e["type"] == "text") == "What is the purpose?"
+    assert next(e for e in events if e["type"] == "fields")["data"] == {"purpose": "Evaluation"}
+
+
+def test_session_with_unregistered_doc_type_is_422(session_client):
+    r = session_client.post("/api/sessions", json={"doc_type": "made-up"})
+    assert r.status_code == 422
+    import main
+
+    conn = sqlite3.connect(main.DB_PATH)
+    assert conn.execute("SELECT COUNT(*) FROM sessions").fetchone()[0] == 0
+
+
+def test_session_chat_sends_only_new_message_and_persists_history(session_client, tmp_path):
+    session = session_client.post("/api/sessions", json={"doc_type": "mnda"}).json()
+    assert session["messages"] == [] and session["fields"] == {}
+
+    first = make_ai_response("What is the purpose?", party1Company="Acme")
+    second = make_ai_response("Got it.", purpose="Evaluation")
+    with patch("main.stream_chat_completion") as mock_fn:
+        mock_fn.side_effect = stream_of(first)
+        session_client.post("/api/chat", json={"session_id": session["id"], "message": "Hi"})
+        mock_fn.side_effect = stream_of(second)
+        session_client.post("/api/chat", json={"session_id": session["id"], "message": "Evaluation"})
+
+    messages, fields, doc_type = mock_fn.call_args[0]
+    assert messages == [
+        {"role": "user", "content": "Hi"},
+        {"role": "assistant", "content": "What is the purpose?"},
+        {"role": "user", "content": "Evaluation"},
+    ]
+    assert fields == {"party1Company": "Acme"}
+    assert doc_type == "mnda"
+
+    stored = session_client.get(f"/api/sessions/{session['id']}").json()
+    assert len(stored["messages"]) == 4
+    assert stored["fields"] == {"party1Company": "Acme", "purpose": "Evaluation"}
+
+    # A restart keeps the data: init_db no longer deletes the database.
+    import main
+    main.init_db()
+
+    async def reopen():
+        store = SessionStore(str(tmp_path / "prelegal.db"))
+        await store.start()
+        try:
+            return await store.get(session["id"])
+        finally:
+            await store.stop()
+
+    assert asyncio.run(reopen()).fields == stored["fields"]
+
+
+def test_session_chat_unknown_session_is_404(session_client):
+    r = session_client.post("/api/chat", json={"session_id": "missing", "message": "Hi"})
+    assert r.status_code == 404
+    assert session_client.get("/api/sessions/missing").status_code == 404
+
+
+def unsure(messages):
+    """Stand-in for the local classifier that always defers to the LLM."""
+    return Classification(None, {})
+
+
+def test_unknown_doc_type_chains_into_drafting():
+    classified = make_ai_response(
         "It sounds like you need a Cloud Service Agreement.",
         detectedDocType="csa",
     )
-    with patch("main.chat_completion", return_value=mock_result):
+    drafted = make_ai_response("Who is the provider?", customerName="Acme Corp")
+    calls = []
+
+    def fake_stream(messages, fields, doc_type):
+        calls.append(doc_type)
+        return stream_of(classified if doc_type == "unknown" else drafted)()
+
+    with patch("main.stream_chat_completion", side_effect=fake_stream), patch("main.classify", unsure):
         r = client.post(
             "/api/chat",
             json={
-                "messages": [{"role": "user", "content": "I need a SaaS contract"}],
+                "messages": [{"role": "user", "content": "Acme Corp needs a SaaS contract"}],
                 "fields": {},
                 "doc_type": "unknown",
             },
@@ -113,9 +274,99 @@ def test_unknown_doc_type_emits_doc_type_event():
         for line in r.text.splitlines()
         if line.startswith("data: ")
     ]
-    doc_type_events = [e for e in events if e["type"] == "doc_type"]
-    assert len(doc_type_events) == 1
-    assert doc_type_events[0]["data"] == "csa"
+    assert calls == ["unknown", "csa"]
+    types = [e["type"] for e in events]
+    assert types.count("doc_type") == 1
+    assert types.index("doc_type") < types.index("fields")
+    assert next(e for e in events if e["type"] == "doc_type")["data"] == "csa"
+    assert "".join(e["delta"] for e in events if e["type"] == "text") == (
+        "It sounds like you need a Cloud Service Agreement.\n\nWho is the provider?"
+    )
+    assert next(e for e in events if e["type"] == "fields")["data"] == {"customerName": "Acme Corp"}
+
+
+def test_confident_local_classification_skips_llm_classifier():
+    drafted = make_ai_response("What is the purpose of the NDA?")
+    with patch("main.stream_chat_completion", side_effect=stream_of(drafted)) as mock_fn:
+        r = client.post(
+            "/api/chat",
+            json={
+                "messages": [{"role": "user", "content": "We need an NDA before sharing our roadmap"}],
+                "doc_type": "unknown",
+            },
+        )
+    events = [json.loads(line[6:]) for line in r.text.splitlines() if line.startswith("data: ")]
+    assert [call.args[2] for call in mock_fn.call_args_list] == ["mnda"]
+    assert next(e for e in events if e["type"] == "doc_type")["data"] == "mnda"
+    assert "".join(e["delta"] for e in events if e["type"] == "text") == (
+        "It sounds like a Mutual Non-Disclosure Agreement is the right fit.\n\nWhat is the purpose of the NDA?"
+    )
+
+
+def test_unsupported_detected_doc_type_is_not_chained():
+    mock_result = make_ai_response("We don't support leases yet.", detectedDocType="lease")
+    with patch("main.stream_chat_completion", side_effect=stream_of(mock_result)) as mock_fn:
+        r = client.post(
+            "/api/chat",
+            json={"messages": [{"role": "user", "content": "A lease"}], "doc_type": "unknown"},
+        )
+    events = [json.loads(line[6:]) for line in r.text.splitlines() if line.startswith("data: ")]
+    assert mock_fn.call_count == 1
+    assert "doc_type" not in [e["type"] for e in events]
+
+
+def test_chained_session_switches_to_detected_doc_type(session_client):
+    classified = make_ai_response("You need a Pilot Agreement.", detectedDocType="pilot")
+    drafted = make_ai_response("When does the pilot start?", providerName="Acme")
+
+    def fake_stream(messages, fields, doc_type):
+        return stream_of(classified if doc_type == "unknown" else drafted)()
+
+    session_id = session_client.post("/api/sessions", json={"doc_type": "unknown"}).json()["id"]
+    with patch("main.stream_chat_completion", side_effect=fake_stream), patch("main.classify", unsure):
+        session_client.post("/api/chat", json={"session_id": session_id, "message": "A pilot"})
+
+    session = session_client.get(f"/api/sessions/{session_id}").json()
+    assert session["doc_type"] == "pilot"
+    assert session["fields"] == {"providerName": "Acme"}
+    assert session["messages"][-1]["content"] == (
+        "You need a Pilot Agreement.\n\nWhen does the pilot start?"
+    )
+
+
+def test_identical_concurrent_chats_share_one_upstream_call():
+    import httpx
+
+    async def run():
+        release = asyncio.Event()
+        calls = []
+
+        async def slow_stream(*args):
+            calls.append(args)
+            yield "Hello "
+            await release.wait()
+            yield "there"
+            yield make_ai_response("Hello there", purpose="Evaluation")
+
+        body = {"messages": [{"role": "user", "content": "Duplicate submit"}], "doc_type": "mnda"}
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as ac:
+            with patch("main.stream_chat_completion", side_effect=slow_stream):
+                first = asyncio.create_task(ac.post("/api/chat", json=body))
+                while not calls:
+                    await asyncio.sleep(0.01)
+                second = asyncio.create_task(ac.post("/api/chat", json=body))
+                await asyncio.sleep(0.05)
+                release.set()
+                responses = await asyncio.gather(first, second)
+        return calls, responses
+
+    calls, responses = asyncio.run(run())
+    assert len(calls) == 1
+    for r in responses:
+        events = [json.loads(line[6:]) for line in r.text.splitlines() if line.startswith("data: ")]
+        assert "".join(e["delta"] for e in events if e["type"] == "text") == "Hello there"
+        assert events[-1] == {"type": "done"}
 
 
 def test_preview_returns_html():
@@ -138,3 +389,132 @@ def test_preview_shows_placeholders_for_missing_fields():
     assert r.status_code == 200
     data = r.json()
     assert "<em>[providerName]</em>" in data["html"]
+
+
+def test_preview_of_missing_template_has_no_version():
+    data = client.post("/api/preview", json={"doc_type": "no-such-type", "fields": {}}).json()
+    assert "Template not available" in data["html"]
+    assert data["version"] is None
+
+
+def test_annotated_preview_wraps_slots_and_slots_endpoint_patches_them():
+    full = client.post(
+        "/api/preview",
+        json={"doc_type": "pilot", "fields": {"providerName": "Acme"}, "annotate": True},
+    ).json()
+    assert '<span data-field="providerName">Acme</span>' in full["html"]
+    assert '<span data-field="customerName"><em>[customerName]</em></span>' in full["html"]
+
+    r = client.post(
+        "/api/preview/slots",
+        json={"doc_type": "pilot", "fields": {"customerName": "Beta & Co", "providerName": "", "nope": "x"}},
+    )
+    assert r.status_code == 200
+    assert r.json() == {
+        "version": full["version"],
+        "slots": {"customerName": "Beta &amp; Co", "providerName": "<em>[providerName]</em>"},
+    }
+    assert client.post("/api/preview/slots", json={"doc_type": "nope", "fields": {}}).status_code == 404
+
+
+def test_preview_recompiles_template_when_file_changes(tmp_path, monkeypatch):
+    import os
+    import template_renderer
+
+    monkeypatch.setattr(template_renderer, "COVER_PAGES_DIR", tmp_path)
+    monkeypatch.setattr(template_renderer, "_compiled", {})
+    path = tmp_path / "custom.md"
+    path.write_text("**Provider:** {{providerName}}")
+
+    assert "Acme" in template_renderer.render_template("custom", {"providerName": "Acme"})
+    compiled = template_renderer._compiled["custom"]
+    template_renderer.render_template("custom", {})
+    assert template_renderer._compiled["custom"] is compiled
+
+    path.write_text("**Vendor:** {{providerName}}")
+    os.utime(path, ns=(compiled.mtime_ns + 1_000_000_000,) * 2)
+    html = template_renderer.render_template("custom", {"providerName": "Acme"})
+    assert "Vendor:" in html and "Provider:" not in html
+
+
+def test_preview_escapes_field_values():
+    r = client.post(
+        "/api/preview",
+        json={"doc_type": "pilot", "fields": {"providerName": "AT&T <Labs>"}},
+    )
+    assert "AT&amp;T &lt;Labs&gt;" in r.json()["html"]
+
+
+def test_agreement_renders_cover_page_and_standard_terms():
+    r = client.post(
+        "/api/agreement", json={"doc_type": "csa", "fields": {"providerName": "Acme Corp"}}
+    )
+    assert r.status_code == 200
+    html = r.json()["html"]
+    assert html.index("Acme Corp") < html.index('id="section-1"')
+    assert 'id="section-13"' in html
+
+
+def test_agreement_section_index_and_fetch_by_anchor():
+    r = client.get("/api/agreement/mnda/sections")
+    assert r.status_code == 200
+    sections = r.json()["sections"]
+    assert len(sections) == 11
+    assert sections[0] == {
+        "anchor": "section-1", "number": "1", "title": "Introduction", "subsections": [],
+    }
+
+    r = client.get("/api/agreement/csa/sections/section-2")
+    assert r.status_code == 200
+    data = r.json()
+    assert data["title"] == "Restrictions & Obligations"
+    assert data["subsections"] == ["Restrictions on Customer", "Suspension"]
+    assert data["html"].startswith('<section id="section-2">\n<ol start="2">')
+
+
+def test_every_section_title_comes_from_the_standard_terms():
+    from agreements import TEMPLATES_DIR, _TAGS, get_standard_terms
+    from docs import DOC_REGISTRY
+
+    for doc_type, config in DOC_REGISTRY.items():
+        if config.terms_file is None:
+            continue
+        source = _TAGS.sub("", (TEMPLATES_DIR / config.terms_file).read_text()).replace("**", "")
+        for section in get_standard_terms(doc_type).sections:
+            assert section.title and section.title in source, (doc_type, section.number, section.title)
+    titles = {s.number: s.title for s in get_standard_terms("software_license").sections}
+    assert titles["11"] == "Definitions"
+
+
+def test_agreement_unknown_doc_type_or_anchor_is_404():
+    assert client.post("/api/agreement", json={"doc_type": "unknown", "fields": {}}).status_code == 404
+    assert client.get("/api/agreement/nope/sections").status_code == 404
+    assert client.get("/api/agreement/csa/sections/section-99").status_code == 404
+
+
+def test_preview_batch_streams_ndjson_with_per_item_errors():
+    items = [{"doc_type": "pilot", "fields": {"providerName": f"Co {i}"}} for i in range(3)]
+    items.insert(1, {"doc_type": "nope", "fields": {}})
+    r = client.post("/api/preview/batch", json={"items": items})
+    assert r.status_code == 200
+    assert r.headers["content-type"].startswith("application/x-ndjson")
+    results = sorted((json.loads(line) for line in r.text.splitlines()), key=lambda x: x["index"])
+    assert [x["index"] for x in results] == [0, 1, 2, 3]
+    assert "Co 0" in results[0]["html"] and "Co 2" in results[3]["html"]
+    assert "error" in results[1] and "html" not in results[1]
+
+
+def test_preview_batch_uses_process_pool_for_large_batches(monkeypatch):
+    import batch
+
+    monkeypatch.setattr(batch, "POOL_THRESHOLD", 2)
+    monkeypatch.setattr(batch, "CHUNK_SIZE", 3)
+    monkeypatch.setattr(batch, "MAX_WORKERS", 2)
+    items = [{"doc_type": "csa", "fields": {"customerName": f"Customer {i}"}} for i in range(10)]
+    try:
+        r = client.post("/api/preview/batch", json={"items": items})
+    finally:
+        batch.shutdown()
+    results = {x["index"]: x for x in map(json.loads, r.text.splitlines())}
+    assert sorted(results) == list(range(10))
+    assert all(f"Customer {i}" in results[i]["html"] for i in range(10))
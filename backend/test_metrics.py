@@ -0,0 +1,42 @@
+import os
+
+from metrics import Counter, Histogram, Registry
+
+
+def test_counter_renders_labelled_samples():
+    registry = Registry()
+    hits = registry.register(Counter("hits_total", "Hits.", ("doc_type",)))
+    hits.inc(doc_type="mnda")
+    hits.inc(2, doc_type='a"b')
+    assert registry.render().splitlines() == [
+        "# HELP hits_total Hits.",
+        "# TYPE hits_total counter",
+        'hits_total{doc_type="a\\"b"} 2',
+        'hits_total{doc_type="mnda"} 1',
+    ]
+
+
+def test_histogram_buckets_are_cumulative():
+    latency = Histogram("latency_seconds", "Latency.", ("stage",), buckets=(0.1, 1.0))
+    for value in (0.05, 0.1, 0.5, 3.0):
+        latency.observe(value, stage="render")
+    assert latency.render()[2:] == [
+        'latency_seconds_bucket{stage="render",le="0.1"} 2',
+        'latency_seconds_bucket{stage="render",le="1.0"} 3',
+        'latency_seconds_bucket{stage="render",le="+Inf"} 4',
+        'latency_seconds_sum{stage="render"} 3.65',
+        'latency_seconds_count{stage="render"} 4',
+    ]
+    assert latency.count(stage="render") == 4
+
+
+def test_worker_label_keeps_processes_apart():
+    registry = Registry(worker_label=True)
+    registry.register(Counter("hits_total", "Hits.", ("doc_type",))).inc(doc_type="mnda")
+    latency = registry.register(Histogram("latency_seconds", "Latency.", buckets=(1.0,)))
+    latency.observe(0.5)
+    worker = f'worker="{os.getpid()}"'
+    lines = registry.render().splitlines()
+    assert f'hits_total{{doc_type="mnda",{worker}}} 1' in lines
+    assert f'latency_seconds_bucket{{{worker},le="1.0"}} 1' in lines
+    assert f"latency_seconds_count{{{worker}}} 1" in lines
@@ -0,0 +1,50 @@
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+
+from migrations import MIGRATIONS, migrate
+
+
+def tables(db_path) -> set[str]:
+    conn = sqlite3.connect(db_path)
+    try:
+        return {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    finally:
+        conn.close()
+
+
+def test_fresh_database_is_migrated_to_latest(tmp_path):
+    db_path = str(tmp_path / "app.db")
+    assert migrate(db_path) == len(MIGRATIONS)
+    assert {"users", "sessions", "session_messages"} <= tables(db_path)
+
+
+def test_unversioned_database_keeps_its_data(tmp_path):
+    db_path = str(tmp_path / "app.db")
+    conn = sqlite3.connect(db_path)
+    conn.execute("CREATE TABLE sessions (id TEXT PRIMARY KEY, doc_type TEXT NOT NULL, "
+                 "fields TEXT NOT NULL DEFAULT '{}', created_at TIMESTAMP, updated_at TIMESTAMP)")
+    conn.execute("INSERT INTO sessions (id, doc_type) VALUES ('s1', 'mnda')")
+    conn.commit()
+    conn.close()
+
+    migrate(db_path)
+    conn = sqlite3.connect(db_path)
+    assert conn.execute("SELECT doc_type FROM sessions WHERE id = 's1'").fetchone() == ("mnda",)
+    conn.close()
+
+
+def test_new_steps_apply_once(tmp_path):
+    db_path = str(tmp_path / "app.db")
+    steps = MIGRATIONS + (("CREATE TABLE extra (id INTEGER)",),)
+    migrate(db_path)
+    assert migrate(db_path, steps) == len(steps)
+    assert migrate(db_path, steps) == len(steps)
+    assert "extra" in tables(db_path)
+
+
+def test_concurrent_workers_migrate_without_conflict(tmp_path):
+    db_path = str(tmp_path / "app.db")
+    steps = MIGRATIONS + (("CREATE TABLE extra (id INTEGER)",),)
+    with ThreadPoolExecutor(8) as pool:
+        versions = list(pool.map(lambda _: migrate(db_path, steps), range(8)))
+    assert versions == [len(steps)] * 8
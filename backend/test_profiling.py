@@ -0,0 +1,75 @@
+import threading
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+
+import profiling
+from main import app
+from profiling import ProfilingMiddleware, Sampler
+
+
+def busy_loop(stop: threading.Event):
+    while not stop.is_set():
+        sum(range(1000))
+
+
+def test_sampler_records_other_threads_stacks():
+    stop = threading.Event()
+    worker = threading.Thread(target=busy_loop, args=(stop,), name="busy")
+    worker.start()
+    with Sampler(interval=0.001) as sampler:
+        time.sleep(0.05)
+    stop.set()
+    worker.join()
+
+    profile = sampler.speedscope("test")
+    busy = next(p for p in profile["profiles"] if p["name"] == "busy")
+    names = {profile["shared"]["frames"][i]["name"] for stack in busy["samples"] for i in stack}
+    assert "busy_loop" in names
+    assert len(busy["samples"]) == len(busy["weights"]) > 5
+
+
+def test_profiling_is_off_by_default():
+    assert not profiling.enabled()
+    assert ProfilingMiddleware not in [m.cls for m in app.user_middleware]
+
+
+@pytest.fixture
+def profiled(tmp_path, monkeypatch):
+    monkeypatch.setattr(profiling, "TOKEN", "secret")
+    monkeypatch.setattr(profiling, "PROFILE_DIR", tmp_path)
+    return TestClient(ProfilingMiddleware(app, directory=tmp_path)), tmp_path
+
+
+def test_header_profiles_request_and_profiles_can_be_fetched(profiled):
+    client, directory = profiled
+    body = {"doc_type": "pilot", "fields": {"providerName": "Acme"}}
+    r = client.post("/api/preview", json=body, headers={"X-Prelegal-Profile": "secret"})
+    assert r.status_code == 200
+    profile_id = r.headers["x-profile-id"]
+
+    listing = client.get("/api/profiles", headers={"X-Prelegal-Profile": "secret"}).json()["profiles"]
+    assert listing[0]["id"] == profile_id
+    assert listing[0]["request"].startswith("POST /api/preview 200")
+
+    profile = client.get(f"/api/profiles/{profile_id}", headers={"X-Prelegal-Profile": "secret"}).json()
+    assert profile["$schema"].startswith("https://www.speedscope.app")
+    assert profile["profiles"] and profile["shared"]["frames"]
+
+
+def test_requests_without_the_token_are_not_profiled_or_served(profiled):
+    client, directory = profiled
+    r = client.post("/api/preview", json={"doc_type": "pilot", "fields": {}}, headers={"X-Prelegal-Profile": "wrong"})
+    assert "x-profile-id" not in r.headers
+    assert not list(directory.iterdir())
+    assert client.get("/api/profiles").status_code == 404
+    assert client.get("/api/profiles/x", headers={"X-Prelegal-Profile": "wrong"}).status_code == 404
+    assert client.get("/api/profiles/missing", headers={"X-Prelegal-Profile": "secret"}).status_code == 404
+    assert profiling.profile_path("../secret", directory) is None
+
+
+def test_old_profiles_are_pruned(tmp_path):
+    for i in range(4):
+        profiling.save(f"2026010{i}-000000-x", {"name": str(i)}, tmp_path, keep=2)
+    assert [p["request"] for p in profiling.list_profiles(tmp_path)] == ["3", "2"]
@@ -0,0 +1,80 @@
+"""Tests for the LRU/TTL response cache and its SQLite tier."""
+import asyncio
+import threading
+from unittest.mock import patch
+
+from response_cache import ResponseCache, cache_key
+
+
+def test_cache_key_is_order_insensitive_for_dicts():
+    assert cache_key("mnda", {"a": 1, "b": 2}) == cache_key("mnda", {"b": 2, "a": 1})
+    assert cache_key("mnda", {"a": 1}) != cache_key("csa", {"a": 1})
+
+
+def test_lru_evicts_least_recently_used():
+    async def run():
+        cache = ResponseCache("t", max_entries=2, ttl_seconds=60)
+        await cache.set("a", 1)
+        await cache.set("b", 2)
+        assert await cache.get("a") == 1
+        await cache.set("c", 3)
+        assert await cache.get("b") is None
+        assert await cache.get("a") == 1 and await cache.get("c") == 3
+        assert cache.stats()["evictions"] == 1
+
+    asyncio.run(run())
+
+
+def test_entries_expire_after_ttl():
+    async def run():
+        cache = ResponseCache("t", max_entries=10, ttl_seconds=5)
+        with patch("response_cache.time.monotonic", return_value=100.0):
+            await cache.set("a", 1)
+        with patch("response_cache.time.monotonic", return_value=106.0):
+            assert await cache.get("a") is None
+        assert cache.stats()["misses"] == 1
+
+    asyncio.run(run())
+
+
+def test_persistent_tier_survives_a_new_instance(tmp_path):
+    db_path = str(tmp_path / "cache.db")
+
+    async def run():
+        await ResponseCache("chat", max_entries=10, ttl_seconds=60, db_path=db_path).set("k", {"reply": "hi"})
+
+        fresh = ResponseCache("chat", max_entries=10, ttl_seconds=60, db_path=db_path)
+        assert await fresh.get("k") == {"reply": "hi"}
+        assert await fresh.get("k") == {"reply": "hi"}
+        stats = fresh.stats()
+        assert stats["persistent_hits"] == 1 and stats["hits"] == 1
+        assert await ResponseCache("preview", 10, 60, db_path=db_path).get("k") is None
+
+    asyncio.run(run())
+
+
+def test_persistent_tier_runs_off_the_event_loop(tmp_path):
+    cache = ResponseCache("chat", max_entries=10, ttl_seconds=60, db_path=str(tmp_path / "cache.db"))
+    threads = []
+    original = cache._db_get
+
+    def recording_get(key):
+        threads.append(threading.current_thread().name)
+        return original(key)
+
+    cache._db_get = recording_get
+
+    async def run():
+        assert await cache.get("missing") is None
+
+    asyncio.run(run())
+    assert threads == ["chat-cache_0"]
+
+
+def test_zero_size_disables_cache():
+    async def run():
+        cache = ResponseCache("t", max_entries=0, ttl_seconds=60)
+        await cache.set("a", 1)
+        assert await cache.get("a") is None
+
+    asyncio.run(run())
@@ -0,0 +1,84 @@
+"""Tests for the SQLite session store."""
+import asyncio
+import sqlite3
+
+import main
+from sessions import SessionStore
+
+
+def run_with_store(tmp_path, body, **store_options):
+    db_path = str(tmp_path / "sessions.db")
+    main.DB_PATH, saved = db_path, main.DB_PATH
+    try:
+        main.init_db()
+    finally:
+        main.DB_PATH = saved
+
+    async def run():
+        store = SessionStore(db_path, **store_options)
+        await store.start()
+        try:
+            return await body(store)
+        finally:
+            await store.stop()
+
+    return asyncio.run(run()), db_path
+
+
+def test_database_uses_wal_mode(tmp_path):
+    async def body(store):
+        await store.create("mnda")
+
+    _, db_path = run_with_store(tmp_path, body)
+    assert sqlite3.connect(db_path).execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+
+
+def test_concurrent_appends_are_group_committed_in_order(tmp_path):
+    async def body(store):
+        session = await store.create("csa")
+        batches_before = store.batches
+        await asyncio.gather(*(
+            store.append(session.id, [{"role": "user", "content": f"m{i}"}], {"n": i}, "csa")
+            for i in range(20)
+        ))
+        return store, await store.get(session.id), batches_before
+
+    # No sweeper, so every write counted is one of the test's.
+    (store, session, batches_before), _ = run_with_store(tmp_path, body, ttl=0)
+    assert [m["content"] for m in session.messages] == [f"m{i}" for i in range(20)]
+    assert session.fields == {"n": 19}
+    assert store.batches - batches_before < 20
+    assert store.stats()["writes"] == 21
+
+
+def test_failed_write_only_fails_its_caller(tmp_path):
+    async def body(store):
+        session = await store.create("mnda")
+        good = store.append(session.id, [{"role": "user", "content": "ok"}], {}, "mnda")
+        bad = store._submit([("INSERT INTO no_such_table VALUES (1)", ())])
+        results = await asyncio.gather(good, bad, return_exceptions=True)
+        return results, await store.get(session.id)
+
+    (results, session), _ = run_with_store(tmp_path, body)
+    assert results[0] is None
+    assert isinstance(results[1], sqlite3.Error)
+    assert session.messages == [{"role": "user", "content": "ok"}]
+
+
+def test_idle_sessions_expire_with_their_messages(tmp_path):
+    async def body(store):
+        old = await store.create("mnda")
+        await store.append(old.id, [{"role": "user", "content": "Acme, 1 Main St"}], {}, "mnda")
+        fresh = await store.create("mnda")
+        await store._submit([(
+            "UPDATE sessions SET updated_at = datetime('now', '-2 hours') WHERE id = ?", (old.id,)
+        )])
+        assert await store.get(old.id) is None  # expired before any sweep
+        await store.expire()
+        return old, await store.get(fresh.id)
+
+    (old, fresh), db_path = run_with_store(tmp_path, body, ttl=3600)
+    assert fresh is not None
+    conn = sqlite3.connect(db_path)
+    assert conn.execute("SELECT COUNT(*) FROM sessions WHERE id = ?", (old.id,)).fetchone()[0] == 0
+    assert conn.execute("SELECT COUNT(*) FROM session_messages").fetchone()[0] == 0
@@ -0,0 +1,65 @@
+import asyncio
+
+import pytest
+
+from singleflight import FlightGroup
+
+
+async def numbers(gate: asyncio.Event, calls: list):
+    calls.append(1)
+    yield {"n": 1}
+    await gate.wait()
+    yield {"n": 2}
+
+
+def test_late_joiner_gets_replay_then_live_events():
+    async def run():
+        group, gate, calls, done = FlightGroup(), asyncio.Event(), [], []
+        leader = group.start("k", numbers(gate, calls), on_done=lambda: done.append(True))
+        first = leader.subscribe()
+        assert await anext(first) == {"n": 1}
+
+        joiner = group.get("k")
+        assert joiner is leader
+        gate.set()
+        received = [event async for event in joiner.subscribe()]
+        rest = [event async for event in first]
+        return received, rest, calls, done, group.stats()
+
+    received, rest, calls, done, stats = asyncio.run(run())
+    assert received == [{"n": 1}, {"n": 2}]
+    assert rest == [{"n": 2}]
+    assert calls == [1] and done == [True]
+    assert stats == {"in_flight": 0, "started": 1, "joined": 1}
+
+
+def test_errors_reach_every_subscriber():
+    async def failing():
+        yield {"n": 1}
+        raise RuntimeError("upstream failed")
+
+    async def run():
+        group = FlightGroup()
+        flight = group.start("k", failing())
+        results = []
+        for _ in range(2):
+            with pytest.raises(RuntimeError):
+                async for event in flight.subscribe():
+                    results.append(event)
+        return results, group.get("k")
+
+    results, leftover = asyncio.run(run())
+    assert results == [{"n": 1}, {"n": 1}]
+    assert leftover is None
+
+
+def test_flight_finishes_without_subscribers():
+    async def run():
+        group, gate, calls, done = FlightGroup(), asyncio.Event(), [], []
+        flight = group.start("k", numbers(gate, calls), on_done=lambda: done.append(True))
+        gate.set()
+        await flight.task
+        return flight.events, done
+
+    events, done = asyncio.run(run())
+    assert events == [{"n": 1}, {"n": 2}] and done == [True]
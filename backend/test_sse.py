@@ -0,0 +1,78 @@
+import asyncio
+import json
+
+import pytest
+
+import sse
+
+
+async def source(events, delay=0.0):
+    for event in events:
+        if delay:
+            await asyncio.sleep(delay)
+        yield event
+
+
+def collect(events, **kwargs) -> list[bytes]:
+    async def run():
+        return [frame async for frame in sse.stream(events, **kwargs)]
+    return asyncio.run(run())
+
+
+def parse(frames: list[bytes]) -> list[dict]:
+    return [
+        json.loads(line[6:])
+        for line in b"".join(frames).decode().split("\n\n")
+        if line.startswith("data: ")
+    ]
+
+
+def test_text_deltas_are_coalesced_after_the_first():
+    words = [{"type": "text", "delta": f"word{i} "} for i in range(200)]
+    frames = collect(source(words + [{"type": "done"}]), frame_bytes=4096, frame_interval=10)
+    events = parse(frames)
+
+    assert events[0] == {"type": "text", "delta": "word0 "}
+    assert "".join(e["delta"] for e in events if e["type"] == "text") == "".join(w["delta"] for w in words)
+    assert events[-1] == {"type": "done"}
+    assert len(frames) <= 3
+
+
+def test_byte_budget_splits_frames():
+    words = [{"type": "text", "delta": "x" * 10} for _ in range(50)]
+    events = parse(collect(source(words), frame_bytes=100, frame_interval=10))
+    assert [len(e["delta"]) for e in events] == [10] + [100] * 4 + [90]
+
+
+def test_pending_text_is_flushed_before_other_events():
+    events = [
+        {"type": "text", "delta": "a"},
+        {"type": "text", "delta": "b"},
+        {"type": "fields", "data": {"purpose": "x"}},
+    ]
+    assert parse(collect(source(events), frame_interval=10)) == [
+        {"type": "text", "delta": "a"},
+        {"type": "text", "delta": "b"},
+        {"type": "fields", "data": {"purpose": "x"}},
+    ]
+
+
+def test_time_budget_flushes_slow_deltas():
+    words = [{"type": "text", "delta": f"{i}"} for i in range(4)]
+    events = parse(collect(source(words, delay=0.03), frame_bytes=4096, frame_interval=0.01))
+    assert len(events) == 4
+
+
+def test_keepalive_comments_while_source_is_idle():
+    frames = collect(source([{"type": "done"}], delay=0.12), keepalive=0.05)
+    assert frames.count(sse.KEEPALIVE) >= 1
+    assert parse(frames) == [{"type": "done"}]
+
+
+def test_source_errors_propagate():
+    async def failing():
+        yield {"type": "text", "delta": "hi"}
+        raise RuntimeError("upstream failed")
+
+    with pytest.raises(RuntimeError):
+        collect(failing())
@@ -0,0 +1,71 @@
+import gzip
+
+import pytest
+from fastapi import FastAPI, Request
+from fastapi.testclient import TestClient
+
+from static_files import IMMUTABLE, REVALIDATE, StaticIndex
+
+CHUNK = "console.log('prelegal');\n" * 200
+
+
+@pytest.fixture
+def export_dir(tmp_path):
+    (tmp_path / "index.html").write_text("<html>home</html>")
+    (tmp_path / "about.html").write_text("<html>about</html>")
+    (tmp_path / "docs").mkdir()
+    (tmp_path / "docs" / "index.html").write_text("<html>docs</html>")
+    (tmp_path / "_next" / "static").mkdir(parents=True)
+    (tmp_path / "_next" / "static" / "chunk.js").write_text(CHUNK)
+    return tmp_path
+
+
+@pytest.fixture
+def client(export_dir):
+    index = StaticIndex.build(str(export_dir))
+    app = FastAPI()
+
+    @app.get("/{path:path}")
+    async def serve(path: str, request: Request):
+        return index.respond(path, request)
+
+    return TestClient(app)
+
+
+def test_routes_resolve_like_file_lookup(export_dir):
+    index = StaticIndex.build(str(export_dir))
+    assert index.lookup("").path.endswith("index.html")
+    assert index.lookup("about").path.endswith("about.html")
+    assert index.lookup("docs/").path.endswith("docs/index.html")
+    assert index.lookup("dashboard") is index.fallback
+    assert index.lookup("_next/static/missing.js") is None
+
+
+def test_compressed_variant_is_negotiated(client):
+    plain = client.get("/_next/static/chunk.js", headers={"Accept-Encoding": "identity"})
+    assert plain.headers.get("content-encoding") is None
+    assert plain.text == CHUNK
+
+    res = client.get("/_next/static/chunk.js", headers={"Accept-Encoding": "gzip"})
+    assert res.headers["content-encoding"] == "gzip"
+    assert res.headers["vary"] == "Accept-Encoding"
+    assert res.headers["etag"] != plain.headers["etag"]
+    assert res.text == CHUNK
+    assert int(res.headers["content-length"]) < len(gzip.compress(CHUNK.encode())) + 64
+
+
+def test_etag_revalidation_returns_304(client):
+    first = client.get("/about")
+    res = client.get("/about", headers={"If-None-Match": first.headers["etag"]})
+    assert res.status_code == 304
+    assert res.content == b""
+
+
+def test_cache_control_by_asset_kind(client):
+    assert client.get("/_next/static/chunk.js").headers["cache-control"] == IMMUTABLE
+    assert client.get("/about").headers["cache-control"] == REVALIDATE
+
+
+def test_missing_next_asset_is_404(client):
+    assert client.get("/_next/static/missing.js").status_code == 404
+    assert client.get("/unknown/page").text == "<html>home</html>"
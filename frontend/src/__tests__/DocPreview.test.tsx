@@ -62,3 +62,85 @@ describe("DocPreview", () => {
     );
   });
 });
+
+describe("DocPreview slot patching", () => {
+  it("fetches only changed slots after an annotated render", async () => {
+    mockFetch.mockResolvedValueOnce({
+      ok: true,
+      json: async () => ({
+        html: '<p>Provider: <span data-field="providerName"><em>[providerName]</em></span></p>',
+        version: "1",
+      }),
+    });
+    const { rerender } = render(<DocPreview docType="pilot" fields={{}} />);
+    jest.runAllTimers();
+    await waitFor(() => screen.getByText("[providerName]"));
+
+    mockFetch.mockResolvedValueOnce({
+      ok: true,
+      json: async () => ({ version: "1", slots: { providerName: "Acme Corp" } }),
+    });
+    rerender(<DocPreview docType="pilot" fields={{ providerName: "Acme Corp" }} />);
+    jest.runAllTimers();
+    await waitFor(() => screen.getByText("Acme Corp"));
+
+    const [url, opts] = mockFetch.mock.calls[1];
+    expect(url).toBe("/api/preview/slots");
+    expect(JSON.parse(opts.body).fields).toEqual({ providerName: "Acme Corp" });
+  });
+
+  it("falls back to a full render when the template version changed", async () => {
+    mockFetch.mockResolvedValueOnce({
+      ok: true,
+      json: async () => ({ html: "<p>old</p>", version: "1" }),
+    });
+    const { rerender } = render(<DocPreview docType="pilot" fields={{}} />);
+    jest.runAllTimers();
+    await waitFor(() => screen.getByText("old"));
+
+    mockFetch
+      .mockResolvedValueOnce({ ok: true, json: async () => ({ version: "2", slots: {} }) })
+      .mockResolvedValueOnce({ ok: true, json: async () => ({ html: "<p>new</p>", version: "2" }) });
+    rerender(<DocPreview docType="pilot" fields={{ providerName: "Acme" }} />);
+    jest.runAllTimers();
+    await waitFor(() => screen.getByText("new"));
+    expect(mockFetch.mock.calls[2][0]).toBe("/api/preview");
+  });
+
+  it("ignores a slot response that arrives after newer fields", async () => {
+    mockFetch.mockResolvedValueOnce({
+      ok: true,
+      json: async () => ({
+        html: '<p>Provider: <span data-field="providerName"><em>[providerName]</em></span></p>',
+        version: "1",
+      }),
+    });
+    const { rerender } = render(<DocPreview docType="pilot" fields={{}} />);
+    jest.runAllTimers();
+    await waitFor(() => screen.getByText("[providerName]"));
+
+    let resolveStale: (value: unknown) => void = () => {};
+    mockFetch.mockReturnValueOnce(new Promise((resolve) => (resolveStale = resolve)));
+    rerender(<DocPreview docType="pilot" fields={{ providerName: "Old Co" }} />);
+    jest.runAllTimers();
+    await waitFor(() => expect(mockFetch).toHaveBeenCalledTimes(2));
+
+    mockFetch.mockResolvedValueOnce({
+      ok: true,
+      json: async () => ({ version: "1", slots: { providerName: "New Co" } }),
+    });
+    rerender(<DocPreview docType="pilot" fields={{ providerName: "New Co" }} />);
+    jest.runAllTimers();
+    await waitFor(() => screen.getByText("New Co"));
+
+    resolveStale({
+      ok: true,
+      json: async () => ({ version: "1", slots: { providerName: "Old Co" } }),
+    });
+    await Promise.resolve();
+    await Promise.resolve();
+    expect(screen.queryByText("Old Co")).toBeNull();
+    expect(screen.getByText("New Co")).toBeTruthy();
+    expect(mockFetch.mock.calls[1][1].signal.aborted).toBe(true);
+  });
+});
@@ -84,7 +84,6 @@ function DashboardContent() {
         <div className="w-1/2 flex flex-col border-r border-gray-200 bg-gray-50">
           <ChatPanel
             docType={activeDocType}
-            fields={fields}
             onFieldsUpdate={handleFieldsUpdate}
             onDocTypeDetected={handleDocTypeDetected}
           />
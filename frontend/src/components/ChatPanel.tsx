@@ -10,7 +10,6 @@ interface Message {
 
 interface Props {
   docType: string;
-  fields: DocFields;
   onFieldsUpdate: (partial: DocFields) => void;
   onDocTypeDetected?: (docType: string) => void;
 }
@@ -29,11 +28,12 @@ function startMessage(docType: string): string {
   return "Hello, I need help drafting a legal document.";
 }
 
-export default function ChatPanel({ docType, fields, onFieldsUpdate, onDocTypeDetected }: Props) {
+export default function ChatPanel({ docType, onFieldsUpdate, onDocTypeDetected }: Props) {
   const [messages, setMessages] = useState<Message[]>([]);
   const [input, setInput] = useState("");
   const [loading, setLoading] = useState(false);
   const [started, setStarted] = useState(false);
+  const sessionId = useRef<string | null>(null);
   const bottomRef = useRef<HTMLDivElement>(null);
 
   useEffect(() => {
@@ -49,12 +49,25 @@ export default function ChatPanel({ docType, fields, onFieldsUpdate, onDocTypeDe
     setMessages((prev) => [...prev, assistantMsg]);
 
     try {
+      // The server keeps the history; only the new message is sent.
+      if (!sessionId.current) {
+        const created = await fetch("/api/sessions", {
+          method: "POST",
+          headers: { "Content-Type": "application/json" },
+          body: JSON.stringify({ doc_type: docType }),
+        });
+        if (!created.ok) {
+          throw new Error(`Request failed: ${created.status}`);
+        }
+        sessionId.current = (await created.json()).id;
+      }
+
       const response = await fetch("/api/chat", {
         method: "POST",
         headers: { "Content-Type": "application/json" },
         body: JSON.stringify({
-          messages: allMessages,
-          fields,
+          session_id: sessionId.current,
+          message: userText,
           doc_type: docType,
         }),
       });
@@ -1,6 +1,6 @@
 "use client";
 
-import { useEffect, useState } from "react";
+import { useEffect, useRef, useState } from "react";
 import { DocFields } from "@/lib/docTypes";
 
 interface Props {
@@ -8,29 +8,99 @@ interface Props {
   fields: DocFields;
 }
 
+interface Rendered {
+  docType: string;
+  fields: DocFields;
+  version?: string | null;
+}
+
+function changedFields(prev: DocFields, next: DocFields): DocFields {
+  const changed: DocFields = {};
+  for (const key of new Set([...Object.keys(prev), ...Object.keys(next)])) {
+    if ((prev[key] ?? "") !== (next[key] ?? "")) changed[key] = next[key] ?? "";
+  }
+  return changed;
+}
+
+// Patch only the changed slots of the annotated preview already on screen.
+// Returns false when a full render is needed instead, or when signal was
+// aborted because newer fields arrived; the DOM is then left untouched.
+async function patchSlots(
+  container: HTMLDivElement,
+  rendered: Rendered,
+  changed: DocFields,
+  signal: AbortSignal
+): Promise<boolean> {
+  try {
+    const res = await fetch("/api/preview/slots", {
+      method: "POST",
+      headers: { "Content-Type": "application/json" },
+      body: JSON.stringify({ doc_type: rendered.docType, fields: changed }),
+      signal,
+    });
+    if (!res.ok) return false;
+    const data = await res.json();
+    if (signal.aborted || data.version !== rendered.version) return false;
+    for (const [key, slotHtml] of Object.entries(data.slots as Record<string, string>)) {
+      container.querySelectorAll(`[data-field="${key}"]`).forEach((el) => {
+        el.innerHTML = slotHtml;
+      });
+    }
+    return true;
+  } catch {
+    return false;
+  }
+}
+
 export default function DocPreview({ docType, fields }: Props) {
   const [html, setHtml] = useState<string>("");
   const [loading, setLoading] = useState(true);
+  const containerRef = useRef<HTMLDivElement>(null);
+  const rendered = useRef<Rendered | null>(null);
 
   useEffect(() => {
+    // Aborted when docType or fields change again, so a slow response for
+    // older fields can never overwrite a newer one.
+    const controller = new AbortController();
+    const { signal } = controller;
     const timer = setTimeout(async () => {
+      const prev = rendered.current;
+      if (prev?.version && prev.docType === docType && containerRef.current) {
+        const changed = changedFields(prev.fields, fields);
+        if (Object.keys(changed).length === 0) return;
+        const patched = await patchSlots(containerRef.current, prev, changed, signal);
+        if (signal.aborted) return;
+        if (patched) {
+          rendered.current = { ...prev, fields };
+          return;
+        }
+      }
+
       setLoading(true);
       try {
         const res = await fetch("/api/preview", {
           method: "POST",
           headers: { "Content-Type": "application/json" },
-          body: JSON.stringify({ doc_type: docType, fields }),
+          body: JSON.stringify({ doc_type: docType, fields, annotate: true }),
+          signal,
         });
         if (!res.ok) throw new Error("Preview fetch failed");
         const data = await res.json();
+        if (signal.aborted) return;
         setHtml(data.html);
+        rendered.current = { docType, fields, version: data.version };
       } catch {
+        if (signal.aborted) return;
         setHtml("<p><em>Preview unavailable. Please try again.</em></p>");
+        rendered.current = null;
       } finally {
-        setLoading(false);
+        if (!signal.aborted) setLoading(false);
       }
     }, 300);
-    return () => clearTimeout(timer);
+    return () => {
+      clearTimeout(timer);
+      controller.abort();
+    };
   }, [docType, fields]);
 
   if (loading) {
@@ -47,6 +117,7 @@ export default function DocPreview({ docType, fields }: Props) {
 
   return (
     <div
+      ref={containerRef}
       className="doc-preview prose prose-sm max-w-none"
       dangerouslySetInnerHTML={{ __html: html }}
     />